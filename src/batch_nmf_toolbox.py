@@ -0,0 +1,278 @@
+"""
+@author: The KnowEnG dev team
+"""
+import time
+import numpy as np
+import numpy.linalg as LA
+import knpackage.toolbox as kn
+
+EPSILON = 1e-15
+
+
+def get_nmf_batch_size(run_parameters):
+    """ number of bootstrap samples factored together by one batched nmf.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "nmf_batch_size").
+
+    Returns:
+        batch_size: positive integer, 1 (no batching) by default.
+    """
+    if 'nmf_batch_size' in run_parameters:
+        return max(1, int(run_parameters['nmf_batch_size']))
+
+    return 1
+
+
+def perform_nmf_list(x_list, random_states, run_parameters, lap_dag=None, lap_val=None, return_iterations=False):
+    """ kn.perform_nmf (or kn.perform_net_nmf when the laplacian is given) of every matrix of x_list,
+        stacking the matrices of equal shape into one batched problem.
+
+    Args:
+        x_list: list of positive matrices (X) to be decomposed into W dot H.
+        random_states: np.random.RandomState to draw the W and H starting point of each matrix from.
+        run_parameters: parameters dictionary with keys "number_of_clusters", "nmf_max_iterations",
+            "nmf_max_invariance", "nmf_conv_check_freq", (net - "nmf_penalty_parameter").
+        lap_dag: (optional) laplacian matrix component, L = lap_dag - lap_val.
+        lap_val: (optional) laplacian matrix component, L = lap_dag - lap_val.
+        return_iterations: (optional) also return the number of iterations and the runtime of each matrix.
+
+    Returns:
+        h_list: list of nonnegative right factor matrices (H), in x_list order.
+        (iterations_list: number of multiplicative updates of each matrix, with return_iterations)
+        (runtimes_list: seconds until each matrix left its batched problem, with return_iterations)
+    """
+    shape_indices = {}
+    for index, x_matrix in enumerate(x_list):
+        shape_indices.setdefault(x_matrix.shape, []).append(index)
+
+    h_list = [None] * len(x_list)
+    iterations_list = [0] * len(x_list)
+    runtimes_list = [0.] * len(x_list)
+    for indices in shape_indices.values():
+        x_stack = np.array([x_list[index] for index in indices], dtype=np.float64)
+        w_stack = np.zeros((len(indices), x_stack.shape[1], run_parameters['number_of_clusters']))
+        h_stack = np.zeros((len(indices), run_parameters['number_of_clusters'], x_stack.shape[2]))
+        for position, index in enumerate(indices):
+            w_stack[position], h_stack[position] = get_initial_factors(
+                x_list[index], run_parameters['number_of_clusters'], random_states[index])
+
+        h_stack, iterations, runtimes = perform_nmf_batch(x_stack, w_stack, h_stack, run_parameters, lap_dag,
+                                                          lap_val)
+        for position, index in enumerate(indices):
+            h_list[index] = h_stack[position]
+            iterations_list[index] = int(iterations[position])
+            runtimes_list[index] = float(runtimes[position])
+
+    if return_iterations:
+        return h_list, iterations_list, runtimes_list
+
+    return h_list
+
+
+def get_initial_factors(x_matrix, number_of_clusters, random_state):
+    """ random W and H starting point, drawn as kn.perform_nmf and kn.perform_net_nmf draw it.
+
+    Args:
+        x_matrix: the positive matrix (X) to be decomposed into W dot H.
+        number_of_clusters: k.
+        random_state: np.random.RandomState to draw from.
+
+    Returns:
+        w_matrix: column normalized positive left factor matrix (W).
+        h_matrix: positive right factor matrix (H).
+    """
+    w_matrix = random_state.rand(x_matrix.shape[0], number_of_clusters)
+    w_matrix = np.maximum(w_matrix / np.maximum(sum(w_matrix), EPSILON), EPSILON)
+    h_matrix = random_state.rand(number_of_clusters, x_matrix.shape[1])
+
+    return w_matrix, h_matrix
+
+
+def perform_nmf_batch(x_stack, w_stack, h_stack, run_parameters, lap_dag=None, lap_val=None):
+    """ the multiplicative updates of kn.perform_nmf (kn.perform_net_nmf when the laplacian is given)
+        run on B same shaped problems at once with batched matrix products. Convergence is checked
+        per problem every "nmf_conv_check_freq" iterations and a problem whose cluster assignments
+        have not changed for "nmf_max_invariance" iterations is removed from the batch.
+
+    Args:
+        x_stack: B x genes x samples positive matrices (X).
+        w_stack: B x genes x k starting left factor matrices (W), updated in place.
+        h_stack: B x k x samples starting right factor matrices (H), updated in place.
+        run_parameters: parameters dictionary with keys "nmf_max_iterations", "nmf_max_invariance",
+            "nmf_conv_check_freq", (net - "nmf_penalty_parameter").
+        lap_dag: (optional) laplacian matrix component, L = lap_dag - lap_val.
+        lap_val: (optional) laplacian matrix component, L = lap_dag - lap_val.
+
+    Returns:
+        h_stack: B x k x samples nonnegative right factor matrices (H).
+        iterations: number of multiplicative updates of each problem.
+        runtimes: seconds from the start until each problem was removed from the batch (or the batch ended).
+    """
+    start_time = time.time()
+    nmf_conv_check_freq = run_parameters["nmf_conv_check_freq"]
+    nmf_max_invariance = run_parameters["nmf_max_invariance"]
+    if lap_val is not None:
+        nmf_penalty_parameter = float(run_parameters["nmf_penalty_parameter"])
+
+    h_clust_eq = np.argmax(h_stack, 1)
+    h_eq_count = np.zeros(h_stack.shape[0], dtype=int)
+    iterations = np.zeros(h_stack.shape[0], dtype=int)
+    runtimes = np.zeros(h_stack.shape[0])
+    active_set = np.arange(0, h_stack.shape[0])
+    x_active = x_stack
+    for itr in range(0, run_parameters["nmf_max_iterations"]):
+        if np.mod(itr, nmf_conv_check_freq) == 0:
+            h_clusters = np.argmax(h_stack[active_set], 1)
+            if itr > 0:
+                unchanged = (h_clust_eq[active_set] == h_clusters).all(1)
+                h_eq_count[active_set] = np.where(unchanged, h_eq_count[active_set] + nmf_conv_check_freq, 0)
+            h_clust_eq[active_set] = h_clusters
+            still_active = h_eq_count[active_set] < nmf_max_invariance
+            if not still_active.all():
+                iterations[active_set[~still_active]] = itr
+                runtimes[active_set[~still_active]] = time.time() - start_time
+                active_set = active_set[still_active]
+                x_active = x_stack[active_set]
+            if active_set.size == 0:
+                break
+
+        w_matrix = w_stack[active_set]
+        h_matrix = h_stack[active_set]
+        numerator = np.matmul(x_active, h_matrix.transpose(0, 2, 1))
+        denomerator = np.matmul(w_matrix, np.matmul(h_matrix, h_matrix.transpose(0, 2, 1)))
+        if lap_val is not None:
+            numerator += nmf_penalty_parameter * get_sparse_stack_product(lap_val, w_matrix)
+            denomerator += nmf_penalty_parameter * get_sparse_stack_product(lap_dag, w_matrix)
+        w_matrix = w_matrix * (np.maximum(numerator, EPSILON) / np.maximum(denomerator, EPSILON))
+        w_matrix = np.maximum(w_matrix / np.maximum(w_matrix.sum(1)[:, None, :], EPSILON), EPSILON)
+        w_stack[active_set] = w_matrix
+        h_stack[active_set] = update_h_coordinate_matrices(w_matrix, x_active)
+        iterations[active_set] = itr + 1
+
+    runtimes[active_set] = time.time() - start_time
+
+    return h_stack, iterations, runtimes
+
+
+def perform_nmf(x_matrix, run_parameters, lap_dag=None, lap_val=None):
+    """ kn.perform_nmf (kn.perform_net_nmf when the laplacian is given) with the same operations, so the
+        same H from the same np.random state, that also returns its number of multiplicative updates.
+
+    Args:
+        x_matrix: the positive matrix (X) to be decomposed into W dot H.
+        run_parameters: parameters dictionary with keys "number_of_clusters", "nmf_max_iterations",
+            "nmf_max_invariance", "nmf_conv_check_freq", (net - "nmf_penalty_parameter").
+        lap_dag: (optional) laplacian matrix component, L = lap_dag - lap_val.
+        lap_val: (optional) laplacian matrix component, L = lap_dag - lap_val.
+
+    Returns:
+        h_matrix: nonnegative right factor matrix (H).
+        iterations: number of multiplicative updates.
+    """
+    k = run_parameters["number_of_clusters"]
+    nmf_conv_check_freq = run_parameters["nmf_conv_check_freq"]
+    nmf_max_invariance = run_parameters["nmf_max_invariance"]
+    if lap_val is not None:
+        nmf_penalty_parameter = float(run_parameters["nmf_penalty_parameter"])
+    w_matrix = np.random.rand(x_matrix.shape[0], k)
+    w_matrix = np.maximum(w_matrix / np.maximum(sum(w_matrix), EPSILON), EPSILON)
+    h_matrix = np.random.rand(k, x_matrix.shape[1])
+    h_clust_eq = np.argmax(h_matrix, 0)
+    h_eq_count = 0
+    iterations = 0
+    for itr in range(0, run_parameters["nmf_max_iterations"]):
+        if np.mod(itr, nmf_conv_check_freq) == 0:
+            h_clusters = np.argmax(h_matrix, 0)
+            if (itr > 0) & (sum(h_clust_eq != h_clusters) == 0):
+                h_eq_count = h_eq_count + nmf_conv_check_freq
+            else:
+                h_eq_count = 0
+            h_clust_eq = h_clusters
+            if h_eq_count >= nmf_max_invariance:
+                break
+        if lap_val is None:
+            numerator = np.maximum(np.dot(x_matrix, h_matrix.T), EPSILON)
+            denomerator = np.maximum(np.dot(w_matrix, np.dot(h_matrix, h_matrix.T)), EPSILON)
+        else:
+            numerator = np.maximum(np.dot(x_matrix, h_matrix.T) + nmf_penalty_parameter * lap_val.dot(w_matrix),
+                                   EPSILON)
+            denomerator = np.maximum(np.dot(w_matrix, np.dot(h_matrix, h_matrix.T))
+                                     + nmf_penalty_parameter * lap_dag.dot(w_matrix), EPSILON)
+        w_matrix = w_matrix * (numerator / denomerator)
+        w_matrix = np.maximum(w_matrix / np.maximum(sum(w_matrix), EPSILON), EPSILON)
+        h_matrix = kn.update_h_coordinate_matrix(w_matrix, x_matrix)
+        iterations = itr + 1
+
+    return h_matrix, iterations
+
+
+def get_sparse_stack_product(sparse_mat, w_stack):
+    """ sparse_mat dot w for every w of the stack, computed as one sparse product.
+
+    Args:
+        sparse_mat: genes x genes sparse matrix.
+        w_stack: B x genes x k matrices.
+
+    Returns:
+        product_stack: B x genes x k matrices.
+    """
+    number_of_problems, number_of_genes, number_of_clusters = w_stack.shape
+    w_wide = w_stack.transpose(1, 0, 2).reshape(number_of_genes, number_of_problems * number_of_clusters)
+    product_wide = np.asarray(sparse_mat.dot(w_wide))
+
+    return product_wide.reshape(number_of_genes, number_of_problems, number_of_clusters).transpose(1, 0, 2)
+
+
+def update_h_coordinate_matrices(w_stack, x_stack):
+    """ kn.update_h_coordinate_matrix of every problem of the stack: the least squares H and each round
+        of the nonnegative active set refinement are solved for all problems at once.
+
+    Args:
+        w_stack: B x genes x k positive left factor matrices (W).
+        x_stack: B x genes x samples positive matrices (X).
+
+    Returns:
+        h_stack: B x k x samples nonnegative right factor matrices (H).
+    """
+    wtw = np.matmul(w_stack.transpose(0, 2, 1), w_stack)
+    wtx = np.matmul(w_stack.transpose(0, 2, 1), x_stack)
+    h_stack = np.matmul(LA.pinv(wtw), wtx)
+    h_stack[h_stack <= 0] = 0
+    for cluster in range(0, wtw.shape[1]):
+        problem_ix, col_ix = np.nonzero((h_stack == 0).any(1))
+        if problem_ix.size == 0:
+            break
+        h_stack[problem_ix, :, col_ix] = update_h_coordinate_active_set(
+            h_stack[problem_ix, :, col_ix] > 0, problem_ix, wtw, wtx[problem_ix, :, col_ix])
+        h_stack[h_stack <= 0] = 0
+
+    return h_stack
+
+
+def update_h_coordinate_active_set(h_pos, problem_ix, wtw, wtx_cols):
+    """ one round of the nonnegative active set refinement of kn.update_h_coordinate_matrix: each column
+        is solved again over its positive rows. The rows of a column pattern are kept by masking the
+        k x k system, so all (problem, pattern) systems are solved by one stacked pinv.
+
+    Args:
+        h_pos: columns x k positive entries of the H columns to refine.
+        problem_ix: columns, problem index of each column.
+        wtw: B x k x k matrices W'W.
+        wtx_cols: columns x k, W'X of each column.
+
+    Returns:
+        h_cols: columns x k refined H columns, zero outside their positive rows.
+    """
+    number_of_clusters = wtw.shape[1]
+    mcoding = np.dot(np.int_(h_pos), 2 ** np.arange(0, number_of_clusters))
+    pattern_keys, pattern_ix = np.unique(problem_ix * 2 ** number_of_clusters + mcoding, return_inverse=True)
+    pattern_mask = (pattern_keys[:, None] >> np.arange(0, number_of_clusters)) & 1
+    pattern_ix = pattern_ix.reshape(-1)
+
+    atmp = pattern_mask[:, :, None] * wtw[pattern_keys >> number_of_clusters] * pattern_mask[:, None, :]
+    atmp_t = atmp.transpose(0, 2, 1)
+    solver = np.matmul(LA.pinv(np.matmul(atmp_t, atmp)), atmp_t)
+    h_cols = np.matmul(solver[pattern_ix], (wtx_cols * h_pos)[:, :, None])[:, :, 0]
+
+    return h_cols * h_pos
@@ -0,0 +1,150 @@
+"""
+@author: The KnowEnG dev team
+"""
+import os
+import hashlib
+import numpy as np
+
+# run parameters that change the clustering a bootstrap seed produces
+CHECKPOINT_PARAMETERS = ['method', 'number_of_clusters', 'rows_sampling_fraction', 'cols_sampling_fraction',
+                         'nmf_conv_check_freq', 'nmf_max_iterations', 'nmf_max_invariance', 'nmf_penalty_parameter',
+                         'nmf_batch_size', 'rwr_max_iterations', 'rwr_convergence_tolerence',
+                         'rwr_restart_probability', 'rwr_solver', 'rwr_smoothing_cache', 'rwr_cache_row_sampling']
+
+
+def use_checkpoint(run_parameters):
+    """ True when the cc bootstraps are checkpointed to, and resumed from, "checkpoint_directory".
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "checkpoint_directory").
+
+    Returns:
+        True or False
+    """
+    return 'checkpoint_directory' in run_parameters and bool(run_parameters['checkpoint_directory'])
+
+
+def get_checkpoint_hash(run_parameters, input_file_names):
+    """ sha1 hex digest of the CHECKPOINT_PARAMETERS values and the input file contents.
+
+    Args:
+        run_parameters: parameter set dictionary.
+        input_file_names: full paths of the spreadsheet (and network) files.
+
+    Returns:
+        checkpoint_hash: hex digest string.
+    """
+    import data_cache_toolbox as dctbx
+
+    checkpoint_hash = hashlib.sha1()
+    for parameter_name in CHECKPOINT_PARAMETERS:
+        if parameter_name in run_parameters:
+            checkpoint_hash.update(('%s=%r\n' % (parameter_name, run_parameters[parameter_name])).encode())
+    for input_file_name in input_file_names:
+        checkpoint_hash.update(dctbx.get_file_hash(input_file_name).encode())
+
+    return checkpoint_hash.hexdigest()
+
+
+def update_checkpoint_directory(run_parameters, number_of_bootstraps, input_file_names):
+    """ find (or create) the checkpoint of this run and the bootstraps it is still missing.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "checkpoint_directory").
+        number_of_bootstraps: number of bootstraps of the run.
+        input_file_names: full paths of the spreadsheet (and network) files.
+
+    Returns:
+        run_parameters: with "checkpoint_run_directory" (checkpoint_{method}_{hash} in "checkpoint_directory")
+            and "checkpoint_samples" (the sample numbers without a checkpoint file) when checkpointing.
+    """
+    if not use_checkpoint(run_parameters):
+        return run_parameters
+
+    checkpoint_dir = os.path.join(run_parameters['checkpoint_directory'], 'checkpoint_%s_%s' % (
+        run_parameters['method'], get_checkpoint_hash(run_parameters, input_file_names)[0:16]))
+    os.makedirs(checkpoint_dir, mode=0o755, exist_ok=True)
+
+    run_parameters['checkpoint_run_directory'] = checkpoint_dir
+    run_parameters['checkpoint_samples'] = [sample for sample in range(0, number_of_bootstraps)
+                                            if not os.path.isfile(get_checkpoint_file_name(checkpoint_dir, sample))]
+
+    return run_parameters
+
+
+def get_checkpoint_file_name(checkpoint_dir, sample):
+    """ checkpoint file of one bootstrap.
+
+    Args:
+        checkpoint_dir: from update_checkpoint_directory.
+        sample: bootstrap sample number (seed).
+
+    Returns:
+        file_name: full path.
+    """
+    return os.path.join(checkpoint_dir, 'bootstrap_%d.npz' % (sample))
+
+
+def save_checkpoint(clustering, run_parameters, sample):
+    """ write the clustering of one bootstrap to the checkpoint of the run, if there is one.
+        The file is renamed into place, so a run killed while writing never leaves a partial checkpoint.
+
+    Args:
+        clustering: (cluster_id, sample_permutation), or a list of them, one per k of a sweep.
+        run_parameters: parameter set dictionary, (optional - "checkpoint_run_directory").
+        sample: bootstrap sample number (seed).
+    """
+    if 'checkpoint_run_directory' not in run_parameters:
+        return
+
+    if isinstance(clustering, list):
+        cluster_id = np.array([k_clustering[0] for k_clustering in clustering])
+        sample_permutation = clustering[0][1]
+    else:
+        cluster_id, sample_permutation = clustering
+
+    file_name = get_checkpoint_file_name(run_parameters['checkpoint_run_directory'], sample)
+    tmp_file_name = file_name + '.%d.tmp.npz' % (os.getpid())
+    np.savez(tmp_file_name, cluster_id=cluster_id, sample_permutation=sample_permutation)
+    os.replace(tmp_file_name, file_name)
+
+
+def load_checkpoint(checkpoint_dir, sample):
+    """ read the clustering of one bootstrap written by save_checkpoint.
+
+    Args:
+        checkpoint_dir: from update_checkpoint_directory.
+        sample: bootstrap sample number (seed).
+
+    Returns:
+        clustering: (cluster_id, sample_permutation), or a list of them, one per k of a sweep.
+    """
+    with np.load(get_checkpoint_file_name(checkpoint_dir, sample)) as npz_data:
+        cluster_id = npz_data['cluster_id']
+        sample_permutation = npz_data['sample_permutation']
+
+    if cluster_id.ndim == 2:
+        return [(k_cluster_id, sample_permutation) for k_cluster_id in cluster_id]
+
+    return cluster_id, sample_permutation
+
+
+def get_checkpoint_clusterings(run_parameters, number_of_bootstraps):
+    """ yield the checkpointed clusterings of the bootstraps that were complete when the run started
+        (all the checkpointed bootstraps after a distribute run).
+
+    Args:
+        run_parameters: parameter set dictionary with "checkpoint_run_directory", "checkpoint_samples".
+        number_of_bootstraps: number of bootstraps of the run.
+
+    Yields:
+        the clustering of each checkpointed bootstrap.
+    """
+    checkpoint_dir = run_parameters['checkpoint_run_directory']
+    missing_samples = set(run_parameters['checkpoint_samples'])
+    if run_parameters['processing_method'] == 'distribute':
+        missing_samples = set()
+
+    for sample in range(0, number_of_bootstraps):
+        if sample not in missing_samples and os.path.isfile(get_checkpoint_file_name(checkpoint_dir, sample)):
+            yield load_checkpoint(checkpoint_dir, sample)
@@ -2,11 +2,14 @@
 @author: The KnowEnG dev team
 """
 import os
+import multiprocessing
+from functools import partial
 from enum import Enum
 import pandas as pd
 import numpy as np
 from scipy import stats
 import knpackage.toolbox as kn
+import knpackage.distributed_computing_utils as dstutil
 
 
 class ColumnType(Enum):
@@ -89,23 +92,48 @@ def f_oneway(phenotype_df):
         phenotype_df: dataframe with two columns with clusters and phenotype trait values.
         ret: result of the phenotype dataframe.
     """
-    uniq_trait = np.unique(phenotype_df.values[:, 1].reshape(-1))
-    uniq_cluster = np.unique(phenotype_df.values[:, 0])
-    if len(uniq_cluster) == 1:
-        comment = 'The number of clusters is one'
-        return ['f_oneway', len(uniq_trait), phenotype_df.shape[0], np.nan, 1, 'FAIL', comment]
+    return f_oneway_batch(phenotype_df.values[:, 0], np.float64(phenotype_df.values[:, 1:2]))[0]
 
-    groups = []
-    uniq_cm_vals = sorted(set(phenotype_df.values[:, 0]))
 
-    phenotype_name = phenotype_df.columns.values[1]
-    for i in uniq_cm_vals:
-        groups.append(
-            phenotype_df.loc[phenotype_df['Cluster_ID'] == i, phenotype_name].values.tolist())
+def f_oneway_batch(cluster_ids, trait_mat):
+    """ Perform the f_oneway test of every trait at once: the clusters are factorized once and the
+    group counts and sums of all traits are products with the samples x clusters indicator matrix.
 
-    fval, pval = stats.f_oneway(*groups)
-    ret = ['f_oneway', len(uniq_trait), phenotype_df.shape[0], fval, pval, 'SUCCESS', np.nan]
-    return ret
+    Parameters:
+        cluster_ids: cluster of each sample.
+        trait_mat: samples x traits continuous values, nan where a sample has no value of the trait.
+    Returns:
+        ret_list: f_oneway result of each trait.
+    """
+    uniq_cluster, cluster_ix = np.unique(cluster_ids, return_inverse=True)
+    cluster_ix = cluster_ix.reshape(-1)
+    indicator_mat = np.float64(cluster_ix[:, None] == np.arange(0, uniq_cluster.size)[None, :])
+
+    valid_mat = ~np.isnan(trait_mat)
+    group_count = np.dot(indicator_mat.T, np.float64(valid_mat))
+    group_mean = np.dot(indicator_mat.T, np.where(valid_mat, trait_mat, 0)) / np.maximum(group_count, 1)
+    sample_count = group_count.sum(axis=0)
+    grand_mean = (group_count * group_mean).sum(axis=0) / np.maximum(sample_count, 1)
+    residual_mat = np.where(valid_mat, trait_mat - group_mean[cluster_ix], 0)
+
+    number_of_groups = (group_count > 0).sum(axis=0)
+    ss_between = (group_count * (group_mean - grand_mean) ** 2).sum(axis=0)
+    ss_within = (residual_mat ** 2).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fval = (ss_between / (number_of_groups - 1)) / (ss_within / (sample_count - number_of_groups))
+        pval = stats.f.sf(fval, number_of_groups - 1, sample_count - number_of_groups)
+    num_uniq_trait = pd.DataFrame(trait_mat).nunique(axis=0).values
+
+    ret_list = []
+    for trait in range(0, trait_mat.shape[1]):
+        if number_of_groups[trait] == 1:
+            comment = 'The number of clusters is one'
+            ret_list.append(['f_oneway', int(num_uniq_trait[trait]), int(sample_count[trait]), np.nan, 1, 'FAIL',
+                             comment])
+        else:
+            ret_list.append(['f_oneway', int(num_uniq_trait[trait]), int(sample_count[trait]), fval[trait], pval[trait],
+                             'SUCCESS', np.nan])
+    return ret_list
 
 
 def chisquare(phenotype_df):
@@ -115,24 +143,207 @@ def chisquare(phenotype_df):
         phenotype_df: dataframe with two columns with clusters and phenotype trait values.
         ret: result of the phenotype dataframe.
     """
-    uniq_category = np.unique(phenotype_df.values[:, 1])
-    uniq_cluster = np.unique(phenotype_df.values[:, 0])
-    num_clusters = len(uniq_cluster)
-    num_phenotype = len(uniq_category)
-    phenotype_name = phenotype_df.columns.values[1]
-    phenotype_val_dict = dict(zip(uniq_category, range(num_phenotype)))
-    cluster_dict = dict(zip(uniq_cluster, range(num_clusters)))
+    return chisquare_batch([phenotype_df])[0]
+
+
+def chisquare_batch(df_list):
+    """ Perform the chi-square test of every categorical trait at once: the clusters are factorized once,
+    the categories once as (trait, value) pairs, and the contingency tables of all traits are the
+    category columns of one clusters x categories table built by one offset bincount.
+
+    Parameters:
+        df_list: dataframes with two columns with clusters and phenotype trait values.
+    Returns:
+        ret_list: chi-square result of each dataframe.
+    """
+    if len(df_list) == 0:
+        return []
+
+    number_of_traits = len(df_list)
+    trait_ix = np.repeat(np.arange(0, number_of_traits), [phenotype_df.shape[0] for phenotype_df in df_list])
+    uniq_cluster, cluster_ix = np.unique(np.concatenate([phenotype_df.values[:, 0] for phenotype_df in df_list]),
+                                         return_inverse=True)
+    value_ix = pd.factorize(np.concatenate([phenotype_df.values[:, 1] for phenotype_df in df_list]))[0]
+    number_of_values = value_ix.max() + 1
+    uniq_category, category_ix = np.unique(trait_ix * number_of_values + value_ix, return_inverse=True)
+    category_trait = uniq_category // number_of_values
+    cluster_ix = cluster_ix.reshape(-1)
+    num_clusters = uniq_cluster.size
+    num_categories = uniq_category.size
+
+    cont_table = np.bincount(cluster_ix * num_categories + category_ix.reshape(-1),
+                             minlength=num_clusters * num_categories)
+    cont_table = np.float64(cont_table.reshape(num_clusters, num_categories))
+    cluster_count = np.bincount(trait_ix * num_clusters + cluster_ix, minlength=number_of_traits * num_clusters)
+    cluster_count = cluster_count.reshape(number_of_traits, num_clusters)
+    sample_count = np.bincount(trait_ix, minlength=number_of_traits)
+    num_phenotype = np.bincount(category_trait, minlength=number_of_traits)
+    dof = ((cluster_count > 0).sum(axis=1) - 1) * (num_phenotype - 1)
+
+    expected = cluster_count[category_trait].T * cont_table.sum(axis=0) / sample_count[category_trait]
+    abs_diff = np.abs(cont_table - expected)
+    abs_diff = np.where(dof[category_trait] == 1, abs_diff - np.minimum(0.5, abs_diff), abs_diff)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi_terms = np.where(expected > 0, abs_diff ** 2 / expected, 0)
+    chi = np.bincount(category_trait, weights=chi_terms.sum(axis=0), minlength=number_of_traits)
+    chi = np.where(dof > 0, chi, 0.)
+    pval = np.where(dof > 0, stats.chi2.sf(chi, np.maximum(dof, 1)), 1.)
+
+    ret_list = []
+    for trait in range(0, number_of_traits):
+        ret_list.append(['chisquare', int(num_phenotype[trait]), int(sample_count[trait]), chi[trait], pval[trait],
+                         'SUCCESS', np.nan])
+    return ret_list
+
+
+def get_number_of_permutations(run_parameters):
+    """ number of Cluster_ID permutations of the permutation test p-values.
+
+    Parameters:
+        run_parameters: parameter set dictionary, (optional - "number_of_permutations").
+    Returns:
+        number_of_permutations: 0 (no permutation test) by default.
+    """
+    if 'number_of_permutations' in run_parameters:
+        return max(0, int(run_parameters['number_of_permutations']))
+    return 0
+
+
+def get_permutation_block_size(run_parameters):
+    """ number of permutations evaluated together by one process pool task.
+
+    Parameters:
+        run_parameters: parameter set dictionary, (optional - "permutation_block_size").
+    Returns:
+        block_size: positive integer, 100 by default.
+    """
+    if 'permutation_block_size' in run_parameters:
+        return max(1, int(run_parameters['permutation_block_size']))
+    return 100
+
+
+def get_permutation_trait(phenotype_df, column_type):
+    """ codes of a two column clusters and trait dataframe for the permutation statistics.
+
+    Parameters:
+        phenotype_df: dataframe with two columns with clusters and phenotype trait values.
+        column_type: ColumnType of the trait.
+    Returns:
+        permutation_trait: (cluster codes, number of clusters, category codes or centered values,
+            number of categories or 0 for a continuous trait).
+    """
+    uniq_cluster, cluster_ix = np.unique(phenotype_df.values[:, 0], return_inverse=True)
+    if column_type == ColumnType.CATEGORICAL:
+        uniq_category, category_ix = np.unique(phenotype_df.values[:, 1], return_inverse=True)
+        return cluster_ix.reshape(-1), uniq_cluster.size, category_ix.reshape(-1), uniq_category.size
+
+    trait_values = np.float64(phenotype_df.values[:, 1])
+    return cluster_ix.reshape(-1), uniq_cluster.size, trait_values - trait_values.mean(), 0
+
+
+def get_permutation_statistics(permutation_trait, cluster_ix_mat):
+    """ test statistic of a trait for every row of cluster codes: the chi-square statistic of the
+    contingency tables, all built by one bincount, or for a continuous trait the between clusters
+    sum of squares (F is monotone in it since the cluster sizes do not change under permutation).
+
+    Parameters:
+        permutation_trait: from get_permutation_trait.
+        cluster_ix_mat: permutations x samples cluster codes.
+    Returns:
+        statistics: one statistic per permutation.
+    """
+    cluster_ix, num_clusters, trait_codes, num_categories = permutation_trait
+    number_of_permutations = cluster_ix_mat.shape[0]
+    table_ix = cluster_ix_mat + num_clusters * np.arange(0, number_of_permutations)[:, None]
+
+    if num_categories > 0:
+        cont_table = np.bincount((table_ix * num_categories + trait_codes[None, :]).reshape(-1),
+                                 minlength=number_of_permutations * num_clusters * num_categories)
+        cont_table = np.float64(cont_table.reshape(number_of_permutations, num_clusters, num_categories))
+        expected = cont_table.sum(axis=2)[:, :, None] * cont_table.sum(axis=1)[:, None, :] / trait_codes.size
+        with np.errstate(divide='ignore', invalid='ignore'):
+            chi_terms = np.where(expected > 0, (cont_table - expected) ** 2 / expected, 0)
+        return chi_terms.sum(axis=(1, 2))
+
+    group_count = np.bincount(table_ix.reshape(-1), minlength=number_of_permutations * num_clusters)
+    group_sum = np.bincount(table_ix.reshape(-1), weights=np.tile(trait_codes, number_of_permutations),
+                            minlength=number_of_permutations * num_clusters)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        group_terms = np.where(group_count > 0, group_sum ** 2 / group_count, 0)
+    return group_terms.reshape(number_of_permutations, num_clusters).sum(axis=1)
+
+
+def count_permutation_exceedances(permutation_traits, observed_statistics, block):
+    """ number of permutations of a block whose statistic reaches the observed one, for every trait.
+
+    Parameters:
+        permutation_traits: list of get_permutation_trait results.
+        observed_statistics: observed statistic of each trait.
+        block: (block seed, number of permutations in the block).
+    Returns:
+        exceedances: count per trait.
+    """
+    block_seed, block_size = block
+    random_state = np.random.RandomState(block_seed)
+    exceedances = np.zeros(len(permutation_traits), dtype=int)
+    for trait, permutation_trait in enumerate(permutation_traits):
+        cluster_ix = permutation_trait[0]
+        permutations = np.argsort(random_state.rand(block_size, cluster_ix.size), axis=1)
+        statistics = get_permutation_statistics(permutation_trait, cluster_ix[permutations])
+        tolerance = 1e-10 * max(1.0, abs(observed_statistics[trait]))
+        exceedances[trait] = (statistics >= observed_statistics[trait] - tolerance).sum()
+    return exceedances
 
-    cont_table = np.zeros((num_clusters, num_phenotype))
 
-    for sample in phenotype_df.index:
-        clus = cluster_dict[phenotype_df.loc[sample, 'Cluster_ID']]
-        trt = phenotype_val_dict[phenotype_df.loc[sample, phenotype_name]]  # pylint: disable=no-member
-        cont_table[clus, trt] += 1
+def get_permutation_pvals(output_dict, run_parameters):
+    """ permutation test p-values of every trait: Cluster_ID is shuffled within the samples of each
+    trait "number_of_permutations" times and the blocks of permutations are spread across a process pool.
 
-    chi, pval, dof, expected = stats.chi2_contingency(cont_table)
-    ret = ['chisquare', num_phenotype, phenotype_df.shape[0], chi, pval, 'SUCCESS', np.nan]
-    return ret
+    Parameters:
+        output_dict: from run_post_processing_phenotype_clustering_data.
+        run_parameters: parameter set dictionary, with "number_of_permutations", (optional -
+            "permutation_block_size", "parallelism").
+    Returns:
+        pval_dict: phenotype name to permutation p-value (nan with a single cluster).
+    """
+    number_of_permutations = get_number_of_permutations(run_parameters)
+    block_size = get_permutation_block_size(run_parameters)
+
+    phenotype_names = []
+    permutation_traits = []
+    for key, df_list in output_dict.items():
+        for item in df_list:
+            permutation_trait = get_permutation_trait(item, key)
+            if permutation_trait[1] > 1:
+                phenotype_names.append(item.columns.values[1])
+                permutation_traits.append(permutation_trait)
+
+    observed_statistics = [get_permutation_statistics(permutation_trait, permutation_trait[0][None, :])[0]
+                           for permutation_trait in permutation_traits]
+    blocks = [(block_seed, min(block_size, number_of_permutations - block_start)) for block_seed, block_start
+              in enumerate(range(0, number_of_permutations, block_size))]
+
+    if 'parallelism' in run_parameters:
+        parallelism = dstutil.determine_parallelism_locally(len(blocks), run_parameters['parallelism'])
+    else:
+        parallelism = dstutil.determine_parallelism_locally(len(blocks))
+    count_block = partial(count_permutation_exceedances, permutation_traits, observed_statistics)
+    if parallelism > 1:
+        pool = multiprocessing.Pool(processes=parallelism)
+        try:
+            block_exceedances = pool.map(count_block, blocks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        block_exceedances = [count_block(block) for block in blocks]
+
+    exceedances = np.sum(block_exceedances, axis=0) if len(blocks) > 0 else np.zeros(len(phenotype_names))
+    pval_dict = {phenotype_name: np.nan for key, df_list in output_dict.items()
+                 for phenotype_name in [item.columns.values[1] for item in df_list]}
+    for phenotype_name, exceedance in zip(phenotype_names, exceedances):
+        pval_dict[phenotype_name] = (exceedance + 1) / (number_of_permutations + 1)
+    return pval_dict
 
 
 def clustering_evaluation(run_parameters):
@@ -147,13 +358,19 @@ def clustering_evaluation(run_parameters):
 
     for key, df_list in output_dict.items():
         if key == ColumnType.CATEGORICAL:
-            for item in df_list:
-                phenotype_name = item.columns.values[1]
-                result_df[phenotype_name] = chisquare(item)
+            ret_list = chisquare_batch(df_list)
         else:
-            for item in df_list:
-                phenotype_name = item.columns.values[1]
-                result_df[phenotype_name] = f_oneway(item)
+            trait_df = pd.concat([item.iloc[:, 1] for item in df_list], axis=1)
+            cluster_ids = cluster_phenotype_df.loc[trait_df.index, 'Cluster_ID'].values
+            ret_list = f_oneway_batch(cluster_ids, np.float64(trait_df.values))
+        for item, ret in zip(df_list, ret_list):
+            phenotype_name = item.columns.values[1]
+            result_df[phenotype_name] = ret
+
+    if get_number_of_permutations(run_parameters) > 0:
+        pval_dict = get_permutation_pvals(output_dict, run_parameters)
+        result_df.loc['permutation_pval'] = [pval_dict[phenotype_name] for phenotype_name in result_df.columns]
+        fail_df.loc['permutation_pval'] = np.nan
 
     file_name = kn.create_timestamped_filename("clustering_evaluation_result", "tsv")
     file_path = os.path.join(run_parameters["results_directory"], file_name)
@@ -0,0 +1,812 @@
+"""
+@author: The KnowEnG dev team
+"""
+import os
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import scipy.sparse as spar
+from scipy.sparse.linalg import LinearOperator, eigsh
+from sklearn.metrics import silhouette_score
+import knpackage.toolbox as kn
+
+BLOCK_ELEMENTS = 2 ** 22
+TILED_CONSENSUS_DIRECTORY = 'tmp_consensus_matrix'
+
+
+def get_consensus_format(run_parameters):
+    """ get the consensus matrix representation name.
+        "dense": samples x samples float64 matrix (default).
+        "packed": upper triangle, diagonal included, float32 vector in row major order.
+        "knn": float32 CSR matrix that keeps the "consensus_neighbors" largest entries of each row.
+        "tiled": samples x samples float32 .npy file, memory-mapped, summed one row tile at a time.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "consensus_format").
+
+    Returns:
+        consensus_format: "dense", "packed" or "knn".
+    """
+    if 'consensus_format' not in run_parameters:
+        return 'dense'
+
+    consensus_format = run_parameters['consensus_format']
+    if consensus_format not in ('dense', 'packed', 'knn', 'tiled'):
+        raise ValueError('consensus_format contains bad value.')
+
+    return consensus_format
+
+
+def get_consensus_memory_budget(run_parameters):
+    """ memory available to form the consensus matrix.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "consensus_memory_budget" in megabytes).
+
+    Returns:
+        memory_budget: bytes, or None when there is no budget.
+    """
+    if 'consensus_memory_budget' in run_parameters:
+        return int(float(run_parameters['consensus_memory_budget']) * 2 ** 20)
+
+    return None
+
+
+def fits_memory_budget(number_of_samples, run_parameters):
+    """ True when the dense linkage, indicator and consensus float64 matrices fit the memory budget.
+
+    Args:
+        number_of_samples: number of spreadsheet columns.
+        run_parameters: parameter set dictionary, (optional - "consensus_memory_budget").
+
+    Returns:
+        True or False
+    """
+    memory_budget = get_consensus_memory_budget(run_parameters)
+
+    return memory_budget is None or 3 * 8 * number_of_samples ** 2 <= memory_budget
+
+
+def get_consensus_neighbors(run_parameters):
+    """ number of entries kept per row of a "knn" consensus matrix.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "consensus_neighbors").
+
+    Returns:
+        number_of_neighbors: positive integer, 30 by default.
+    """
+    if 'consensus_neighbors' in run_parameters:
+        return max(1, int(run_parameters['consensus_neighbors']))
+
+    return 30
+
+
+def is_packed(consensus_matrix):
+    """ True for a "packed" consensus matrix.
+
+    Args:
+        consensus_matrix: dense, packed or sparse consensus matrix.
+
+    Returns:
+        True or False
+    """
+    return not spar.issparse(consensus_matrix) and np.ndim(consensus_matrix) == 1
+
+
+def is_read_by_rows(consensus_matrix):
+    """ True for consensus matrices that are only read one row block at a time: packed and memory-mapped.
+
+    Args:
+        consensus_matrix: dense, packed or sparse consensus matrix.
+
+    Returns:
+        True or False
+    """
+    return is_packed(consensus_matrix) or isinstance(consensus_matrix, np.memmap)
+
+
+def get_number_of_samples(consensus_matrix):
+    """ number of rows of a dense, packed or sparse consensus matrix.
+
+    Args:
+        consensus_matrix: dense, packed or sparse consensus matrix.
+
+    Returns:
+        number_of_samples: number of rows (and columns).
+    """
+    if is_packed(consensus_matrix):
+        return int((np.sqrt(8 * consensus_matrix.size + 1) - 1) // 2)
+
+    return consensus_matrix.shape[0]
+
+
+def get_packed_offsets(number_of_samples):
+    """ position of the diagonal entry of each row in the packed upper triangle.
+
+    Args:
+        number_of_samples: number of rows (and columns).
+
+    Returns:
+        offsets: number_of_samples + 1 positions, the last one is the packed size.
+    """
+    rows = np.arange(0, number_of_samples + 1, dtype=np.int64)
+
+    return rows * number_of_samples - rows * (rows - 1) // 2
+
+
+def get_block_rows(number_of_samples):
+    """ number of rows of a row block of about BLOCK_ELEMENTS entries.
+
+    Args:
+        number_of_samples: row length.
+
+    Returns:
+        block_rows: positive integer.
+    """
+    return max(1, BLOCK_ELEMENTS // max(number_of_samples, 1))
+
+
+def get_count_dtype(number_of_bootstraps):
+    """ smallest unsigned integer type that holds a count of number_of_bootstraps.
+
+    Args:
+        number_of_bootstraps: largest count.
+
+    Returns:
+        count_dtype: numpy.uint16 or numpy.uint32.
+    """
+    if number_of_bootstraps <= np.iinfo(np.uint16).max:
+        return np.uint16
+
+    return np.uint32
+
+
+def get_clusterings_encoding(clusterings_batch, number_of_samples, dtype=np.float64):
+    """ one-hot encoding of a batch of clusterings.
+
+    Args:
+        clusterings_batch: list of (cluster_id, sample_permutation).
+        number_of_samples: number of spreadsheet columns.
+        dtype: encoding type.
+
+    Returns:
+        encode_mat: (sum of the clusters of each bootstrap) x samples cluster assignments.
+        sample_mat: bootstraps x samples sampled columns.
+    """
+    cluster_rows = [np.max(cluster_id) + 1 if cluster_id.size > 0 else 0 for cluster_id, perm in clusterings_batch]
+    encode_mat = np.zeros((sum(cluster_rows), number_of_samples), dtype=dtype)
+    sample_mat = np.zeros((len(clusterings_batch), number_of_samples), dtype=dtype)
+
+    row_0 = 0
+    for bootstrap, (cluster_id, sample_permutation) in enumerate(clusterings_batch):
+        encode_mat[row_0 + cluster_id, sample_permutation] = 1
+        sample_mat[bootstrap, sample_permutation] = 1
+        row_0 += cluster_rows[bootstrap]
+
+    return encode_mat, sample_mat
+
+
+def form_packed_consensus_matrix(clusterings, number_of_samples, number_of_bootstraps, batch_size=20):
+    """ consensus matrix in packed upper triangle form: the linkage and indicator counts are summed in
+        packed small integer vectors and their quotient is returned as float32.
+
+    Args:
+        clusterings: iterable of (cluster_id, sample_permutation), at most number_of_bootstraps of them.
+        number_of_samples: number of spreadsheet columns.
+        number_of_bootstraps: number of bootstraps, sets the count type.
+        batch_size: number of clusterings summed per matrix product.
+
+    Returns:
+        consensus_matrix: packed float32 consensus matrix.
+    """
+    offsets = get_packed_offsets(number_of_samples)
+    linkage_packed = np.zeros(offsets[-1], dtype=get_count_dtype(number_of_bootstraps))
+    indicator_packed = np.zeros(offsets[-1], dtype=linkage_packed.dtype)
+
+    clusterings_batch = []
+    for clustering in clusterings:
+        clusterings_batch.append(clustering)
+        if len(clusterings_batch) >= batch_size:
+            update_packed_linkage_batch(clusterings_batch, linkage_packed, indicator_packed, offsets)
+            clusterings_batch = []
+
+    if len(clusterings_batch) > 0:
+        update_packed_linkage_batch(clusterings_batch, linkage_packed, indicator_packed, offsets)
+
+    consensus_matrix = np.zeros(offsets[-1], dtype=np.float32)
+    for start in range(0, offsets[-1], BLOCK_ELEMENTS):
+        stop = min(start + BLOCK_ELEMENTS, offsets[-1])
+        consensus_matrix[start:stop] = linkage_packed[start:stop] / np.maximum(indicator_packed[start:stop], 1)
+
+    return consensus_matrix
+
+
+def update_packed_linkage_batch(clusterings_batch, linkage_packed, indicator_packed, offsets):
+    """ add a batch of clusterings to the packed linkage and indicator counts (in place), computing only
+        the upper triangle of the Z'.Z and S'.S products of update_linkage_matrix_batch.
+
+    Args:
+        clusterings_batch: list of (cluster_id, sample_permutation).
+        linkage_packed: packed linkage counts.
+        indicator_packed: packed indicator counts.
+        offsets: from get_packed_offsets.
+    """
+    number_of_samples = offsets.size - 1
+    encode_mat, sample_mat = get_clusterings_encoding(clusterings_batch, number_of_samples)
+
+    block_rows = get_block_rows(number_of_samples)
+    for row_start in range(0, number_of_samples, block_rows):
+        row_stop = min(row_start + block_rows, number_of_samples)
+        upper_mask = np.arange(row_start, number_of_samples)[None, :] >= np.arange(row_start, row_stop)[:, None]
+        packed_slice = slice(offsets[row_start], offsets[row_stop])
+        linkage_block = encode_mat[:, row_start:row_stop].T.dot(encode_mat[:, row_start:])
+        linkage_packed[packed_slice] += linkage_block[upper_mask].astype(linkage_packed.dtype)
+        indicator_block = sample_mat[:, row_start:row_stop].T.dot(sample_mat[:, row_start:])
+        indicator_packed[packed_slice] += indicator_block[upper_mask].astype(indicator_packed.dtype)
+
+
+def form_tiled_consensus_matrix(clusterings, number_of_samples, number_of_bootstraps, tiled_dir, memory_budget,
+                                batch_size=20):
+    """ out of core consensus matrix: the linkage and indicator counts are small integer memory-mapped
+        files, updated one row tile at a time for a buffer of clusterings, and the float32 consensus
+        matrix is written to a memory-mapped file one row tile at a time. About half of memory_budget
+        buffers clusterings and the other half holds the float64 sums of one row tile.
+
+    Args:
+        clusterings: iterable of (cluster_id, sample_permutation), at most number_of_bootstraps of them.
+        number_of_samples: number of spreadsheet columns.
+        number_of_bootstraps: number of bootstraps, sets the count type.
+        tiled_dir: directory of the memory-mapped files.
+        memory_budget: bytes.
+        batch_size: number of clusterings summed per matrix product.
+
+    Returns:
+        consensus_matrix: read-only memory-mapped float32 consensus matrix (tiled_dir/consensus_matrix.npy).
+    """
+    count_dtype = get_count_dtype(number_of_bootstraps)
+    matrix_shape = (number_of_samples, number_of_samples)
+    linkage_name = os.path.join(tiled_dir, 'linkage_counts.npy')
+    indicator_name = os.path.join(tiled_dir, 'indicator_counts.npy')
+    consensus_name = os.path.join(tiled_dir, 'consensus_matrix.npy')
+    linkage_counts = np.lib.format.open_memmap(linkage_name, mode='w+', dtype=count_dtype, shape=matrix_shape)
+    indicator_counts = np.lib.format.open_memmap(indicator_name, mode='w+', dtype=count_dtype, shape=matrix_shape)
+    tile_rows = max(1, min(number_of_samples, memory_budget // (32 * max(number_of_samples, 1))))
+
+    clusterings_buffer = []
+    buffer_bytes = 0
+    for cluster_id, sample_permutation in clusterings:
+        clusterings_buffer.append((cluster_id, sample_permutation))
+        buffer_bytes += cluster_id.nbytes + sample_permutation.nbytes
+        if buffer_bytes >= memory_budget // 2:
+            update_tiled_linkage(clusterings_buffer, linkage_counts, indicator_counts, tile_rows, batch_size)
+            clusterings_buffer = []
+            buffer_bytes = 0
+
+    if len(clusterings_buffer) > 0:
+        update_tiled_linkage(clusterings_buffer, linkage_counts, indicator_counts, tile_rows, batch_size)
+
+    consensus_matrix = np.lib.format.open_memmap(consensus_name, mode='w+', dtype=np.float32, shape=matrix_shape)
+    for row_start in range(0, number_of_samples, tile_rows):
+        row_stop = min(row_start + tile_rows, number_of_samples)
+        consensus_matrix[row_start:row_stop] = linkage_counts[row_start:row_stop] / np.maximum(
+            indicator_counts[row_start:row_stop], 1)
+    consensus_matrix.flush()
+
+    del consensus_matrix, linkage_counts, indicator_counts
+    os.remove(linkage_name)
+    os.remove(indicator_name)
+
+    return np.load(consensus_name, mmap_mode='r')
+
+
+def update_tiled_linkage(clusterings_buffer, linkage_counts, indicator_counts, tile_rows, batch_size=20):
+    """ add a buffer of clusterings to the linkage and indicator counts (in place), one row tile at a time,
+        so that each tile of the count files is read and written once per buffer.
+
+    Args:
+        clusterings_buffer: list of (cluster_id, sample_permutation).
+        linkage_counts: samples x samples linkage counts (memory-mapped).
+        indicator_counts: samples x samples indicator counts (memory-mapped).
+        tile_rows: number of rows of a tile.
+        batch_size: number of clusterings summed per matrix product.
+    """
+    number_of_samples = linkage_counts.shape[1]
+    for row_start in range(0, number_of_samples, tile_rows):
+        row_stop = min(row_start + tile_rows, number_of_samples)
+        linkage_tile = np.zeros((row_stop - row_start, number_of_samples))
+        indicator_tile = np.zeros((row_stop - row_start, number_of_samples))
+        for batch_start in range(0, len(clusterings_buffer), batch_size):
+            encode_mat, sample_mat = get_clusterings_encoding(
+                clusterings_buffer[batch_start:batch_start + batch_size], number_of_samples)
+            linkage_tile += encode_mat[:, row_start:row_stop].T.dot(encode_mat)
+            indicator_tile += sample_mat[:, row_start:row_stop].T.dot(sample_mat)
+        linkage_counts[row_start:row_stop] += linkage_tile.astype(linkage_counts.dtype)
+        indicator_counts[row_start:row_stop] += indicator_tile.astype(indicator_counts.dtype)
+
+
+@contextmanager
+def tiled_consensus_directory(run_parameters):
+    """ context of a run whose consensus matrix may be formed "tiled": sets the directory of the
+        memory-mapped files, and removes it on exit, also when the run fails.
+
+    Args:
+        run_parameters: parameter set dictionary with "run_directory".
+
+    Yields:
+        tiled_dir: run_parameters["tiled_consensus_directory"], created by form_consensus_matrix when needed.
+    """
+    tiled_dir = os.path.join(run_parameters['run_directory'], TILED_CONSENSUS_DIRECTORY + kn.get_timestamp())
+    run_parameters['tiled_consensus_directory'] = tiled_dir
+    try:
+        yield tiled_dir
+    finally:
+        if os.path.isdir(tiled_dir):
+            kn.remove_dir(tiled_dir)
+
+
+def remove_tiled_consensus_matrix(consensus_matrix):
+    """ delete the directory of a memory-mapped consensus matrix from form_tiled_consensus_matrix.
+
+    Args:
+        consensus_matrix: consensus matrix of any representation; only memory-mapped ones are removed.
+    """
+    if isinstance(consensus_matrix, np.memmap) and consensus_matrix.filename is not None:
+        kn.remove_dir(os.path.dirname(consensus_matrix.filename))
+
+
+def get_consensus_rows(consensus_matrix, row_start, row_stop):
+    """ dense rows of a dense, packed or sparse consensus matrix.
+
+    Args:
+        consensus_matrix: dense, packed or sparse consensus matrix.
+        row_start: first row.
+        row_stop: row after the last row.
+
+    Returns:
+        consensus_rows: (row_stop - row_start) x samples array.
+    """
+    if spar.issparse(consensus_matrix):
+        return consensus_matrix[row_start:row_stop].toarray()
+    if not is_packed(consensus_matrix):
+        return np.asarray(consensus_matrix[row_start:row_stop])
+
+    return get_consensus_rows_at(consensus_matrix, np.arange(row_start, row_stop))
+
+
+def get_consensus_rows_at(consensus_matrix, row_ix):
+    """ dense rows of a dense, packed or sparse consensus matrix at any row indices.
+
+    Args:
+        consensus_matrix: dense, packed or sparse consensus matrix.
+        row_ix: row indices.
+
+    Returns:
+        consensus_rows: row_ix.size x samples array.
+    """
+    if spar.issparse(consensus_matrix):
+        return consensus_matrix[row_ix].toarray()
+    if not is_packed(consensus_matrix):
+        return np.asarray(consensus_matrix[row_ix])
+
+    number_of_samples = get_number_of_samples(consensus_matrix)
+    offsets = get_packed_offsets(number_of_samples)
+    row_ix = np.asarray(row_ix)[:, None]
+    col_ix = np.arange(0, number_of_samples)[None, :]
+    low_ix = np.minimum(row_ix, col_ix)
+
+    return consensus_matrix[offsets[low_ix] + np.maximum(row_ix, col_ix) - low_ix]
+
+
+def get_knn_consensus_matrix(consensus_matrix, number_of_neighbors):
+    """ sparse consensus matrix that keeps the number_of_neighbors largest entries of each row.
+
+    Args:
+        consensus_matrix: dense or packed consensus matrix.
+        number_of_neighbors: entries kept per row.
+
+    Returns:
+        knn_matrix: float32 CSR matrix.
+    """
+    number_of_samples = get_number_of_samples(consensus_matrix)
+    number_of_neighbors = min(number_of_neighbors, number_of_samples)
+    block_rows = get_block_rows(number_of_samples)
+
+    data_list = []
+    indices_list = []
+    for row_start in range(0, number_of_samples, block_rows):
+        row_stop = min(row_start + block_rows, number_of_samples)
+        consensus_rows = get_consensus_rows(consensus_matrix, row_start, row_stop)
+        top_ix = np.argpartition(-consensus_rows, number_of_neighbors - 1, axis=1)[:, 0:number_of_neighbors]
+        top_ix.sort(axis=1)
+        data_list.append(consensus_rows[np.arange(0, row_stop - row_start)[:, None], top_ix].astype(np.float32))
+        indices_list.append(top_ix)
+
+    indptr = np.arange(0, number_of_samples + 1) * number_of_neighbors
+    knn_matrix = spar.csr_matrix((np.concatenate(data_list).ravel(), np.concatenate(indices_list).ravel(), indptr),
+                                 shape=(number_of_samples, number_of_samples))
+    knn_matrix.eliminate_zeros()
+
+    return knn_matrix
+
+
+def get_final_clustering_name(run_parameters):
+    """ get the name of the method that clusters the consensus matrix.
+        "kmeans" (default) clusters the consensus matrix rows with perform_kmeans,
+        "spectral" clusters the rows of a spectral embedding with kn.perform_kmeans.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "final_clustering").
+
+    Returns:
+        final_clustering: "kmeans" or "spectral".
+    """
+    if 'final_clustering' not in run_parameters:
+        return 'kmeans'
+
+    final_clustering = run_parameters['final_clustering']
+    if final_clustering not in ('kmeans', 'spectral'):
+        raise ValueError('final_clustering contains bad value.')
+
+    return final_clustering
+
+
+def perform_final_clustering(consensus_matrix, k, run_parameters):
+    """ cluster the samples of the consensus matrix with the "final_clustering" method.
+
+    Args:
+        consensus_matrix: dense, packed or sparse consensus matrix.
+        k: clusters estimate.
+        run_parameters: parameter set dictionary, (optional - "final_clustering", "embedding_dimension").
+
+    Returns:
+        labels: cluster assignment of each sample.
+    """
+    if get_final_clustering_name(run_parameters) == 'kmeans':
+        return perform_kmeans(consensus_matrix, k)
+
+    if 'embedding_dimension' in run_parameters:
+        embedding_dimension = int(run_parameters['embedding_dimension'])
+    else:
+        embedding_dimension = k
+
+    return kn.perform_kmeans(get_spectral_embedding(consensus_matrix, embedding_dimension), k)
+
+
+def get_spectral_embedding(consensus_matrix, embedding_dimension):
+    """ normalized spectral embedding of the consensus matrix as an affinity matrix A: the leading
+        eigenvectors of D^-1/2.A.D^-1/2 (D the row sums of A), found by Lanczos iterations that only
+        use products of A with a few vectors, each row scaled to unit length.
+
+    Args:
+        consensus_matrix: dense, packed or sparse consensus matrix (a sparse one is symmetrized).
+        embedding_dimension: number of eigenvectors.
+
+    Returns:
+        embedding: samples x embedding_dimension matrix.
+    """
+    number_of_samples = get_number_of_samples(consensus_matrix)
+    embedding_dimension = max(1, min(embedding_dimension, number_of_samples - 1))
+    degree = get_consensus_product(consensus_matrix, np.ones((number_of_samples, 1)))[:, 0]
+    degree_scale = 1 / np.sqrt(np.maximum(degree, np.finfo(np.float64).tiny))
+
+    def normalized_product(vectors):
+        vectors = np.asarray(vectors, dtype=np.float64).reshape(number_of_samples, -1)
+        return degree_scale[:, None] * get_consensus_product(consensus_matrix, degree_scale[:, None] * vectors)
+
+    normalized_operator = LinearOperator((number_of_samples, number_of_samples), matvec=normalized_product,
+                                         matmat=normalized_product, dtype=np.float64)
+    start_vector = np.random.RandomState(10).rand(number_of_samples)
+    eigen_values, embedding = eigsh(normalized_operator, k=embedding_dimension, which='LA', v0=start_vector)
+    embedding = embedding / np.maximum(np.sqrt((embedding ** 2).sum(1)), np.finfo(np.float64).tiny)[:, None]
+
+    return embedding
+
+
+def get_consensus_product(consensus_matrix, vectors):
+    """ consensus_matrix dot vectors, one row block at a time for packed and memory-mapped matrices.
+
+    Args:
+        consensus_matrix: dense, packed or sparse consensus matrix (a sparse one is symmetrized).
+        vectors: samples x m matrix.
+
+    Returns:
+        product: samples x m matrix.
+    """
+    if spar.issparse(consensus_matrix):
+        return 0.5 * (consensus_matrix.dot(vectors) + consensus_matrix.T.dot(vectors))
+    if not is_read_by_rows(consensus_matrix):
+        return consensus_matrix.dot(vectors)
+
+    number_of_samples = get_number_of_samples(consensus_matrix)
+    block_rows = get_block_rows(number_of_samples)
+    product = np.zeros((number_of_samples, vectors.shape[1]))
+    for row_start in range(0, number_of_samples, block_rows):
+        row_stop = min(row_start + block_rows, number_of_samples)
+        product[row_start:row_stop] = get_consensus_rows(consensus_matrix, row_start, row_stop).dot(vectors)
+
+    return product
+
+
+def perform_kmeans(consensus_matrix, k=3, random_state=10):
+    """ kn.perform_kmeans of the consensus matrix rows; packed and memory-mapped matrices are
+        clustered by perform_kmeans_by_rows, one row block at a time.
+
+    Args:
+        consensus_matrix: dense, packed or sparse consensus matrix.
+        k: clusters estimate.
+        random_state: random seed.
+
+    Returns:
+        labels: cluster assignment of each row.
+    """
+    if is_read_by_rows(consensus_matrix):
+        return perform_kmeans_by_rows(consensus_matrix, k, random_state)
+
+    return kn.perform_kmeans(consensus_matrix, k, random_state)
+
+
+def perform_kmeans_by_rows(consensus_matrix, k=3, random_state=10, max_iterations=300):
+    """ k-means++ seeded Lloyd k-means of the consensus matrix rows, reading one row block at a time.
+
+    Args:
+        consensus_matrix: dense, packed or sparse consensus matrix.
+        k: clusters estimate.
+        random_state: random seed.
+        max_iterations: largest number of Lloyd iterations.
+
+    Returns:
+        labels: cluster assignment of each row.
+    """
+    number_of_samples = get_number_of_samples(consensus_matrix)
+    block_rows = get_block_rows(number_of_samples)
+    random_generator = np.random.RandomState(random_state)
+
+    centers = np.zeros((k, number_of_samples))
+    first_row = random_generator.randint(number_of_samples)
+    centers[0] = get_consensus_rows(consensus_matrix, first_row, first_row + 1)[0]
+    closest_distance = np.full(number_of_samples, np.inf)
+    for center in range(1, k):
+        for row_start in range(0, number_of_samples, block_rows):
+            row_stop = min(row_start + block_rows, number_of_samples)
+            consensus_rows = get_consensus_rows(consensus_matrix, row_start, row_stop)
+            distance = ((consensus_rows - centers[center - 1]) ** 2).sum(1)
+            closest_distance[row_start:row_stop] = np.minimum(closest_distance[row_start:row_stop], distance)
+        if closest_distance.sum() > 0:
+            next_row = random_generator.choice(number_of_samples, p=closest_distance / closest_distance.sum())
+        else:
+            next_row = random_generator.randint(number_of_samples)
+        centers[center] = get_consensus_rows(consensus_matrix, next_row, next_row + 1)[0]
+
+    labels = np.full(number_of_samples, -1)
+    for iteration in range(0, max_iterations):
+        previous_labels = labels.copy()
+        center_sums = np.zeros(centers.shape)
+        center_norms = (centers ** 2).sum(1)
+        for row_start in range(0, number_of_samples, block_rows):
+            row_stop = min(row_start + block_rows, number_of_samples)
+            consensus_rows = get_consensus_rows(consensus_matrix, row_start, row_stop)
+            labels[row_start:row_stop] = np.argmin(center_norms[None, :] - 2 * consensus_rows.dot(centers.T), 1)
+            block_clusters = np.zeros((k, row_stop - row_start))
+            block_clusters[labels[row_start:row_stop], np.arange(0, row_stop - row_start)] = 1
+            center_sums += block_clusters.dot(consensus_rows)
+        center_counts = np.bincount(labels, minlength=k)
+        non_empty = center_counts > 0
+        centers[non_empty] = center_sums[non_empty] / center_counts[non_empty, None]
+        if np.array_equal(labels, previous_labels):
+            break
+
+    return labels
+
+
+def get_silhouette_distance_name(run_parameters):
+    """ get the name of the sample dissimilarity of the silhouette score.
+        "euclidean" (default) is the distance between consensus matrix rows,
+        "consensus" is 1 - consensus, read from the consensus matrix as a precomputed dissimilarity.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "silhouette_distance").
+
+    Returns:
+        silhouette_distance: "euclidean" or "consensus".
+    """
+    if 'silhouette_distance' not in run_parameters:
+        return 'euclidean'
+
+    silhouette_distance = run_parameters['silhouette_distance']
+    if silhouette_distance not in ('euclidean', 'consensus'):
+        raise ValueError('silhouette_distance contains bad value.')
+
+    return silhouette_distance
+
+
+def get_silhouette_sample_size(run_parameters, number_of_samples):
+    """ number of samples the silhouette score is estimated from.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "silhouette_sample_size").
+        number_of_samples: number of samples.
+
+    Returns:
+        sample_size: "silhouette_sample_size", or number_of_samples (all samples) by default.
+    """
+    if 'silhouette_sample_size' in run_parameters:
+        return min(number_of_samples, max(2, int(run_parameters['silhouette_sample_size'])))
+
+    return number_of_samples
+
+
+def get_silhouette_score(consensus_matrix, labels, run_parameters=None):
+    """ mean silhouette coefficient of all samples. The default euclidean distance of dense matrices is
+        sklearn silhouette_score; other cases use get_silhouette_samples.
+
+    Args:
+        consensus_matrix: dense, packed or sparse consensus matrix.
+        labels: cluster assignment of each row.
+        run_parameters: (optional) parameter set dictionary, (optional - "silhouette_distance").
+
+    Returns:
+        silhouette_average: mean silhouette coefficient of the rows.
+    """
+    if run_parameters is None:
+        run_parameters = {}
+    silhouette_distance = get_silhouette_distance_name(run_parameters)
+    if silhouette_distance == 'euclidean' and not is_read_by_rows(consensus_matrix):
+        return silhouette_score(consensus_matrix, labels)
+
+    row_ix = np.arange(0, get_number_of_samples(consensus_matrix))
+
+    return float(np.mean(get_silhouette_samples(consensus_matrix, labels, row_ix, silhouette_distance)))
+
+
+def get_silhouette_estimate(consensus_matrix, labels, run_parameters, random_state=10):
+    """ silhouette score estimated from a stratified sample of "silhouette_sample_size" samples: each
+        cluster is sampled in proportion to its size (at least two samples) and the cluster means are
+        weighted by the cluster sizes.
+
+    Args:
+        consensus_matrix: dense, packed or sparse consensus matrix.
+        labels: cluster assignment of each row.
+        run_parameters: parameter set dictionary with "silhouette_sample_size",
+            (optional - "silhouette_distance").
+        random_state: random seed of the sample.
+
+    Returns:
+        silhouette_average: estimated mean silhouette coefficient.
+        confidence_interval: (low, high) 95% confidence interval of the estimate.
+        sample_size: number of sampled samples.
+    """
+    number_of_samples = get_number_of_samples(consensus_matrix)
+    sample_size = get_silhouette_sample_size(run_parameters, number_of_samples)
+    random_generator = np.random.RandomState(random_state)
+
+    cluster_names, cluster_ix = np.unique(labels, return_inverse=True)
+    strata = []
+    for cluster in range(0, cluster_names.size):
+        cluster_rows = np.flatnonzero(cluster_ix == cluster)
+        stratum_size = min(cluster_rows.size, max(2, int(round(sample_size * cluster_rows.size / number_of_samples))))
+        strata.append(np.sort(random_generator.choice(cluster_rows, stratum_size, replace=False)))
+
+    row_ix = np.concatenate(strata)
+    silhouette_samples = get_silhouette_samples(consensus_matrix, labels, row_ix,
+                                                get_silhouette_distance_name(run_parameters))
+
+    silhouette_average = 0.0
+    estimate_variance = 0.0
+    stratum_start = 0
+    for cluster, stratum in enumerate(strata):
+        stratum_values = silhouette_samples[stratum_start:stratum_start + stratum.size]
+        stratum_start += stratum.size
+        cluster_size = np.sum(cluster_ix == cluster)
+        cluster_weight = cluster_size / number_of_samples
+        silhouette_average += cluster_weight * stratum_values.mean()
+        if stratum.size > 1:
+            estimate_variance += cluster_weight ** 2 * (1 - stratum.size / cluster_size) * \
+                stratum_values.var(ddof=1) / stratum.size
+
+    half_width = 1.96 * np.sqrt(estimate_variance)
+
+    return silhouette_average, (silhouette_average - half_width, silhouette_average + half_width), row_ix.size
+
+
+def get_silhouette_samples(consensus_matrix, labels, row_ix, silhouette_distance='euclidean'):
+    """ silhouette coefficients of the rows row_ix against all samples, computed one block of rows at a
+        time. With the "consensus" distance 1 - C, the sums of the distances of a block to each cluster
+        are (cluster size) - C[block].Z, with Z the one-hot labels; with the "euclidean" distance they
+        are summed over blocks of columns too.
+
+    Args:
+        consensus_matrix: dense, packed or sparse consensus matrix (a sparse one is symmetrized).
+        labels: cluster assignment of each row.
+        row_ix: rows to compute the coefficients of.
+        silhouette_distance: "euclidean" or "consensus".
+
+    Returns:
+        silhouette_samples: silhouette coefficient of each row of row_ix.
+    """
+    number_of_samples = get_number_of_samples(consensus_matrix)
+    block_rows = get_block_rows(number_of_samples)
+    cluster_names, cluster_ix = np.unique(labels, return_inverse=True)
+    cluster_mat = np.zeros((number_of_samples, cluster_names.size))
+    cluster_mat[np.arange(0, number_of_samples), cluster_ix] = 1
+    cluster_size = cluster_mat.sum(0)
+
+    if silhouette_distance == 'euclidean':
+        row_norms = np.zeros(number_of_samples)
+        for row_start in range(0, number_of_samples, block_rows):
+            row_stop = min(row_start + block_rows, number_of_samples)
+            consensus_rows = get_silhouette_rows(consensus_matrix, np.arange(row_start, row_stop))
+            row_norms[row_start:row_stop] = (consensus_rows ** 2).sum(1)
+
+    distance_sums = np.zeros((row_ix.size, cluster_names.size))
+    self_distance = np.zeros(row_ix.size)
+    for block_start in range(0, row_ix.size, block_rows):
+        block_stop = min(block_start + block_rows, row_ix.size)
+        block_ix = row_ix[block_start:block_stop]
+        consensus_rows = get_silhouette_rows(consensus_matrix, block_ix)
+        if silhouette_distance == 'consensus':
+            distance_sums[block_start:block_stop] = cluster_size[None, :] - consensus_rows.dot(cluster_mat)
+            self_distance[block_start:block_stop] = 1 - consensus_rows[np.arange(0, block_ix.size), block_ix]
+            continue
+        for col_start in range(0, number_of_samples, block_rows):
+            col_stop = min(col_start + block_rows, number_of_samples)
+            consensus_cols = get_silhouette_rows(consensus_matrix, np.arange(col_start, col_stop))
+            squared_distance = row_norms[block_ix, None] + row_norms[None, col_start:col_stop] \
+                - 2 * consensus_rows.dot(consensus_cols.T)
+            distance_sums[block_start:block_stop] += np.sqrt(np.maximum(squared_distance, 0)).dot(
+                cluster_mat[col_start:col_stop])
+        self_distance[block_start:block_stop] = np.sqrt(np.maximum(
+            2 * row_norms[block_ix] - 2 * (consensus_rows ** 2).sum(1), 0))
+
+    own_ix = cluster_ix[row_ix]
+    rows_range = np.arange(0, row_ix.size)
+    own_size = cluster_size[own_ix]
+    intra_distance = (distance_sums[rows_range, own_ix] - self_distance) / np.maximum(own_size - 1, 1)
+    inter_distance = distance_sums / cluster_size[None, :]
+    inter_distance[rows_range, own_ix] = np.inf
+    inter_distance = inter_distance.min(1)
+    silhouette_samples = (inter_distance - intra_distance) / np.maximum(np.maximum(inter_distance, intra_distance),
+                                                                        np.finfo(np.float64).tiny)
+    silhouette_samples[own_size == 1] = 0
+
+    return silhouette_samples
+
+
+def get_silhouette_rows(consensus_matrix, row_ix):
+    """ float64 consensus rows for the silhouette; sparse matrices are symmetrized.
+
+    Args:
+        consensus_matrix: dense, packed or sparse consensus matrix.
+        row_ix: row indices.
+
+    Returns:
+        consensus_rows: row_ix.size x samples array.
+    """
+    if spar.issparse(consensus_matrix):
+        return 0.5 * (consensus_matrix[row_ix].toarray() + consensus_matrix[:, row_ix].T.toarray())
+
+    return get_consensus_rows_at(consensus_matrix, row_ix).astype(np.float64)
+
+
+def save_consensus_matrix(consensus_matrix, sample_names, file_name):
+    """ write a dense, packed or sparse consensus matrix as a samples x samples tsv file; packed,
+        memory-mapped and sparse matrices are written one row block at a time.
+
+    Args:
+        consensus_matrix: dense, packed or sparse consensus matrix.
+        sample_names: data identifiers for row and column names.
+        file_name: full path of the output file.
+    """
+    if not spar.issparse(consensus_matrix) and not is_read_by_rows(consensus_matrix):
+        out_df = pd.DataFrame(data=consensus_matrix, columns=sample_names, index=sample_names)
+        out_df.to_csv(file_name, sep='\t')
+        return
+
+    number_of_samples = get_number_of_samples(consensus_matrix)
+    block_rows = get_block_rows(number_of_samples)
+    with open(file_name, 'w') as fh:
+        for row_start in range(0, number_of_samples, block_rows):
+            row_stop = min(row_start + block_rows, number_of_samples)
+            out_df = pd.DataFrame(data=get_consensus_rows(consensus_matrix, row_start, row_stop),
+                                  columns=sample_names, index=sample_names[row_start:row_stop])
+            out_df.to_csv(fh, sep='\t', header=(row_start == 0))
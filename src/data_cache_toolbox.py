@@ -0,0 +1,199 @@
+"""
+@author: The KnowEnG dev team
+"""
+import os
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+import knpackage.toolbox as kn
+
+import shared_matrix_toolbox as shmtbx
+
+
+def use_input_cache(run_parameters):
+    """ True when the parsed network and spreadsheet files are cached in binary form.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "input_cache").
+
+    Returns:
+        True or False
+    """
+    return 'input_cache' in run_parameters and bool(run_parameters['input_cache'])
+
+
+def get_file_hash(file_name, block_size=2 ** 20):
+    """ sha1 hex digest of the file contents.
+
+    Args:
+        file_name: full path of the file.
+        block_size: bytes read at a time.
+
+    Returns:
+        file_hash: hex digest string.
+    """
+    file_hash = hashlib.sha1()
+    with open(file_name, 'rb') as fh:
+        for block in iter(lambda: fh.read(block_size), b''):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
+
+
+def get_cache_name(source_full_path, cache_suffix, run_parameters):
+    """ cache directory name of a source file: {basename}_{content hash}.{cache_suffix}, stored in
+        run_parameters["input_cache_directory"] or next to the source file.
+
+    Args:
+        source_full_path: full path of the input file.
+        cache_suffix: kind of cache, e.g. 'network'.
+        run_parameters: parameter set dictionary, (optional - "input_cache_directory").
+
+    Returns:
+        cache_name: full path of the cache directory.
+    """
+    if 'input_cache_directory' in run_parameters:
+        cache_dir = run_parameters['input_cache_directory']
+    else:
+        cache_dir = os.path.dirname(os.path.abspath(source_full_path))
+    base_name = os.path.basename(source_full_path)
+
+    return os.path.join(cache_dir, '%s_%s.%s' % (base_name, get_file_hash(source_full_path)[0:16], cache_suffix))
+
+
+def write_cache_directory(cache_name, arrays_dict):
+    """ save arrays as .npy files of a new cache directory, replacing older caches of the same source.
+
+    Args:
+        cache_name: full path from get_cache_name.
+        arrays_dict: file name prefix to numpy array or sparse matrix.
+    """
+    tmp_name = cache_name + '.tmp%d' % (os.getpid())
+    os.makedirs(tmp_name, mode=0o755, exist_ok=True)
+    for array_name, array in arrays_dict.items():
+        shmtbx.share_matrix(array, tmp_name, array_name)
+
+    cache_dir, cache_file = os.path.split(cache_name)
+    source_prefix = cache_file[0:cache_file.rindex('_') + 1]
+    cache_suffix = cache_file[cache_file.rindex('.'):]
+    for old_file in os.listdir(cache_dir):
+        if old_file != cache_file and len(old_file) == len(cache_file) and \
+                old_file.startswith(source_prefix) and old_file.endswith(cache_suffix):
+            shutil.rmtree(os.path.join(cache_dir, old_file), ignore_errors=True)
+
+    try:
+        os.rename(tmp_name, cache_name)
+    except OSError:
+        shutil.rmtree(tmp_name, ignore_errors=True)
+
+
+def get_network_matrices(gg_network_name_full_path, run_parameters):
+    """ normalized network, its laplacian components and gene names of a 4 col edge file.
+        With "input_cache", they are loaded memory-mapped from a cache keyed on the edge file
+        contents, and the cache is rebuilt when the edge file changes.
+
+    Args:
+        gg_network_name_full_path: file path to gene gene network data.
+        run_parameters: parameter set dictionary.
+
+    Returns:
+        network_mat: normalized sparse network matrix.
+        lap_diag: laplacian matrix component, L = lap_diag - lap_pos.
+        lap_pos: laplacian matrix component, L = lap_diag - lap_pos.
+        unique_gene_names: sorted list of the network gene names.
+    """
+    if not use_input_cache(run_parameters):
+        return form_network_matrices(gg_network_name_full_path)
+
+    cache_name = get_cache_name(gg_network_name_full_path, 'network', run_parameters)
+    if not os.path.isdir(cache_name):
+        network_mat, lap_diag, lap_pos, unique_gene_names = form_network_matrices(gg_network_name_full_path)
+        write_cache_directory(cache_name, {'network_mat': network_mat, 'lap_diag': lap_diag, 'lap_pos': lap_pos,
+                                           'gene_names': np.array(unique_gene_names, dtype=str)})
+        return network_mat, lap_diag, lap_pos, unique_gene_names
+
+    unique_gene_names = np.load(os.path.join(cache_name, 'gene_names.npy')).tolist()
+    network_shape = (len(unique_gene_names), len(unique_gene_names))
+    network_mat = shmtbx.attach_shared_matrix(('csr', os.path.join(cache_name, 'network_mat'), network_shape))
+    lap_diag = shmtbx.attach_shared_matrix(('csr', os.path.join(cache_name, 'lap_diag'), network_shape))
+    lap_pos = shmtbx.attach_shared_matrix(('csr', os.path.join(cache_name, 'lap_pos'), network_shape))
+
+    return network_mat, lap_diag, lap_pos, unique_gene_names
+
+
+def form_network_matrices(gg_network_name_full_path):
+    """ parse and normalize a 4 col edge file and form its laplacian components.
+
+    Args:
+        gg_network_name_full_path: file path to gene gene network data.
+
+    Returns:
+        network_mat: normalized sparse network matrix.
+        lap_diag: laplacian matrix component, L = lap_diag - lap_pos.
+        lap_pos: laplacian matrix component, L = lap_diag - lap_pos.
+        unique_gene_names: sorted list of the network gene names.
+    """
+    network_mat, unique_gene_names = kn.get_sparse_network_matrix(gg_network_name_full_path)
+    network_mat = kn.normalize_sparse_mat_by_diagonal(network_mat)
+    lap_diag, lap_pos = kn.form_network_laplacian_matrix(network_mat)
+
+    return network_mat, lap_diag, lap_pos, unique_gene_names
+
+
+def get_spreadsheet_df(spreadsheet_name_full_path, run_parameters):
+    """ read the genes x samples spreadsheet into a dataframe. With "input_cache", the spreadsheet is
+        converted once to a column-major .npy file plus row name, column name and column dtype files,
+        keyed on the spreadsheet contents, and the dataframe is backed by the memory-mapped matrix.
+        The cached dataframe has the values, index and column dtypes of the parsed spreadsheet (a
+        spreadsheet with mixed column dtypes is copied back to them, so it is not memory-mapped).
+
+    Args:
+        spreadsheet_name_full_path: full path name of a tab separated values spreadsheet
+            with row and column names.
+        run_parameters: parameter set dictionary.
+
+    Returns:
+        spreadsheet_df: the spreadsheet dataframe.
+    """
+    if not use_input_cache(run_parameters):
+        return kn.get_spreadsheet_df(spreadsheet_name_full_path)
+
+    cache_name = get_cache_name(spreadsheet_name_full_path, 'spreadsheet', run_parameters)
+    if not os.path.isdir(cache_name):
+        spreadsheet_df = kn.get_spreadsheet_df(spreadsheet_name_full_path)
+        write_cache_directory(cache_name, {
+            'spreadsheet_mat': np.asfortranarray(spreadsheet_df.values),
+            'row_names': get_names_array(spreadsheet_df.index),
+            'col_names': get_names_array(spreadsheet_df.columns),
+            'col_dtypes': np.array([str(col_dtype) for col_dtype in spreadsheet_df.dtypes], dtype=str)})
+
+    spreadsheet_mat = np.load(os.path.join(cache_name, 'spreadsheet_mat.npy'), mmap_mode='r')
+    row_names = np.load(os.path.join(cache_name, 'row_names.npy'))
+    col_names = np.load(os.path.join(cache_name, 'col_names.npy'))
+    col_dtypes = np.load(os.path.join(cache_name, 'col_dtypes.npy'))
+
+    spreadsheet_df = pd.DataFrame(spreadsheet_mat, index=row_names, columns=col_names, copy=False)
+    if np.unique(col_dtypes).size > 1:
+        spreadsheet_df = pd.DataFrame({col_number: spreadsheet_df.iloc[:, col_number].astype(col_dtype)
+                                       for col_number, col_dtype in enumerate(col_dtypes)})
+        spreadsheet_df.columns = col_names
+
+    return spreadsheet_df
+
+
+def get_names_array(names):
+    """ dataframe index as a numpy array np.load reads without pickle: numeric names keep their dtype,
+        other names are stored as str.
+
+    Args:
+        names: dataframe index or columns.
+
+    Returns:
+        names_array: numpy array.
+    """
+    names_array = np.asarray(names)
+    if names_array.dtype.kind in 'biuf':
+        return names_array
+
+    return np.array(names_array, dtype=str)
@@ -0,0 +1,333 @@
+"""
+@author: The KnowEnG dev team
+"""
+import os
+import multiprocessing
+from contextlib import contextmanager
+import numpy as np
+
+import batch_nmf_toolbox as bnmftbx
+import consensus_matrix_toolbox as cmtbx
+import rwr_toolbox as rwrtbx
+import shared_matrix_toolbox as shmtbx
+
+BLAS_THREADS_VARIABLES = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS',
+                          'NUMEXPR_NUM_THREADS']
+
+# sampled spreadsheet elements (genes x samples, summed over an nmf batch) that keep one more BLAS thread busy
+BLAS_ELEMENTS_PER_THREAD = 2 ** 18
+
+# float64 genes x sampled columns copies a bootstrap holds at its peak: the sample and the nmf products,
+# and for net nmf also the rwr smoothing iterates and the quantile normalized copy
+WORKER_SAMPLE_COPIES = {'cc_nmf': 3, 'cc_net_nmf': 6}
+
+PLAN_KEYS = ['cores', 'jobs', 'processes', 'blas_threads', 'memory_budget', 'parent_bytes', 'worker_bytes',
+             'memory_processes']
+
+
+def get_number_of_cores():
+    """ number of cores this process may run on (the affinity mask when the platform has one).
+
+    Returns:
+        number_of_cores: positive integer.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return max(1, len(os.sched_getaffinity(0)))
+
+    return max(1, multiprocessing.cpu_count())
+
+
+def get_memory_budget(run_parameters):
+    """ memory the run may use: parent process and all workers.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "memory_budget" in megabytes).
+
+    Returns:
+        memory_budget: bytes, the physical memory by default (None when the platform does not tell).
+    """
+    if 'memory_budget' in run_parameters:
+        return int(float(run_parameters['memory_budget']) * 2 ** 20)
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def get_sampled_columns(run_parameters, number_of_samples):
+    """ number of spreadsheet columns of a bootstrap (the sampled out rows are zeroed, not dropped).
+
+    Args:
+        run_parameters: parameter set dictionary with "cols_sampling_fraction".
+        number_of_samples: spreadsheet columns.
+
+    Returns:
+        sampled_columns: positive integer.
+    """
+    return max(1, int(round(number_of_samples * float(run_parameters['cols_sampling_fraction']))))
+
+
+def get_network_bytes(number_of_genes, network_nnz):
+    """ size of the CSR network and its laplacian components (lap_pos has the network pattern,
+        lap_diag is diagonal).
+
+    Args:
+        number_of_genes: network rows.
+        network_nnz: stored network entries.
+
+    Returns:
+        network_bytes: integer.
+    """
+    return 2 * (12 * network_nnz + 4 * (number_of_genes + 1)) + 16 * number_of_genes
+
+
+def get_consensus_bytes(run_parameters, number_of_samples, number_of_bootstraps):
+    """ peak memory of the parent's consensus stage.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "consensus_format", "consensus_memory_budget",
+            "consensus_neighbors", "adaptive_bootstraps").
+        number_of_samples: spreadsheet columns.
+        number_of_bootstraps: number of bootstraps.
+
+    Returns:
+        consensus_bytes: integer.
+    """
+    consensus_format = cmtbx.get_consensus_format(run_parameters)
+    dense_bytes = 8 * number_of_samples ** 2
+    packed_elements = number_of_samples * (number_of_samples + 1) // 2
+    count_bytes = np.dtype(cmtbx.get_count_dtype(number_of_bootstraps)).itemsize
+
+    if consensus_format in ('packed', 'knn'):
+        consensus_bytes = packed_elements * (2 * count_bytes + 4)
+        if consensus_format == 'knn':
+            consensus_bytes += 12 * number_of_samples * cmtbx.get_consensus_neighbors(run_parameters)
+        return consensus_bytes
+
+    number_of_ks = 1
+    if isinstance(run_parameters['number_of_clusters'], list):
+        number_of_ks = len(run_parameters['number_of_clusters'])
+    consensus_bytes = (2 * number_of_ks + 1) * dense_bytes
+    if 'adaptive_bootstraps' in run_parameters and run_parameters['adaptive_bootstraps']:
+        consensus_bytes += dense_bytes
+
+    memory_budget = cmtbx.get_consensus_memory_budget(run_parameters)
+    if consensus_format == 'tiled' or not cmtbx.fits_memory_budget(number_of_samples, run_parameters):
+        consensus_bytes = min(consensus_bytes, memory_budget or consensus_bytes)
+
+    return consensus_bytes
+
+
+def get_memory_estimate(run_parameters, number_of_bootstraps, matrix_shape, network_nnz=None):
+    """ peak memory of the parent process and of each bootstrap worker.
+        The parent holds the input matrices (and the rwr smoothed cache) and forms the consensus matrix.
+        A worker holds a few genes x sampled columns copies and the nmf factors for each bootstrap of
+        its nmf batch, plus its own copy of the inputs when it is a process without shared memory.
+
+    Args:
+        run_parameters: parameter set dictionary with "method", "processing_method", "number_of_clusters",
+            "cols_sampling_fraction", (optional - "nmf_batch_size", "parallel_shared_memory",
+            "rwr_smoothing_cache", consensus parameters).
+        number_of_bootstraps: number of bootstraps.
+        matrix_shape: (genes, samples) of the spreadsheet.
+        network_nnz: (optional) stored entries of the network, cc_net_nmf.
+
+    Returns:
+        parent_bytes: integer.
+        worker_bytes: integer.
+    """
+    number_of_genes, number_of_samples = int(matrix_shape[0]), int(matrix_shape[1])
+    sampled_columns = get_sampled_columns(run_parameters, number_of_samples)
+    number_of_clusters = run_parameters['number_of_clusters']
+    if isinstance(number_of_clusters, list):
+        number_of_clusters = max(number_of_clusters)
+
+    input_bytes = 8 * number_of_genes * number_of_samples
+    if network_nnz is not None:
+        input_bytes += get_network_bytes(number_of_genes, network_nnz)
+    parent_bytes = input_bytes + get_consensus_bytes(run_parameters, number_of_samples, number_of_bootstraps)
+    if network_nnz is not None and run_parameters['processing_method'] != 'distribute' and \
+            rwrtbx.use_rwr_cache(run_parameters):
+        parent_bytes += 8 * number_of_genes * number_of_samples
+
+    sample_copies = WORKER_SAMPLE_COPIES.get(run_parameters['method'], WORKER_SAMPLE_COPIES['cc_net_nmf'])
+    bootstrap_bytes = 8 * (sample_copies * number_of_genes * sampled_columns +
+                           2 * (number_of_genes + sampled_columns) * number_of_clusters)
+    worker_bytes = bootstrap_bytes * bnmftbx.get_nmf_batch_size(run_parameters)
+    if run_parameters['processing_method'] in ('parallel', 'distribute') and \
+            not shmtbx.use_shared_memory(run_parameters):
+        worker_bytes += input_bytes
+
+    return parent_bytes, worker_bytes
+
+
+def get_parallelism_plan(run_parameters, number_of_bootstraps, matrix_shape, network_nnz=None):
+    """ split the cores between worker processes (or threads) and the BLAS threads of each worker.
+        Bootstraps are independent, so workers come first: one per bootstrap job, up to the cores, the
+        optional "parallelism" and the workers whose estimated memory fits the memory budget next to the
+        parent. The cores left over go to BLAS threads, but only as many as the sampled matrix keeps busy,
+        so workers x BLAS threads never exceeds the cores.
+
+    Args:
+        run_parameters: parameter set dictionary with "cols_sampling_fraction", (optional - "parallelism",
+            "nmf_batch_size", "memory_budget", see get_memory_estimate).
+        number_of_bootstraps: number of bootstraps to be run.
+        matrix_shape: (genes, samples) of the spreadsheet the bootstraps sample.
+        network_nnz: (optional) stored entries of the network, cc_net_nmf.
+
+    Returns:
+        parallelism_plan: dictionary with the PLAN_KEYS ("memory_budget" is 0 when unknown,
+            "memory_processes" is the number of workers that fit it).
+    """
+    number_of_cores = get_number_of_cores()
+    nmf_batch_size = bnmftbx.get_nmf_batch_size(run_parameters)
+    number_of_jobs = max(1, -(-int(number_of_bootstraps) // nmf_batch_size))
+
+    processes = min(number_of_cores, number_of_jobs)
+    if 'parallelism' in run_parameters and int(run_parameters['parallelism']) > 0:
+        processes = min(processes, int(run_parameters['parallelism']))
+
+    parent_bytes, worker_bytes = get_memory_estimate(run_parameters, number_of_bootstraps, matrix_shape,
+                                                     network_nnz)
+    memory_budget = get_memory_budget(run_parameters) or 0
+    memory_processes = processes
+    if memory_budget > 0:
+        memory_processes = max(0, (memory_budget - parent_bytes) // worker_bytes)
+        processes = max(1, min(processes, memory_processes))
+
+    sampled_elements = matrix_shape[0] * get_sampled_columns(run_parameters, matrix_shape[1]) * nmf_batch_size
+    useful_blas_threads = max(1, sampled_elements // BLAS_ELEMENTS_PER_THREAD)
+    blas_threads = max(1, min(number_of_cores // processes, useful_blas_threads))
+
+    return {'cores': number_of_cores, 'jobs': number_of_jobs, 'processes': processes, 'blas_threads': blas_threads,
+            'memory_budget': memory_budget, 'parent_bytes': parent_bytes, 'worker_bytes': worker_bytes,
+            'memory_processes': int(memory_processes)}
+
+
+def update_parallelism_plan(run_parameters, number_of_bootstraps, matrix_shape, network_nnz=None):
+    """ plan the local parallelism of a parallel or threads run (see get_parallelism_plan).
+
+    Args:
+        run_parameters: parameter set dictionary.
+        number_of_bootstraps: number of bootstraps to be run.
+        matrix_shape: (genes, samples) of the spreadsheet the bootstraps sample.
+        network_nnz: (optional) stored entries of the network, cc_net_nmf.
+
+    Returns:
+        run_parameters: with "parallelism_plan" when the processing_method is parallel or threads.
+    """
+    if run_parameters['processing_method'] in ('parallel', 'threads'):
+        run_parameters['parallelism_plan'] = get_parallelism_plan(run_parameters, number_of_bootstraps,
+                                                                  matrix_shape, network_nnz)
+
+    return run_parameters
+
+
+def is_dry_run(run_parameters):
+    """ True when a cc run only prints its parallelism plan and memory estimate.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "dry_run").
+
+    Returns:
+        True or False
+    """
+    return 'dry_run' in run_parameters and bool(run_parameters['dry_run'])
+
+
+def get_parallelism_plan_text(parallelism_plan, run_parameters):
+    """ readable parallelism plan and memory estimate of a run.
+
+    Args:
+        parallelism_plan: from get_parallelism_plan.
+        run_parameters: parameter set dictionary with "method" and "processing_method".
+
+    Returns:
+        plan_text: multi-line string.
+    """
+    megabyte = float(2 ** 20)
+    workers = parallelism_plan['processes']
+    if run_parameters['processing_method'] == 'serial':
+        workers = 1
+    peak_bytes = parallelism_plan['parent_bytes'] + workers * parallelism_plan['worker_bytes']
+
+    plan_lines = ['method: %s, processing_method: %s' % (run_parameters['method'], run_parameters['processing_method']),
+                  'cores: %d, bootstrap jobs: %d' % (parallelism_plan['cores'], parallelism_plan['jobs']),
+                  'workers: %d x BLAS threads: %d' % (workers, parallelism_plan['blas_threads']),
+                  'parent memory: %.1f MB' % (parallelism_plan['parent_bytes'] / megabyte),
+                  'memory per worker: %.1f MB' % (parallelism_plan['worker_bytes'] / megabyte),
+                  'peak memory: %.1f MB' % (peak_bytes / megabyte)]
+    if parallelism_plan['memory_budget'] > 0:
+        plan_lines.append('memory budget: %.1f MB (fits %d workers)' % (
+            parallelism_plan['memory_budget'] / megabyte, parallelism_plan['memory_processes']))
+        if peak_bytes > parallelism_plan['memory_budget']:
+            plan_lines.append('warning: the estimated peak memory exceeds the memory budget')
+
+    return '\n'.join(plan_lines)
+
+
+def get_blas_threads(run_parameters):
+    """ BLAS threads per worker of the parallelism plan.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "parallelism_plan").
+
+    Returns:
+        blas_threads: positive integer, or None when there is no plan (BLAS keeps its own default).
+    """
+    if 'parallelism_plan' in run_parameters:
+        return run_parameters['parallelism_plan']['blas_threads']
+
+    return None
+
+
+def set_blas_threads(blas_threads):
+    """ limit the BLAS and OpenMP thread pools of this process for good (worker process initializer).
+        The loaded libraries are limited with threadpoolctl when it is installed; the environment
+        variables cover libraries loaded later and the processes this one starts.
+
+    Args:
+        blas_threads: positive integer, or None to leave the defaults.
+    """
+    if blas_threads is None:
+        return
+
+    for variable_name in BLAS_THREADS_VARIABLES:
+        os.environ[variable_name] = str(blas_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(limits=blas_threads)
+
+
+@contextmanager
+def limit_blas_threads(blas_threads):
+    """ context with the BLAS and OpenMP thread pools of this process limited (worker threads).
+
+    Args:
+        blas_threads: positive integer, or None to leave the defaults.
+    """
+    if blas_threads is None:
+        yield
+        return
+
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        yield
+        return
+    with threadpool_limits(limits=blas_threads):
+        yield
+
+
+def save_parallelism_plan(parallelism_plan, file_name):
+    """ write the parallelism plan as a two column table.
+
+    Args:
+        parallelism_plan: from get_parallelism_plan.
+        file_name: full path of the output file.
+    """
+    with open(file_name, 'w') as fh:
+        for plan_key in PLAN_KEYS:
+            fh.write('%s\t%d\n' % (plan_key, parallelism_plan[plan_key]))
@@ -0,0 +1,118 @@
+"""
+@author: The KnowEnG dev team
+"""
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+
+def use_pipelined_execution(run_parameters):
+    """ True when input loading and result writing overlap the computation in a thread pool.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "pipelined_execution").
+
+    Returns:
+        True or False
+    """
+    return 'pipelined_execution' in run_parameters and bool(run_parameters['pipelined_execution'])
+
+
+def get_pipeline_threads(run_parameters):
+    """ number of threads running the background stages.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "pipeline_threads").
+
+    Returns:
+        pipeline_threads: positive integer, 4 by default.
+    """
+    if 'pipeline_threads' in run_parameters:
+        return max(1, int(run_parameters['pipeline_threads']))
+
+    return 4
+
+
+@contextmanager
+def run_pipeline(run_parameters):
+    """ context of a pipelined run: yields the pipeline the stages are submitted to (None when not
+        "pipelined_execution", the stages then run at once). On exit all stages are joined and the
+        first stage error is raised, then the final stages run on the calling thread; an error of the
+        run itself is raised after the stages finish.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "pipelined_execution", "pipeline_threads").
+
+    Yields:
+        pipeline: dictionary with keys "executor", "futures" and "final_stages", or None.
+    """
+    if not use_pipelined_execution(run_parameters):
+        yield None
+        return
+
+    pipeline = {'executor': ThreadPoolExecutor(max_workers=get_pipeline_threads(run_parameters)), 'futures': [],
+                'final_stages': []}
+    try:
+        yield pipeline
+    except BaseException:
+        join_pipeline(pipeline, raise_errors=False)
+        raise
+    join_pipeline(pipeline)
+    for stage_function, args, kwargs in pipeline['final_stages']:
+        stage_function(*args, **kwargs)
+
+
+def submit_stage(pipeline, stage_function, *args, **kwargs):
+    """ run stage_function(*args, **kwargs) in the pipeline thread pool, or at once without a pipeline.
+
+    Args:
+        pipeline: from run_pipeline, or None.
+        stage_function: the stage to run.
+        args, kwargs: the stage arguments.
+
+    Returns:
+        stage_future: concurrent.futures.Future of the stage result.
+    """
+    if pipeline is None:
+        stage_future = Future()
+        stage_future.set_result(stage_function(*args, **kwargs))
+        return stage_future
+
+    stage_future = pipeline['executor'].submit(stage_function, *args, **kwargs)
+    pipeline['futures'].append(stage_future)
+
+    return stage_future
+
+
+def submit_final_stage(pipeline, stage_function, *args, **kwargs):
+    """ run stage_function(*args, **kwargs) on the calling thread after every stage of the pipeline has
+        finished, or at once without a pipeline. For stages that fork processes, which is unsafe while
+        the pipeline threads run.
+
+    Args:
+        pipeline: from run_pipeline, or None.
+        stage_function: the stage to run.
+        args, kwargs: the stage arguments.
+    """
+    if pipeline is None:
+        stage_function(*args, **kwargs)
+        return
+
+    pipeline['final_stages'].append((stage_function, args, kwargs))
+
+
+def join_pipeline(pipeline, raise_errors=True):
+    """ wait for every submitted stage and stop the thread pool.
+
+    Args:
+        pipeline: from run_pipeline.
+        raise_errors: raise the error of the first failed stage (in submission order).
+    """
+    try:
+        wait(pipeline['futures'])
+    finally:
+        pipeline['executor'].shutdown(wait=True)
+
+    if raise_errors:
+        for stage_future in pipeline['futures']:
+            if stage_future.exception() is not None:
+                raise stage_future.exception()
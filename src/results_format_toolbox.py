@@ -0,0 +1,205 @@
+"""
+@author: The KnowEnG dev team
+"""
+import os
+import sys
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import scipy.sparse as spar
+
+import consensus_matrix_toolbox as cmtbx
+
+OUTPUT_TYPE_SUFFIX = {'tsv': 'tsv', 'npz': 'npz', 'hdf5': 'h5', 'parquet': 'parquet'}
+
+
+def get_output_format(run_parameters):
+    """ get the file format of the large result matrices (consensus matrix, genes by samples heatmap).
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "output_format": "tsv" (default), "npz",
+            "hdf5" or "parquet").
+
+    Returns:
+        output_format: format name.
+    """
+    if 'output_format' not in run_parameters:
+        return 'tsv'
+
+    output_format = run_parameters['output_format']
+    if output_format not in OUTPUT_TYPE_SUFFIX:
+        raise ValueError('output_format contains bad value.')
+
+    return output_format
+
+
+def get_output_type_suffix(run_parameters):
+    """ file name extension of the large result matrices.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "output_format").
+
+    Returns:
+        type_suffix: extension for get_output_file_name.
+    """
+    return OUTPUT_TYPE_SUFFIX[get_output_format(run_parameters)]
+
+
+def save_matrix(matrix, row_names, column_names, file_name, output_format):
+    """ write a labeled matrix in a binary format.
+        "npz": the matrix in its own representation (dense, packed consensus or CSR parts) with the names.
+        "hdf5": "matrix", "row_names" and "column_names" datasets, written one row block at a time.
+        "parquet": one column per column name and a "row_names" column, one row group per row block.
+
+    Args:
+        matrix: dense matrix, or packed or sparse consensus matrix.
+        row_names: row labels.
+        column_names: column labels.
+        file_name: full path of the output file.
+        output_format: "npz", "hdf5" or "parquet".
+    """
+    row_names = np.array(row_names, dtype=str)
+    column_names = np.array(column_names, dtype=str)
+
+    if output_format == 'npz':
+        if spar.issparse(matrix):
+            csr_mat = spar.csr_matrix(matrix)
+            np.savez(file_name, matrix_format='csr', data=csr_mat.data, indices=csr_mat.indices,
+                     indptr=csr_mat.indptr, row_names=row_names, column_names=column_names)
+        elif cmtbx.is_packed(matrix):
+            np.savez(file_name, matrix_format='packed', matrix=matrix, row_names=row_names,
+                     column_names=column_names)
+        else:
+            np.savez(file_name, matrix_format='dense', matrix=np.asarray(matrix), row_names=row_names,
+                     column_names=column_names)
+
+    elif output_format == 'hdf5':
+        import h5py
+        with h5py.File(file_name, 'w') as fh:
+            matrix_set = fh.create_dataset('matrix', shape=(row_names.size, column_names.size),
+                                           dtype=matrix.dtype)
+            for row_start, row_stop, matrix_rows in get_matrix_row_blocks(matrix, row_names.size, column_names.size):
+                matrix_set[row_start:row_stop] = matrix_rows
+            fh.create_dataset('row_names', data=row_names.astype(object), dtype=h5py.string_dtype())
+            fh.create_dataset('column_names', data=column_names.astype(object), dtype=h5py.string_dtype())
+
+    elif output_format == 'parquet':
+        import pyarrow
+        import pyarrow.parquet
+        parquet_writer = None
+        try:
+            for row_start, row_stop, matrix_rows in get_matrix_row_blocks(matrix, row_names.size, column_names.size):
+                out_df = pd.DataFrame(matrix_rows, columns=column_names)
+                out_df.insert(0, 'row_names', row_names[row_start:row_stop])
+                out_table = pyarrow.Table.from_pandas(out_df, preserve_index=False)
+                if parquet_writer is None:
+                    parquet_writer = pyarrow.parquet.ParquetWriter(file_name, out_table.schema)
+                parquet_writer.write_table(out_table)
+        finally:
+            if parquet_writer is not None:
+                parquet_writer.close()
+
+    else:
+        raise ValueError('output_format contains bad value.')
+
+
+def get_matrix_row_blocks(matrix, number_of_rows, number_of_columns):
+    """ yield the rows of a dense, packed or sparse matrix one block of rows at a time.
+
+    Args:
+        matrix: dense matrix, or packed or sparse consensus matrix.
+        number_of_rows: number of rows.
+        number_of_columns: row length.
+
+    Yields:
+        (row_start, row_stop, dense rows)
+    """
+    block_rows = cmtbx.get_block_rows(number_of_columns)
+    for row_start in range(0, number_of_rows, block_rows):
+        row_stop = min(row_start + block_rows, number_of_rows)
+        yield row_start, row_stop, cmtbx.get_consensus_rows(matrix, row_start, row_stop)
+
+
+def load_matrix(file_name):
+    """ read a matrix written by save_matrix into memory.
+
+    Args:
+        file_name: full path of a .npz, .h5 or .parquet file.
+
+    Returns:
+        matrix: dense matrix, or packed or sparse consensus matrix.
+        row_names: row labels.
+        column_names: column labels.
+    """
+    with open_matrix(file_name) as (matrix, row_names, column_names):
+        if not isinstance(matrix, (np.ndarray, spar.spmatrix)):
+            matrix = matrix[()]
+
+    return matrix, row_names, column_names
+
+
+@contextmanager
+def open_matrix(file_name):
+    """ context of a matrix written by save_matrix; an hdf5 matrix stays on disk, is read as it is sliced
+        and its file is closed on exit.
+
+    Args:
+        file_name: full path of a .npz, .h5 or .parquet file.
+
+    Yields:
+        (matrix, row_names, column_names): dense matrix, packed or sparse consensus matrix, or hdf5 dataset,
+            with the row and column labels.
+    """
+    if file_name.endswith('.npz'):
+        with np.load(file_name) as npz_data:
+            row_names = npz_data['row_names']
+            column_names = npz_data['column_names']
+            if str(npz_data['matrix_format']) == 'csr':
+                matrix = spar.csr_matrix((npz_data['data'], npz_data['indices'], npz_data['indptr']),
+                                         shape=(row_names.size, column_names.size))
+            else:
+                matrix = npz_data['matrix']
+        yield matrix, row_names, column_names
+
+    elif file_name.endswith('.h5'):
+        import h5py
+        with h5py.File(file_name, 'r') as fh:
+            row_names = np.array(fh['row_names'].asstr()[()], dtype=str)
+            column_names = np.array(fh['column_names'].asstr()[()], dtype=str)
+            yield fh['matrix'], row_names, column_names
+
+    elif file_name.endswith('.parquet'):
+        in_df = pd.read_parquet(file_name)
+        row_names = in_df['row_names'].values.astype(str)
+        in_df = in_df.drop('row_names', axis=1)
+        yield in_df.values, row_names, in_df.columns.values.astype(str)
+
+    else:
+        raise ValueError('file type is not npz, h5 or parquet.')
+
+
+def save_tsv(file_name, tsv_file_name=None):
+    """ convert a matrix written by save_matrix to the tab separated file the tsv output_format writes,
+        one block of rows at a time.
+
+    Args:
+        file_name: full path of a .npz, .h5 or .parquet file.
+        tsv_file_name: (optional) output path, file_name with a .tsv extension by default.
+
+    Returns:
+        tsv_file_name: the written file.
+    """
+    if tsv_file_name is None:
+        tsv_file_name = os.path.splitext(file_name)[0] + '.tsv'
+
+    with open_matrix(file_name) as (matrix, row_names, column_names), open(tsv_file_name, 'w') as fh:
+        for row_start, row_stop, matrix_rows in get_matrix_row_blocks(matrix, row_names.size, column_names.size):
+            out_df = pd.DataFrame(matrix_rows, index=row_names[row_start:row_stop], columns=column_names)
+            out_df.to_csv(fh, sep='\t', header=(row_start == 0))
+
+    return tsv_file_name
+
+
+if __name__ == '__main__':
+    for binary_file_name in sys.argv[1:]:
+        print(save_tsv(binary_file_name))
@@ -0,0 +1,187 @@
+"""
+@author: The KnowEnG dev team
+"""
+import hashlib
+import numpy as np
+import scipy.sparse as spar
+from scipy.sparse.linalg import splu
+import knpackage.toolbox as kn
+
+RWR_FACTOR_CACHE = {}
+
+
+def smooth_matrix_with_rwr(restart, network_mat, run_parameters):
+    """ random walk with restart smoothing of every column of restart.
+        "rwr_solver": "power" (default) iterates R_n+1 = a*N*R_n + (1-a)*R_0 (kn.smooth_matrix_with_rwr),
+        "direct" solves the fixed point (I - a*N).R = (1-a)*R_0 with a factorization of (I - a*N)
+        that is computed once per network and reused as extra right hand sides on every call.
+
+    Args:
+        restart: restart array of any column size.
+        network_mat: normalized network stored in sparse format.
+        run_parameters: parameters dictionary with "rwr_restart_probability",
+        "rwr_convergence_tolerence", "rwr_max_iterations", (optional - "rwr_solver",
+        "rwr_network_fingerprint" - from update_rwr_network_fingerprint).
+
+    Returns:
+        smooth_1: smoothed restart data.
+        step: number of power iterations (0 for the direct solver).
+    """
+    if get_rwr_solver_name(run_parameters) == 'power':
+        return kn.smooth_matrix_with_rwr(restart, network_mat, run_parameters)
+
+    alpha = run_parameters["rwr_restart_probability"]
+    network_fingerprint = None
+    if 'rwr_network_fingerprint' in run_parameters:
+        network_fingerprint = run_parameters['rwr_network_fingerprint']
+    rwr_factor = get_rwr_factor(network_mat, alpha, network_fingerprint)
+    smooth_1 = rwr_factor.solve((1. - alpha) * np.asarray(restart, dtype=np.float64))
+
+    return smooth_1, 0
+
+
+def get_rwr_solver_name(run_parameters):
+    """ get the random walk with restart solver name.
+
+    Args:
+        run_parameters: parameters dictionary, (optional - "rwr_solver").
+
+    Returns:
+        rwr_solver: "power" or "direct".
+    """
+    if 'rwr_solver' not in run_parameters:
+        return 'power'
+
+    rwr_solver = run_parameters['rwr_solver']
+    if rwr_solver not in ('power', 'direct'):
+        raise ValueError('rwr_solver contains bad value.')
+
+    return rwr_solver
+
+
+def get_rwr_factor(network_mat, alpha, network_fingerprint=None):
+    """ sparse LU factorization of (I - alpha * network_mat), cached for the last network seen.
+
+    Args:
+        network_mat: normalized network stored in sparse format.
+        alpha: rwr_restart_probability.
+        network_fingerprint: (optional) get_network_fingerprint of network_mat, hashed here when not given.
+
+    Returns:
+        rwr_factor: scipy SuperLU object with a solve(rhs) method.
+    """
+    if network_fingerprint is None:
+        network_fingerprint = get_network_fingerprint(network_mat)
+    factor_key = (network_fingerprint, alpha)
+    rwr_factor = RWR_FACTOR_CACHE.get(factor_key)
+    if rwr_factor is None:
+        identity_mat = spar.identity(network_mat.shape[0], format='csc')
+        rwr_factor = splu(spar.csc_matrix(identity_mat - alpha * network_mat))
+        RWR_FACTOR_CACHE.clear()
+        RWR_FACTOR_CACHE[factor_key] = rwr_factor
+
+    return rwr_factor
+
+
+def clear_rwr_factor_cache():
+    """ release the cached factorization at the end of a run. """
+    RWR_FACTOR_CACHE.clear()
+
+
+def update_rwr_network_fingerprint(run_parameters, network_mat):
+    """ hash the network once in the parent for the "direct" solver, so the bootstraps look up the
+        factorization by "rwr_network_fingerprint" instead of hashing their copy of the network.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "rwr_solver").
+        network_mat: normalized network of the run.
+
+    Returns:
+        run_parameters: with "rwr_network_fingerprint" for the "direct" solver.
+    """
+    if get_rwr_solver_name(run_parameters) == 'direct':
+        run_parameters['rwr_network_fingerprint'] = get_network_fingerprint(network_mat)
+
+    return run_parameters
+
+
+def get_network_fingerprint(network_mat):
+    """ content hash of a sparse network, equal for copies of the same network in any process.
+
+    Args:
+        network_mat: network stored in sparse format.
+
+    Returns:
+        fingerprint: hex digest string.
+    """
+    csr_mat = spar.csr_matrix(network_mat)
+    network_hash = hashlib.sha1(str(csr_mat.shape).encode())
+    for part in (csr_mat.indptr, csr_mat.indices, csr_mat.data):
+        network_hash.update(np.ascontiguousarray(part))
+
+    return network_hash.hexdigest()
+
+
+def use_rwr_cache(run_parameters):
+    """ True when the bootstraps should slice their smoothed columns from one smoothing of the spreadsheet.
+        "rwr_cache_row_sampling" defines how rows_sampling_fraction interacts with the cache:
+        "before_smoothing" (default) keeps the rows dropped before smoothing, so the cache is only
+        used when no rows are dropped; "after_smoothing" drops the rows from the cached smoothed columns.
+
+    Args:
+        run_parameters: with "rows_sampling_fraction", (optional - "rwr_smoothing_cache",
+            "rwr_cache_row_sampling").
+
+    Returns:
+        True or False
+    """
+    if 'rwr_smoothing_cache' not in run_parameters or not run_parameters['rwr_smoothing_cache']:
+        return False
+
+    if 'rwr_cache_row_sampling' in run_parameters:
+        row_sampling = run_parameters['rwr_cache_row_sampling']
+    else:
+        row_sampling = 'before_smoothing'
+    if row_sampling not in ('before_smoothing', 'after_smoothing'):
+        raise ValueError('rwr_cache_row_sampling contains bad value.')
+
+    return row_sampling == 'after_smoothing' or run_parameters['rows_sampling_fraction'] >= 1
+
+
+def sample_a_smoothed_matrix(spreadsheet_mat, smooth_spreadsheet_mat, rows_fraction, cols_fraction,
+                             random_state=None):
+    """ kn.sample_a_matrix of spreadsheet_mat, with the sampled columns sliced from the smoothed cache
+        and the dropped rows zeroed after smoothing. Draws the same random permutations as
+        kn.sample_a_matrix, so a seeded bootstrap selects the same rows and columns.
+
+    Args:
+        spreadsheet_mat: gene x sample spread sheet as matrix.
+        smooth_spreadsheet_mat: spreadsheet_mat smoothed with random walk with restart.
+        rows_fraction: decimal fraction of rows kept - [0 : 1].
+        cols_fraction: decimal fraction of columns kept - [0 : 1].
+        random_state: (optional) np.random.RandomState to draw from, the global generator by default.
+
+    Returns:
+        smooth_random: smoothed sampled columns with the dropped rows set to zero.
+        sample_permutation: the array that correponds to columns sample.
+    """
+    if random_state is None:
+        random_state = np.random
+
+    features_size = int(np.round(spreadsheet_mat.shape[0] * (1 - rows_fraction)))
+    features_permutation = random_state.permutation(spreadsheet_mat.shape[0])
+    features_permutation = features_permutation[0:features_size].T
+
+    patients_size = int(np.round(spreadsheet_mat.shape[1] * cols_fraction))
+    sample_permutation = random_state.permutation(spreadsheet_mat.shape[1])
+    sample_permutation = sample_permutation[0:patients_size]
+
+    sample_random = spreadsheet_mat[:, sample_permutation]
+    sample_random[features_permutation[:, None], :] = 0
+    positive_col_set = sum(sample_random) > 0
+    sample_permutation = sample_permutation[positive_col_set]
+
+    smooth_random = smooth_spreadsheet_mat[:, sample_permutation]
+    smooth_random[features_permutation[:, None], :] = 0
+
+    return smooth_random, sample_permutation
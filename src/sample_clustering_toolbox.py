@@ -2,13 +2,25 @@
 @author: The KnowEnG dev team
 """
 import os
+import time
+import multiprocessing
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
 import pandas as pd
-from sklearn.metrics import silhouette_score
 import knpackage.toolbox as kn
 import knpackage.distributed_computing_utils as dstutil
 
 import clustering_eval_toolbox as cluster_eval
+import shared_matrix_toolbox as shmtbx
+import rwr_toolbox as rwrtbx
+import data_cache_toolbox as dctbx
+import batch_nmf_toolbox as bnmftbx
+import consensus_matrix_toolbox as cmtbx
+import results_format_toolbox as rftbx
+import pipeline_toolbox as pltbx
+import parallelism_toolbox as prtbx
+import checkpoint_toolbox as cptbx
 
 def run_nmf(run_parameters):
     """ wrapper: call sequence to perform non-negative matrix factorization and write results.
@@ -19,21 +31,22 @@ def run_nmf(run_parameters):
     number_of_clusters = run_parameters['number_of_clusters']
     spreadsheet_name_full_path = run_parameters['spreadsheet_name_full_path']
 
-    spreadsheet_df = kn.get_spreadsheet_df(spreadsheet_name_full_path)
-    spreadsheet_mat = spreadsheet_df.as_matrix()
-    spreadsheet_mat = kn.get_quantile_norm_matrix(spreadsheet_mat)
+    with pltbx.run_pipeline(run_parameters) as pipeline:
+        spreadsheet_df = dctbx.get_spreadsheet_df(spreadsheet_name_full_path, run_parameters)
+        spreadsheet_mat = spreadsheet_df.as_matrix()
+        spreadsheet_mat = kn.get_quantile_norm_matrix(spreadsheet_mat)
 
-    h_mat = kn.perform_nmf(spreadsheet_mat, run_parameters)
+        h_mat = kn.perform_nmf(spreadsheet_mat, run_parameters)
 
-    linkage_matrix = np.zeros((spreadsheet_mat.shape[1], spreadsheet_mat.shape[1]))
-    sample_perm = np.arange(0, spreadsheet_mat.shape[1])
-    linkage_matrix = kn.update_linkage_matrix(h_mat, sample_perm, linkage_matrix)
-    labels = kn.perform_kmeans(linkage_matrix, number_of_clusters)
+        linkage_matrix = np.zeros((spreadsheet_mat.shape[1], spreadsheet_mat.shape[1]))
+        sample_perm = np.arange(0, spreadsheet_mat.shape[1])
+        linkage_matrix = kn.update_linkage_matrix(h_mat, sample_perm, linkage_matrix)
+        labels = kn.perform_kmeans(linkage_matrix, number_of_clusters)
 
-    sample_names = spreadsheet_df.columns
-    save_consensus_clustering(linkage_matrix, sample_names, labels, run_parameters)
-    save_final_samples_clustering(sample_names, labels, run_parameters)
-    save_spreadsheet_and_variance_heatmap(spreadsheet_df, labels, run_parameters)
+        sample_names = spreadsheet_df.columns
+        save_final_samples_clustering(sample_names, labels, run_parameters, pipeline)
+        pltbx.submit_stage(pipeline, save_spreadsheet_and_variance_heatmap, spreadsheet_df, labels, run_parameters)
+        save_consensus_clustering(linkage_matrix, sample_names, labels, run_parameters, pipeline)
 
 
 def run_net_nmf(run_parameters):
@@ -46,27 +59,33 @@ def run_net_nmf(run_parameters):
     gg_network_name_full_path = run_parameters['gg_network_name_full_path']
     spreadsheet_name_full_path = run_parameters['spreadsheet_name_full_path']
 
-    network_mat, unique_gene_names = kn.get_sparse_network_matrix(gg_network_name_full_path)
-    network_mat = kn.normalize_sparse_mat_by_diagonal(network_mat)
-    lap_diag, lap_pos = kn.form_network_laplacian_matrix(network_mat)
+    with pltbx.run_pipeline(run_parameters) as pipeline:
+        network_future = pltbx.submit_stage(pipeline, dctbx.get_network_matrices, gg_network_name_full_path,
+                                            run_parameters)
+        spreadsheet_future = pltbx.submit_stage(pipeline, dctbx.get_spreadsheet_df, spreadsheet_name_full_path,
+                                                run_parameters)
+        network_mat, lap_diag, lap_pos, unique_gene_names = network_future.result()
 
-    spreadsheet_df = kn.get_spreadsheet_df(spreadsheet_name_full_path)
-    spreadsheet_df = kn.update_spreadsheet_df(spreadsheet_df, unique_gene_names)
-    sample_names = spreadsheet_df.columns
-    spreadsheet_mat = spreadsheet_df.as_matrix()
+        spreadsheet_df = kn.update_spreadsheet_df(spreadsheet_future.result(), unique_gene_names)
+        sample_names = spreadsheet_df.columns
+        spreadsheet_mat = spreadsheet_df.as_matrix()
 
-    spreadsheet_mat, iterations = kn.smooth_matrix_with_rwr(spreadsheet_mat, network_mat, run_parameters)
-    spreadsheet_mat = kn.get_quantile_norm_matrix(spreadsheet_mat)
-    h_mat = kn.perform_net_nmf(spreadsheet_mat, lap_pos, lap_diag, run_parameters)
+        run_parameters = rwrtbx.update_rwr_network_fingerprint(run_parameters, network_mat)
+        smooth_spreadsheet_mat, iterations = rwrtbx.smooth_matrix_with_rwr(spreadsheet_mat, network_mat, run_parameters)
+        spreadsheet_mat = kn.get_quantile_norm_matrix(smooth_spreadsheet_mat)
+        h_mat = kn.perform_net_nmf(spreadsheet_mat, lap_pos, lap_diag, run_parameters)
 
-    linkage_matrix = np.zeros((spreadsheet_mat.shape[1], spreadsheet_mat.shape[1]))
-    sample_perm = np.arange(0, spreadsheet_mat.shape[1])
-    linkage_matrix = kn.update_linkage_matrix(h_mat, sample_perm, linkage_matrix)
-    labels = kn.perform_kmeans(linkage_matrix, number_of_clusters)
+        linkage_matrix = np.zeros((spreadsheet_mat.shape[1], spreadsheet_mat.shape[1]))
+        sample_perm = np.arange(0, spreadsheet_mat.shape[1])
+        linkage_matrix = kn.update_linkage_matrix(h_mat, sample_perm, linkage_matrix)
+        labels = kn.perform_kmeans(linkage_matrix, number_of_clusters)
 
-    save_consensus_clustering(linkage_matrix, sample_names, labels, run_parameters)
-    save_final_samples_clustering(sample_names, labels, run_parameters)
-    save_spreadsheet_and_variance_heatmap(spreadsheet_df, labels, run_parameters, network_mat)
+        save_final_samples_clustering(sample_names, labels, run_parameters, pipeline)
+        pltbx.submit_stage(pipeline, save_spreadsheet_and_variance_heatmap, spreadsheet_df, labels, run_parameters,
+                           network_mat, smooth_spreadsheet_mat)
+        save_consensus_clustering(linkage_matrix, sample_names, labels, run_parameters, pipeline)
+
+    rwrtbx.clear_rwr_factor_cache()
 
 
 def run_cc_nmf(run_parameters):
@@ -76,46 +95,91 @@ def run_cc_nmf(run_parameters):
     Args:
         run_parameters: parameter set dictionary.
     """
-    tmp_dir = 'tmp_cc_nmf'
-    run_parameters = update_tmp_directory(run_parameters, tmp_dir)
-
+    run_parameters = update_number_of_clusters(run_parameters)
     processing_method = run_parameters['processing_method']
+    if processing_method == 'distribute':
+        run_parameters = update_tmp_directory(run_parameters, 'tmp_cc_nmf')
+
     number_of_bootstraps = run_parameters['number_of_bootstraps']
     number_of_clusters = run_parameters['number_of_clusters']
     spreadsheet_name_full_path = run_parameters['spreadsheet_name_full_path']
 
-    spreadsheet_df = kn.get_spreadsheet_df(spreadsheet_name_full_path)
-    spreadsheet_mat = spreadsheet_df.as_matrix()
-    spreadsheet_mat = kn.get_quantile_norm_matrix(spreadsheet_mat)
-    number_of_samples = spreadsheet_mat.shape[1]
-
-    if processing_method == 'serial':
-        for sample in range(0, number_of_bootstraps):
-            run_cc_nmf_clusters_worker(spreadsheet_mat, run_parameters, sample)
-
-    elif processing_method == 'parallel':
-        find_and_save_cc_nmf_clusters_parallel(spreadsheet_mat, run_parameters, number_of_bootstraps)
-
-    elif processing_method == 'distribute':
-        func_args = [spreadsheet_mat, run_parameters]
-        dependency_list = [run_cc_nmf_clusters_worker, save_a_clustering_to_tmp, dstutil.determine_parallelism_locally]
-        dstutil.execute_distribute_computing_job(run_parameters['cluster_ip_address'],
-                                                 number_of_bootstraps,
-                                                 func_args,
-                                                 find_and_save_cc_nmf_clusters_parallel,
-                                                 dependency_list)
-    else:
-        raise ValueError('processing_method contains bad value.')
-
-    consensus_matrix = form_consensus_matrix(run_parameters, number_of_samples)
-    labels = kn.perform_kmeans(consensus_matrix, number_of_clusters)
-
-    sample_names = spreadsheet_df.columns
-    save_consensus_clustering(consensus_matrix, sample_names, labels, run_parameters)
-    save_final_samples_clustering(sample_names, labels, run_parameters)
-    save_spreadsheet_and_variance_heatmap(spreadsheet_df, labels, run_parameters)
-
-    kn.remove_dir(run_parameters["tmp_directory"])
+    with cmtbx.tiled_consensus_directory(run_parameters), pltbx.run_pipeline(run_parameters) as pipeline:
+        spreadsheet_df = dctbx.get_spreadsheet_df(spreadsheet_name_full_path, run_parameters)
+        spreadsheet_mat = spreadsheet_df.as_matrix()
+        spreadsheet_mat = kn.get_quantile_norm_matrix(spreadsheet_mat)
+        number_of_samples = spreadsheet_mat.shape[1]
+        if prtbx.is_dry_run(run_parameters):
+            print(prtbx.get_parallelism_plan_text(prtbx.get_parallelism_plan(
+                run_parameters, number_of_bootstraps, spreadsheet_mat.shape), run_parameters))
+            return
+
+        run_parameters = cptbx.update_checkpoint_directory(run_parameters, number_of_bootstraps,
+                                                          [spreadsheet_name_full_path])
+        run_parameters = prtbx.update_parallelism_plan(run_parameters, number_of_bootstraps, spreadsheet_mat.shape)
+        if 'parallelism_plan' in run_parameters:
+            pltbx.submit_stage(pipeline, prtbx.save_parallelism_plan, run_parameters['parallelism_plan'],
+                               get_output_file_name(run_parameters, 'parallelism_plan', 'download'))
+
+        bootstrap_log = [] if use_bootstrap_log(run_parameters) else None
+        if processing_method == 'serial' and bootstrap_log is not None:
+            clusterings = schedule_bootstraps(partial(run_cc_nmf_clusters_worker, spreadsheet_mat, run_parameters),
+                                              get_bootstrap_samples(run_parameters, number_of_bootstraps), 1,
+                                              processing_method, bootstrap_log)
+
+        elif processing_method == 'serial':
+            clusterings = get_bootstrap_clusterings(
+                (run_cc_nmf_clusters_worker(spreadsheet_mat, run_parameters, sample)
+                 for sample in get_bootstrap_samples(run_parameters, number_of_bootstraps)), run_parameters)
+
+        elif processing_method == 'parallel':
+            clusterings = find_cc_nmf_clusters_parallel(spreadsheet_mat, run_parameters, number_of_bootstraps,
+                                                        bootstrap_log)
+
+        elif processing_method == 'threads':
+            clusterings = find_cc_nmf_clusters_threads(spreadsheet_mat, run_parameters, number_of_bootstraps,
+                                                       bootstrap_log)
+
+        elif processing_method == 'distribute':
+            func_args = [spreadsheet_mat, run_parameters]
+            dependency_list = get_distribute_dependency_list('cc_nmf')
+            dstutil.execute_distribute_computing_job(run_parameters['cluster_ip_address'],
+                                                     number_of_bootstraps,
+                                                     func_args,
+                                                     find_and_save_cc_nmf_clusters_parallel,
+                                                     dependency_list)
+            if cptbx.use_checkpoint(run_parameters):
+                clusterings = cptbx.get_checkpoint_clusterings(run_parameters, number_of_bootstraps)
+            else:
+                clusterings = get_clusterings_from_tmp(run_parameters)
+        else:
+            raise ValueError('processing_method contains bad value.')
+
+        if cptbx.use_checkpoint(run_parameters) and processing_method != 'distribute':
+            checkpoint_clusterings = cptbx.get_checkpoint_clusterings(run_parameters, number_of_bootstraps)
+            clusterings = get_resumed_clusterings(checkpoint_clusterings, clusterings)
+
+        sample_names = spreadsheet_df.columns
+        if is_number_of_clusters_sweep(run_parameters):
+            save_number_of_clusters_sweep(clusterings, sample_names, run_parameters, pipeline)
+        else:
+            if use_adaptive_bootstraps(run_parameters):
+                consensus_matrix, convergence_df = form_consensus_matrix_adaptive(clusterings, number_of_samples,
+                                                                                  run_parameters)
+                save_bootstrap_convergence(convergence_df, run_parameters)
+            else:
+                consensus_matrix = form_consensus_matrix(clusterings, number_of_samples, run_parameters)
+            labels = cmtbx.perform_final_clustering(consensus_matrix, number_of_clusters, run_parameters)
+
+            save_final_samples_clustering(sample_names, labels, run_parameters, pipeline)
+            pltbx.submit_stage(pipeline, save_spreadsheet_and_variance_heatmap, spreadsheet_df, labels, run_parameters)
+            save_consensus_clustering(consensus_matrix, sample_names, labels, run_parameters, pipeline)
+
+        if bootstrap_log is not None:
+            pltbx.submit_stage(pipeline, save_bootstrap_log, bootstrap_log, run_parameters)
+
+    if processing_method == 'distribute':
+        kn.remove_dir(run_parameters["tmp_directory"])
 
 
 def run_cc_net_nmf(run_parameters):
@@ -125,56 +189,114 @@ def run_cc_net_nmf(run_parameters):
     Args:
         run_parameters: parameter set dictionary.
     """
-    tmp_dir = 'tmp_cc_net_nmf'
-    run_parameters = update_tmp_directory(run_parameters, tmp_dir)
-
+    run_parameters = update_number_of_clusters(run_parameters)
     processing_method = run_parameters['processing_method']
+    if processing_method == 'distribute':
+        run_parameters = update_tmp_directory(run_parameters, 'tmp_cc_net_nmf')
+
     number_of_bootstraps = run_parameters['number_of_bootstraps']
     number_of_clusters = run_parameters['number_of_clusters']
     gg_network_name_full_path = run_parameters['gg_network_name_full_path']
     spreadsheet_name_full_path = run_parameters['spreadsheet_name_full_path']
 
-    network_mat, unique_gene_names = kn.get_sparse_network_matrix(gg_network_name_full_path)
-    network_mat = kn.normalize_sparse_mat_by_diagonal(network_mat)
-    lap_diag, lap_pos = kn.form_network_laplacian_matrix(network_mat)
-
-    spreadsheet_df = kn.get_spreadsheet_df(spreadsheet_name_full_path)
-    spreadsheet_df = kn.update_spreadsheet_df(spreadsheet_df, unique_gene_names)
-    spreadsheet_mat = spreadsheet_df.as_matrix()
-    number_of_samples = spreadsheet_mat.shape[1]
-    sample_names = spreadsheet_df.columns
-
-    if processing_method == 'serial':
-        for sample in range(0, number_of_bootstraps):
-            run_cc_net_nmf_clusters_worker(network_mat, spreadsheet_mat, lap_diag, lap_pos, run_parameters, sample)
-
-    elif processing_method == 'parallel':
-        find_and_save_cc_net_nmf_clusters_parallel(network_mat, spreadsheet_mat, lap_diag, lap_pos, run_parameters, number_of_bootstraps)
-
-    elif processing_method == 'distribute':
-        func_args = [network_mat, spreadsheet_mat, lap_diag, lap_pos, run_parameters]
-        dependency_list = [run_cc_net_nmf_clusters_worker, save_a_clustering_to_tmp, dstutil.determine_parallelism_locally]
-        dstutil.execute_distribute_computing_job(run_parameters['cluster_ip_address'],
-                                                 number_of_bootstraps,
-                                                 func_args,
-                                                 find_and_save_cc_net_nmf_clusters_parallel,
-                                                 dependency_list)
-    else:
-        raise ValueError('processing_method contains bad value.')
-
-    consensus_matrix = form_consensus_matrix(run_parameters, number_of_samples)
-    labels = kn.perform_kmeans(consensus_matrix, number_of_clusters)
-
-    save_consensus_clustering(consensus_matrix, sample_names, labels, run_parameters)
-    save_final_samples_clustering(sample_names, labels, run_parameters)
-    save_spreadsheet_and_variance_heatmap(spreadsheet_df, labels, run_parameters, network_mat)
-
-    kn.remove_dir(run_parameters["tmp_directory"])
+    with cmtbx.tiled_consensus_directory(run_parameters), pltbx.run_pipeline(run_parameters) as pipeline:
+        network_future = pltbx.submit_stage(pipeline, dctbx.get_network_matrices, gg_network_name_full_path,
+                                            run_parameters)
+        spreadsheet_future = pltbx.submit_stage(pipeline, dctbx.get_spreadsheet_df, spreadsheet_name_full_path,
+                                                run_parameters)
+        network_mat, lap_diag, lap_pos, unique_gene_names = network_future.result()
+
+        spreadsheet_df = kn.update_spreadsheet_df(spreadsheet_future.result(), unique_gene_names)
+        spreadsheet_mat = spreadsheet_df.as_matrix()
+        number_of_samples = spreadsheet_mat.shape[1]
+        sample_names = spreadsheet_df.columns
+        if prtbx.is_dry_run(run_parameters):
+            print(prtbx.get_parallelism_plan_text(prtbx.get_parallelism_plan(
+                run_parameters, number_of_bootstraps, spreadsheet_mat.shape, network_mat.nnz), run_parameters))
+            return
+
+        run_parameters = cptbx.update_checkpoint_directory(run_parameters, number_of_bootstraps,
+                                                          [spreadsheet_name_full_path, gg_network_name_full_path])
+        run_parameters = rwrtbx.update_rwr_network_fingerprint(run_parameters, network_mat)
+        run_parameters = prtbx.update_parallelism_plan(run_parameters, number_of_bootstraps, spreadsheet_mat.shape,
+                                                       network_mat.nnz)
+        if 'parallelism_plan' in run_parameters:
+            pltbx.submit_stage(pipeline, prtbx.save_parallelism_plan, run_parameters['parallelism_plan'],
+                               get_output_file_name(run_parameters, 'parallelism_plan', 'download'))
+
+        smooth_spreadsheet_mat = None
+        if processing_method != 'distribute' and rwrtbx.use_rwr_cache(run_parameters):
+            smooth_spreadsheet_mat, iterations = rwrtbx.smooth_matrix_with_rwr(spreadsheet_mat, network_mat, run_parameters)
+
+        bootstrap_log = [] if use_bootstrap_log(run_parameters) else None
+        if processing_method == 'serial' and bootstrap_log is not None:
+            clusterings = schedule_bootstraps(
+                partial(run_cc_net_nmf_clusters_worker, network_mat, spreadsheet_mat, lap_diag, lap_pos,
+                        run_parameters, smooth_spreadsheet_mat=smooth_spreadsheet_mat),
+                get_bootstrap_samples(run_parameters, number_of_bootstraps), 1, processing_method, bootstrap_log)
+
+        elif processing_method == 'serial':
+            clusterings = get_bootstrap_clusterings(
+                (run_cc_net_nmf_clusters_worker(network_mat, spreadsheet_mat, lap_diag, lap_pos,
+                                                run_parameters, sample, smooth_spreadsheet_mat)
+                 for sample in get_bootstrap_samples(run_parameters, number_of_bootstraps)), run_parameters)
+
+        elif processing_method == 'parallel':
+            clusterings = find_cc_net_nmf_clusters_parallel(network_mat, spreadsheet_mat, lap_diag, lap_pos,
+                                                            run_parameters, number_of_bootstraps, smooth_spreadsheet_mat,
+                                                            bootstrap_log)
+
+        elif processing_method == 'threads':
+            clusterings = find_cc_net_nmf_clusters_threads(network_mat, spreadsheet_mat, lap_diag, lap_pos,
+                                                           run_parameters, number_of_bootstraps, smooth_spreadsheet_mat,
+                                                           bootstrap_log)
+
+        elif processing_method == 'distribute':
+            func_args = [network_mat, spreadsheet_mat, lap_diag, lap_pos, run_parameters]
+            dependency_list = get_distribute_dependency_list('cc_net_nmf')
+            dstutil.execute_distribute_computing_job(run_parameters['cluster_ip_address'],
+                                                     number_of_bootstraps,
+                                                     func_args,
+                                                     find_and_save_cc_net_nmf_clusters_parallel,
+                                                     dependency_list)
+            if cptbx.use_checkpoint(run_parameters):
+                clusterings = cptbx.get_checkpoint_clusterings(run_parameters, number_of_bootstraps)
+            else:
+                clusterings = get_clusterings_from_tmp(run_parameters)
+        else:
+            raise ValueError('processing_method contains bad value.')
+
+        if cptbx.use_checkpoint(run_parameters) and processing_method != 'distribute':
+            checkpoint_clusterings = cptbx.get_checkpoint_clusterings(run_parameters, number_of_bootstraps)
+            clusterings = get_resumed_clusterings(checkpoint_clusterings, clusterings)
+
+        if is_number_of_clusters_sweep(run_parameters):
+            save_number_of_clusters_sweep(clusterings, sample_names, run_parameters, pipeline)
+        else:
+            if use_adaptive_bootstraps(run_parameters):
+                consensus_matrix, convergence_df = form_consensus_matrix_adaptive(clusterings, number_of_samples,
+                                                                                  run_parameters)
+                save_bootstrap_convergence(convergence_df, run_parameters)
+            else:
+                consensus_matrix = form_consensus_matrix(clusterings, number_of_samples, run_parameters)
+            labels = cmtbx.perform_final_clustering(consensus_matrix, number_of_clusters, run_parameters)
+
+            save_final_samples_clustering(sample_names, labels, run_parameters, pipeline)
+            pltbx.submit_stage(pipeline, save_spreadsheet_and_variance_heatmap, spreadsheet_df, labels, run_parameters,
+                               network_mat, smooth_spreadsheet_mat)
+            save_consensus_clustering(consensus_matrix, sample_names, labels, run_parameters, pipeline)
+
+        if bootstrap_log is not None:
+            pltbx.submit_stage(pipeline, save_bootstrap_log, bootstrap_log, run_parameters)
+
+    rwrtbx.clear_rwr_factor_cache()
+    if processing_method == 'distribute':
+        kn.remove_dir(run_parameters["tmp_directory"])
 
 
 def find_and_save_cc_nmf_clusters_parallel(spreadsheet_mat, run_parameters, number_of_bootstraps):
     """ central loop: compute components for the consensus matrix by
-        non-negative matrix factorization.
+        non-negative matrix factorization and save them to temp files (distribute).
 
     Args:
         spreadsheet_mat: genes x samples matrix.
@@ -182,19 +304,23 @@ def find_and_save_cc_nmf_clusters_parallel(spreadsheet_mat, run_parameters, numb
         number_of_cpus: number of processes to be running in parallel
     """
     import knpackage.distributed_computing_utils as dstutil
+    from functools import partial
 
     jobs_id = range(0, number_of_bootstraps)
-    zipped_arguments = dstutil.zip_parameters(spreadsheet_mat, run_parameters, jobs_id)
+    if 'checkpoint_samples' in run_parameters:
+        checkpoint_samples = set(run_parameters['checkpoint_samples'])
+        jobs_id = [job_id for job_id in jobs_id if job_id in checkpoint_samples]
     if 'parallelism' in run_parameters:
         parallelism = dstutil.determine_parallelism_locally(number_of_bootstraps, run_parameters['parallelism'])
     else:
         parallelism = dstutil.determine_parallelism_locally(number_of_bootstraps)
-    dstutil.parallelize_processes_locally(run_cc_nmf_clusters_worker, zipped_arguments, parallelism)
+    parallelize_bootstraps_queue(partial(run_cc_nmf_clusters_worker, spreadsheet_mat, run_parameters), jobs_id,
+                                 parallelism)
 
 
 def find_and_save_cc_net_nmf_clusters_parallel(network_mat, spreadsheet_mat, lap_diag, lap_pos, run_parameters, number_of_bootstraps):
     """ central loop: compute components for the consensus matrix from the input
-        network and spreadsheet matrices and save them to temp files.
+        network and spreadsheet matrices and save them to temp files (distribute).
 
     Args:
         network_mat: genes x genes symmetric matrix.
@@ -205,41 +331,536 @@ def find_and_save_cc_net_nmf_clusters_parallel(network_mat, spreadsheet_mat, lap
         number_of_cpus: number of processes to be running in parallel
     """
     import knpackage.distributed_computing_utils as dstutil
+    from functools import partial
 
     jobs_id = range(0, number_of_bootstraps)
-    zipped_arguments = dstutil.zip_parameters(network_mat, spreadsheet_mat, lap_diag, lap_pos, run_parameters, jobs_id)
+    if 'checkpoint_samples' in run_parameters:
+        checkpoint_samples = set(run_parameters['checkpoint_samples'])
+        jobs_id = [job_id for job_id in jobs_id if job_id in checkpoint_samples]
     if 'parallelism' in run_parameters:
         parallelism = dstutil.determine_parallelism_locally(number_of_bootstraps, run_parameters['parallelism'])
     else:
         parallelism = dstutil.determine_parallelism_locally(number_of_bootstraps)
-    dstutil.parallelize_processes_locally(run_cc_net_nmf_clusters_worker, zipped_arguments, parallelism)
+    parallelize_bootstraps_queue(partial(run_cc_net_nmf_clusters_worker, network_mat, spreadsheet_mat, lap_diag,
+                                         lap_pos, run_parameters), jobs_id, parallelism)
+
+
+def get_distribute_dependency_list(method):
+    """ functions and modules shipped to the dispy compute nodes with find_and_save_{method}_clusters_parallel.
+
+    Args:
+        method: "cc_nmf" or "cc_net_nmf".
+
+    Returns:
+        dependency_list: everything the node function reaches outside of its local imports.
+    """
+    dependency_list = [parallelize_bootstraps_queue, save_a_clustering_to_tmp, get_h_matrix,
+                       dstutil.determine_parallelism_locally, cptbx]
+    if method == 'cc_net_nmf':
+        return [run_cc_net_nmf_clusters_worker, rwrtbx] + dependency_list
+
+    return [run_cc_nmf_clusters_worker] + dependency_list
+
 
+def parallelize_bootstraps_queue(worker, jobs_id, parallelism):
+    """ run worker(job_id) for every job in a process pool fed one job at a time, so a free process
+        takes the next bootstrap instead of waiting on a fixed share of them (distribute).
+
+    Args:
+        worker: bootstrap worker with all arguments but the job id bound.
+        jobs_id: bootstrap sample numbers.
+        parallelism: number of processes to be running in parallel.
+    """
+    import multiprocessing
 
-def run_cc_nmf_clusters_worker(spreadsheet_mat, run_parameters, sample):
+    pool = multiprocessing.Pool(processes=parallelism)
+    try:
+        for result in pool.imap_unordered(worker, jobs_id, chunksize=1):
+            pass
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def find_cc_nmf_clusters_parallel(spreadsheet_mat, run_parameters, number_of_bootstraps, bootstrap_log=None):
+    """ central loop: compute components for the consensus matrix by non-negative matrix
+        factorization in a local process pool and yield them as the bootstraps complete.
+
+    Args:
+        spreadsheet_mat: genes x samples matrix.
+        run_parameters: dictionary of run-time parameters.
+        number_of_bootstraps: number of bootstrap workers.
+        bootstrap_log: (optional) list to append the runtime and nmf iterations of each bootstrap to.
+
+    Yields:
+        (cluster_id, sample_permutation) of each bootstrap, in completion order.
+    """
+    samples = get_bootstrap_samples(run_parameters, number_of_bootstraps)
+    parallelism = get_parallelism_locally(run_parameters, len(samples))
+
+    if shmtbx.use_shared_memory(run_parameters):
+        shared_dir = shmtbx.create_shared_directory(run_parameters)
+        try:
+            spreadsheet_handle = shmtbx.share_matrix(spreadsheet_mat, shared_dir, 'spreadsheet_mat')
+            worker = partial(run_cc_nmf_clusters_worker_shared, spreadsheet_handle, run_parameters)
+            for clustering in get_parallel_clusterings(worker, samples, parallelism, run_parameters,
+                                                       bootstrap_log):
+                yield clustering
+        finally:
+            kn.remove_dir(shared_dir)
+    else:
+        worker = partial(run_cc_nmf_clusters_worker, spreadsheet_mat, run_parameters)
+        for clustering in get_parallel_clusterings(worker, samples, parallelism, run_parameters, bootstrap_log):
+            yield clustering
+
+
+def find_cc_net_nmf_clusters_parallel(network_mat, spreadsheet_mat, lap_diag, lap_pos, run_parameters,
+                                      number_of_bootstraps, smooth_spreadsheet_mat=None, bootstrap_log=None):
+    """ central loop: compute components for the consensus matrix from the input network and
+        spreadsheet matrices in a local process pool and yield them as the bootstraps complete.
+
+    Args:
+        network_mat: genes x genes symmetric matrix.
+        spreadsheet_mat: genes x samples matrix.
+        lap_dag: laplacian matrix component, L = lap_dag - lap_val.
+        lap_val: laplacian matrix component, L = lap_dag - lap_val.
+        run_parameters: dictionary of run-time parameters.
+        number_of_bootstraps: number of bootstrap workers.
+        smooth_spreadsheet_mat: (optional) rwr smoothed spreadsheet_mat to slice the bootstraps from.
+        bootstrap_log: (optional) list to append the runtime and nmf iterations of each bootstrap to.
+
+    Yields:
+        (cluster_id, sample_permutation) of each bootstrap, in completion order.
+    """
+    samples = get_bootstrap_samples(run_parameters, number_of_bootstraps)
+    parallelism = get_parallelism_locally(run_parameters, len(samples))
+
+    if shmtbx.use_shared_memory(run_parameters):
+        shared_dir = shmtbx.create_shared_directory(run_parameters)
+        try:
+            network_handle = shmtbx.share_matrix(network_mat, shared_dir, 'network_mat')
+            spreadsheet_handle = shmtbx.share_matrix(spreadsheet_mat, shared_dir, 'spreadsheet_mat')
+            lap_diag_handle = shmtbx.share_matrix(lap_diag, shared_dir, 'lap_diag')
+            lap_pos_handle = shmtbx.share_matrix(lap_pos, shared_dir, 'lap_pos')
+            smooth_spreadsheet_handle = None
+            if smooth_spreadsheet_mat is not None:
+                smooth_spreadsheet_handle = shmtbx.share_matrix(smooth_spreadsheet_mat, shared_dir,
+                                                                'smooth_spreadsheet_mat')
+            worker = partial(run_cc_net_nmf_clusters_worker_shared, network_handle, spreadsheet_handle,
+                             lap_diag_handle, lap_pos_handle, run_parameters,
+                             smooth_spreadsheet_handle=smooth_spreadsheet_handle)
+            for clustering in get_parallel_clusterings(worker, samples, parallelism, run_parameters,
+                                                       bootstrap_log):
+                yield clustering
+        finally:
+            kn.remove_dir(shared_dir)
+    else:
+        worker = partial(run_cc_net_nmf_clusters_worker, network_mat, spreadsheet_mat, lap_diag, lap_pos,
+                         run_parameters, smooth_spreadsheet_mat=smooth_spreadsheet_mat)
+        for clustering in get_parallel_clusterings(worker, samples, parallelism, run_parameters, bootstrap_log):
+            yield clustering
+
+
+def find_cc_nmf_clusters_threads(spreadsheet_mat, run_parameters, number_of_bootstraps, bootstrap_log=None):
+    """ central loop: compute components for the consensus matrix by non-negative matrix factorization
+        in a thread pool sharing spreadsheet_mat, and yield them as the bootstraps complete.
+
+    Args:
+        spreadsheet_mat: genes x samples matrix.
+        run_parameters: dictionary of run-time parameters.
+        number_of_bootstraps: number of bootstrap workers.
+        bootstrap_log: (optional) list to append the runtime and nmf iterations of each bootstrap to.
+
+    Yields:
+        (cluster_id, sample_permutation) of each bootstrap, in completion order.
+    """
+    samples = get_bootstrap_sample_lists(run_parameters, number_of_bootstraps)
+    parallelism = get_parallelism_locally(run_parameters, len(samples))
+    worker = partial(run_cc_nmf_clusters_batch, spreadsheet_mat, run_parameters)
+    for clustering in get_threads_clusterings(worker, samples, parallelism, bootstrap_log,
+                                              prtbx.get_blas_threads(run_parameters)):
+        yield clustering
+
+
+def find_cc_net_nmf_clusters_threads(network_mat, spreadsheet_mat, lap_diag, lap_pos, run_parameters,
+                                     number_of_bootstraps, smooth_spreadsheet_mat=None, bootstrap_log=None):
+    """ central loop: compute components for the consensus matrix from the input network and
+        spreadsheet matrices in a thread pool sharing them, and yield them as the bootstraps complete.
+
+    Args:
+        network_mat: genes x genes symmetric matrix.
+        spreadsheet_mat: genes x samples matrix.
+        lap_dag: laplacian matrix component, L = lap_dag - lap_val.
+        lap_val: laplacian matrix component, L = lap_dag - lap_val.
+        run_parameters: dictionary of run-time parameters.
+        number_of_bootstraps: number of bootstrap workers.
+        smooth_spreadsheet_mat: (optional) rwr smoothed spreadsheet_mat to slice the bootstraps from.
+        bootstrap_log: (optional) list to append the runtime and nmf iterations of each bootstrap to.
+
+    Yields:
+        (cluster_id, sample_permutation) of each bootstrap, in completion order.
+    """
+    samples = get_bootstrap_sample_lists(run_parameters, number_of_bootstraps)
+    parallelism = get_parallelism_locally(run_parameters, len(samples))
+    worker = partial(run_cc_net_nmf_clusters_batch, network_mat, spreadsheet_mat, lap_diag, lap_pos, run_parameters,
+                     smooth_spreadsheet_mat=smooth_spreadsheet_mat)
+    for clustering in get_threads_clusterings(worker, samples, parallelism, bootstrap_log,
+                                              prtbx.get_blas_threads(run_parameters)):
+        yield clustering
+
+
+def get_parallel_clusterings(worker, samples, parallelism, run_parameters, bootstrap_log=None):
+    """ yield the clusterings of a local process pool, scheduled and logged when bootstrap_log is given.
+
+    Args:
+        worker: bootstrap worker with all arguments but the sample bound.
+        samples: from get_bootstrap_samples.
+        parallelism: number of processes to be running in parallel.
+        run_parameters: dictionary of run-time parameters.
+        bootstrap_log: (optional) list to append the runtime and nmf iterations of each bootstrap to.
+
+    Yields:
+        the clustering of each bootstrap, in completion order.
+    """
+    blas_threads = prtbx.get_blas_threads(run_parameters)
+    if bootstrap_log is None:
+        return get_bootstrap_clusterings(parallelize_clusterings_locally(worker, samples, parallelism, blas_threads),
+                                         run_parameters)
+
+    return schedule_bootstraps(worker, samples, parallelism, 'parallel', bootstrap_log, blas_threads)
+
+
+def get_threads_clusterings(worker, samples, parallelism, bootstrap_log=None, blas_threads=None):
+    """ yield the clusterings of a thread pool of batch workers, logged when bootstrap_log is given.
+
+    Args:
+        worker: batch worker with all arguments but the sample list bound.
+        samples: from get_bootstrap_sample_lists.
+        parallelism: number of threads to be running in parallel.
+        bootstrap_log: (optional) list to append the runtime and nmf iterations of each bootstrap to.
+        blas_threads: (optional) BLAS threads limit while the threads run.
+
+    Yields:
+        the clustering of each bootstrap, in completion order.
+    """
+    if bootstrap_log is not None:
+        for clustering in schedule_bootstraps(worker, samples, parallelism, 'threads', bootstrap_log, blas_threads):
+            yield clustering
+    else:
+        for clusterings_batch in parallelize_clusterings_in_threads(worker, samples, parallelism, blas_threads):
+            for clustering in clusterings_batch:
+                yield clustering
+
+
+def schedule_bootstraps(worker, samples, parallelism, processing_method, bootstrap_log, blas_threads=None):
+    """ feed the bootstrap samples (or sample lists) one at a time to the first free worker process ("parallel") or
+        thread ("threads"), or run them in turn ("serial"), yield the clusterings in completion order
+        and log the runtime and nmf iterations of every bootstrap.
+
+    Args:
+        worker: worker(sample, return_iterations=True) returns the clustering, nmf iterations and runtime
+            (lists of them when sample is a list).
+        samples: from get_bootstrap_samples ("serial", "parallel") or get_bootstrap_sample_lists ("threads").
+        parallelism: number of processes or threads to be running in parallel.
+        processing_method: "serial", "parallel" or "threads".
+        bootstrap_log: list to append (sample, runtime, nmf iterations, batch size) of each bootstrap to,
+            the runtime of a batched bootstrap is its sampling plus the time until its nmf left the batch.
+        blas_threads: (optional) BLAS threads limit of each worker process or of the threads.
+
+    Yields:
+        the clustering of each bootstrap, in completion order.
+    """
+    timed_worker = partial(run_timed_bootstraps, worker)
+    if processing_method == 'parallel':
+        worker_results = parallelize_clusterings_locally(timed_worker, samples, parallelism, blas_threads)
+    elif processing_method == 'threads':
+        worker_results = parallelize_clusterings_in_threads(timed_worker, samples, parallelism, blas_threads)
+    else:
+        worker_results = (timed_worker(sample) for sample in samples)
+
+    try:
+        for sample_list, clusterings_batch, runtimes, iterations in worker_results:
+            for sample, runtime, nmf_iterations in zip(sample_list, runtimes, iterations):
+                bootstrap_log.append((sample, runtime, nmf_iterations, len(sample_list)))
+            for clustering in clusterings_batch:
+                yield clustering
+    finally:
+        worker_results.close()
+
+
+def run_timed_bootstraps(worker, sample):
+    """ run a worker on one sample, or one sample list, with the runtime and nmf iterations of each sample.
+
+    Args:
+        worker: worker(sample, return_iterations=True) returns the clustering, nmf iterations and runtime
+            (lists of them when sample is a list).
+        sample: sample number or list of sample numbers.
+
+    Returns:
+        sample_list: the sample numbers.
+        clusterings: list of the clustering of each sample.
+        runtimes: seconds of each sample.
+        iterations: nmf iterations of each sample.
+    """
+    if isinstance(sample, list):
+        clusterings, iterations, runtimes = worker(sample, return_iterations=True)
+        return sample, clusterings, runtimes, iterations
+
+    clustering, iterations, runtime = worker(sample, return_iterations=True)
+
+    return [sample], [clustering], [runtime], [iterations]
+
+
+def use_bootstrap_log(run_parameters):
+    """ True when the runtime and nmf iterations of each local cc bootstrap are written.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "bootstrap_log").
+
+    Returns:
+        True or False
+    """
+    return 'bootstrap_log' in run_parameters and bool(run_parameters['bootstrap_log']) and \
+           run_parameters['processing_method'] != 'distribute'
+
+
+def save_bootstrap_log(bootstrap_log, run_parameters):
+    """ write the runtime and nmf iterations of each bootstrap, in completion order.
+
+    Args:
+        bootstrap_log: from schedule_bootstraps.
+        run_parameters: parameter set dictionary.
+
+    Output:
+        bootstrap_log_{method}_{timestamp}_download.tsv
+    """
+    log_df = pd.DataFrame(bootstrap_log, columns=['bootstrap', 'runtime', 'nmf_iterations', 'batch_size'])
+    log_df.index.name = 'completion_order'
+    log_df.to_csv(get_output_file_name(run_parameters, 'bootstrap_log', 'download'), sep='\t')
+
+
+def get_parallelism_locally(run_parameters, number_of_bootstraps):
+    """ number of local worker processes, from the parallelism plan or limited by the optional
+        "parallelism" parameter.
+
+    Args:
+        run_parameters: dictionary of run-time parameters, (optional - "parallelism_plan", "parallelism").
+        number_of_bootstraps: number of bootstrap workers.
+
+    Returns:
+        parallelism: number of processes to be running in parallel.
+    """
+    if 'parallelism_plan' in run_parameters:
+        return max(1, min(run_parameters['parallelism_plan']['processes'], number_of_bootstraps))
+
+    if 'parallelism' in run_parameters:
+        return dstutil.determine_parallelism_locally(number_of_bootstraps, run_parameters['parallelism'])
+
+    return dstutil.determine_parallelism_locally(number_of_bootstraps)
+
+
+def parallelize_clusterings_locally(worker, samples, parallelism, blas_threads=None):
+    """ run worker(sample) for every bootstrap in a process pool and yield each result as it completes.
+
+    Args:
+        worker: bootstrap worker with all arguments but the sample number bound.
+        samples: bootstrap sample numbers (or sample number batches) from get_bootstrap_samples.
+        parallelism: number of processes to be running in parallel.
+        blas_threads: (optional) BLAS threads limit of each worker process.
+
+    Yields:
+        worker return values, in completion order.
+    """
+    pool = multiprocessing.Pool(processes=parallelism, initializer=prtbx.set_blas_threads, initargs=(blas_threads,))
+    completed = False
+    try:
+        for clustering in pool.imap_unordered(worker, samples, chunksize=1):
+            yield clustering
+        completed = True
+    finally:
+        if completed:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+
+
+def parallelize_clusterings_in_threads(worker, samples, parallelism, blas_threads=None):
+    """ run worker(sample) for every bootstrap in a thread pool and yield each result as it completes.
+        The threads share the worker arguments, nothing is pickled.
+
+    Args:
+        worker: thread safe bootstrap worker with all arguments but the samples bound.
+        samples: bootstrap sample number lists from get_bootstrap_sample_lists.
+        parallelism: number of threads to be running in parallel.
+        blas_threads: (optional) BLAS threads limit of the process while the threads run.
+
+    Yields:
+        worker return values, in completion order.
+    """
+    with prtbx.limit_blas_threads(blas_threads):
+        executor = ThreadPoolExecutor(max_workers=parallelism)
+        futures = [executor.submit(worker, sample) for sample in samples]
+        try:
+            for clustering_future in as_completed(futures):
+                yield clustering_future.result()
+        finally:
+            for clustering_future in futures:
+                clustering_future.cancel()
+            executor.shutdown(wait=True)
+
+
+def get_bootstrap_sample_lists(run_parameters, number_of_bootstraps):
+    """ get_bootstrap_samples with every sample number in a list, for the batch workers.
+
+    Args:
+        run_parameters: dictionary of run-time parameters, (optional - "nmf_batch_size").
+        number_of_bootstraps: number of bootstrap workers.
+
+    Returns:
+        samples: list of sample number lists.
+    """
+    if bnmftbx.get_nmf_batch_size(run_parameters) == 1:
+        return [[sample] for sample in get_bootstrap_sample_numbers(run_parameters, number_of_bootstraps)]
+
+    return get_bootstrap_samples(run_parameters, number_of_bootstraps)
+
+
+def get_bootstrap_samples(run_parameters, number_of_bootstraps):
+    """ bootstrap sample numbers, grouped in lists of "nmf_batch_size" when the nmf is batched.
+
+    Args:
+        run_parameters: dictionary of run-time parameters, (optional - "nmf_batch_size").
+        number_of_bootstraps: number of bootstrap workers.
+
+    Returns:
+        samples: range of sample numbers, or list of sample number lists.
+    """
+    sample_numbers = get_bootstrap_sample_numbers(run_parameters, number_of_bootstraps)
+    batch_size = bnmftbx.get_nmf_batch_size(run_parameters)
+    if batch_size == 1:
+        return sample_numbers
+
+    return [list(sample_numbers[first_sample:first_sample + batch_size])
+            for first_sample in range(0, len(sample_numbers), batch_size)]
+
+
+def get_bootstrap_sample_numbers(run_parameters, number_of_bootstraps):
+    """ sample numbers of the bootstraps to be run: all of them, or those without a checkpoint.
+
+    Args:
+        run_parameters: dictionary of run-time parameters, (optional - "checkpoint_samples").
+        number_of_bootstraps: number of bootstrap workers.
+
+    Returns:
+        sample_numbers: range or list of sample numbers.
+    """
+    if 'checkpoint_samples' in run_parameters:
+        return run_parameters['checkpoint_samples']
+
+    return range(0, number_of_bootstraps)
+
+
+def get_resumed_clusterings(checkpoint_clusterings, clusterings):
+    """ yield the checkpointed clusterings, then those of the bootstraps run now. Closing this generator
+        (an adaptive_bootstraps early stop) closes both sources, which stops the running workers.
+
+    Args:
+        checkpoint_clusterings: from cptbx.get_checkpoint_clusterings.
+        clusterings: clusterings of the bootstraps without a checkpoint.
+
+    Yields:
+        the clustering of each bootstrap.
+    """
+    try:
+        for clustering in checkpoint_clusterings:
+            yield clustering
+        for clustering in clusterings:
+            yield clustering
+    finally:
+        for clusterings_source in (checkpoint_clusterings, clusterings):
+            if hasattr(clusterings_source, 'close'):
+                clusterings_source.close()
+
+
+def get_bootstrap_clusterings(worker_results, run_parameters):
+    """ yield the clustering of each bootstrap from the worker results of get_bootstrap_samples samples.
+
+    Args:
+        worker_results: iterable of worker return values.
+        run_parameters: dictionary of run-time parameters, (optional - "nmf_batch_size").
+
+    Yields:
+        the clustering of each bootstrap.
+    """
+    if bnmftbx.get_nmf_batch_size(run_parameters) == 1:
+        for clustering in worker_results:
+            yield clustering
+    else:
+        for clusterings_batch in worker_results:
+            for clustering in clusterings_batch:
+                yield clustering
+
+
+def run_cc_nmf_clusters_worker(spreadsheet_mat, run_parameters, sample, return_iterations=False):
     """Worker to execute nmf_clusters in a single process
 
     Args:
         spreadsheet_mat: genes x samples matrix.
         run_parameters: dictionary of run-time parameters.
-        sample: each loops.
+        sample: each loops, or a list of them to factor with one batched nmf.
+        return_iterations: (optional) also return the nmf iterations and runtime (of each sample of a list).
 
     Returns:
-        None
+        cluster_id: cluster number of each sampled column.
+        sample_permutation: spreadsheet column index of each sampled column.
+        (a list of (cluster_id, sample_permutation), one per k, when "number_of_clusters" is a list)
+        (a list of the above, one per sample, when sample is a list)
+        (iterations, runtime: with return_iterations, lists of them when sample is a list)
 
     """
+    import time
+    from functools import partial
     import knpackage.toolbox as kn
     import numpy as np
+    import checkpoint_toolbox as cptbx
+
+    if isinstance(sample, list):
+        return run_cc_nmf_clusters_batch(spreadsheet_mat, run_parameters, sample, return_iterations)
 
+    start_time = time.time()
     np.random.seed(sample)
     rows_sampling_fraction = run_parameters["rows_sampling_fraction"]
     cols_sampling_fraction = run_parameters["cols_sampling_fraction"]
     spreadsheet_mat, sample_permutation = kn.sample_a_matrix(spreadsheet_mat,
                                                              rows_sampling_fraction, cols_sampling_fraction)
-    h_mat = kn.perform_nmf(spreadsheet_mat, run_parameters)
-    save_a_clustering_to_tmp(h_mat, sample_permutation, run_parameters, sample)
+    if return_iterations:
+        import batch_nmf_toolbox as bnmftbx
+        nmf_function = partial(bnmftbx.perform_nmf, spreadsheet_mat)
+    else:
+        nmf_function = partial(kn.perform_nmf, spreadsheet_mat)
+
+    if isinstance(run_parameters['number_of_clusters'], list):
+        clustering, iterations = get_clusterings_for_each_k(nmf_function, sample_permutation, run_parameters,
+                                                            return_iterations)
+    else:
+        h_mat, iterations = get_h_matrix(nmf_function, run_parameters, return_iterations)
+        if run_parameters['processing_method'] == 'distribute':
+            save_a_clustering_to_tmp(h_mat, sample_permutation, run_parameters, sample)
+        clustering = np.argmax(h_mat, 0), sample_permutation
 
+    cptbx.save_checkpoint(clustering, run_parameters, sample)
+    if return_iterations:
+        return clustering, iterations, time.time() - start_time
 
-def run_cc_net_nmf_clusters_worker(network_mat, spreadsheet_mat, lap_dag, lap_val, run_parameters, sample):
+    return clustering
+
+
+def run_cc_net_nmf_clusters_worker(network_mat, spreadsheet_mat, lap_dag, lap_val, run_parameters, sample,
+                                   smooth_spreadsheet_mat=None, return_iterations=False):
     """Worker to execute net_nmf_clusters in a single process
 
     Args:
@@ -248,24 +869,354 @@ def run_cc_net_nmf_clusters_worker(network_mat, spreadsheet_mat, lap_dag, lap_va
         lap_dag: laplacian matrix component, L = lap_dag - lap_val.
         lap_val: laplacian matrix component, L = lap_dag - lap_val.
         run_parameters: dictionay of run-time parameters.
-        sample: each single loop.
+        sample: each single loop, or a list of them to factor with one batched nmf.
+        smooth_spreadsheet_mat: (optional) rwr smoothed spreadsheet_mat cache to slice the columns from.
+        return_iterations: (optional) also return the nmf iterations and runtime (of each sample of a list).
 
     Returns:
-        None
+        cluster_id: cluster number of each sampled column.
+        sample_permutation: spreadsheet column index of each sampled column.
+        (a list of (cluster_id, sample_permutation), one per k, when "number_of_clusters" is a list)
+        (a list of the above, one per sample, when sample is a list)
+        (iterations, runtime: with return_iterations, lists of them when sample is a list)
     """
+    import time
+    from functools import partial
     import knpackage.toolbox as kn
     import numpy as np
+    import rwr_toolbox as rwrtbx
+    import checkpoint_toolbox as cptbx
+
+    if isinstance(sample, list):
+        return run_cc_net_nmf_clusters_batch(network_mat, spreadsheet_mat, lap_dag, lap_val, run_parameters,
+                                             sample, smooth_spreadsheet_mat, return_iterations)
 
+    start_time = time.time()
     np.random.seed(sample)
     rows_sampling_fraction = run_parameters["rows_sampling_fraction"]
     cols_sampling_fraction = run_parameters["cols_sampling_fraction"]
-    spreadsheet_mat, sample_permutation = kn.sample_a_matrix(spreadsheet_mat, rows_sampling_fraction, cols_sampling_fraction)
-    
-    spreadsheet_mat, iterations = kn.smooth_matrix_with_rwr(spreadsheet_mat, network_mat, run_parameters)
+    if smooth_spreadsheet_mat is None:
+        spreadsheet_mat, sample_permutation = kn.sample_a_matrix(spreadsheet_mat, rows_sampling_fraction,
+                                                                 cols_sampling_fraction)
+        spreadsheet_mat, iterations = rwrtbx.smooth_matrix_with_rwr(spreadsheet_mat, network_mat, run_parameters)
+    else:
+        spreadsheet_mat, sample_permutation = rwrtbx.sample_a_smoothed_matrix(
+            spreadsheet_mat, smooth_spreadsheet_mat, rows_sampling_fraction, cols_sampling_fraction)
+
     spreadsheet_mat = kn.get_quantile_norm_matrix(spreadsheet_mat)
-    h_mat = kn.perform_net_nmf(spreadsheet_mat, lap_val, lap_dag, run_parameters)
+    if return_iterations:
+        import batch_nmf_toolbox as bnmftbx
+        nmf_function = partial(bnmftbx.perform_nmf, spreadsheet_mat, lap_dag=lap_dag, lap_val=lap_val)
+    else:
+        nmf_function = partial(kn.perform_net_nmf, spreadsheet_mat, lap_val, lap_dag)
+
+    if isinstance(run_parameters['number_of_clusters'], list):
+        clustering, iterations = get_clusterings_for_each_k(nmf_function, sample_permutation, run_parameters,
+                                                            return_iterations)
+    else:
+        h_mat, iterations = get_h_matrix(nmf_function, run_parameters, return_iterations)
+        if run_parameters['processing_method'] == 'distribute':
+            save_a_clustering_to_tmp(h_mat, sample_permutation, run_parameters, sample)
+        clustering = np.argmax(h_mat, 0), sample_permutation
+
+    cptbx.save_checkpoint(clustering, run_parameters, sample)
+    if return_iterations:
+        return clustering, iterations, time.time() - start_time
+
+    return clustering
+
+
+def run_cc_nmf_clusters_batch(spreadsheet_mat, run_parameters, samples, return_iterations=False):
+    """ run_cc_nmf_clusters_worker of a list of samples, factoring their sampled spreadsheets together.
+        Each sample draws from its own np.random.RandomState(sample), so batches can run in threads.
+
+    Args:
+        spreadsheet_mat: genes x samples matrix.
+        run_parameters: dictionary of run-time parameters.
+        samples: list of sample numbers.
+        return_iterations: (optional) also return the nmf iterations and runtime of each sample.
+
+    Returns:
+        clusterings: list of run_cc_nmf_clusters_worker return values, one per sample.
+        (iterations: nmf iterations of each sample, with return_iterations)
+        (runtimes: seconds of each sample, its sampling plus its nmf in the batch, with return_iterations)
+    """
+    x_list = []
+    sample_permutations = []
+    random_states = []
+    sample_runtimes = []
+    for sample in samples:
+        start_time = time.time()
+        random_state = np.random.RandomState(sample)
+        sample_mat, sample_permutation = sample_a_matrix(spreadsheet_mat, run_parameters["rows_sampling_fraction"],
+                                                         run_parameters["cols_sampling_fraction"], random_state)
+        x_list.append(sample_mat)
+        sample_permutations.append(sample_permutation)
+        random_states.append(random_state)
+        sample_runtimes.append(time.time() - start_time)
+
+    batch_results = get_clusterings_of_batch(x_list, sample_permutations, random_states, run_parameters,
+                                             return_iterations=return_iterations)
+    save_checkpoints_of_batch(batch_results, run_parameters, samples, return_iterations)
+
+    return add_sample_runtimes(batch_results, sample_runtimes, return_iterations)
+
+
+def run_cc_net_nmf_clusters_batch(network_mat, spreadsheet_mat, lap_dag, lap_val, run_parameters, samples,
+                                  smooth_spreadsheet_mat=None, return_iterations=False):
+    """ run_cc_net_nmf_clusters_worker of a list of samples, factoring their smoothed spreadsheets together.
+        Each sample draws from its own np.random.RandomState(sample), so batches can run in threads.
+
+    Args:
+        network_mat: genes x genes symmetric matrix.
+        spreadsheet_mat: genes x samples matrix.
+        lap_dag: laplacian matrix component, L = lap_dag - lap_val.
+        lap_val: laplacian matrix component, L = lap_dag - lap_val.
+        run_parameters: dictionay of run-time parameters.
+        samples: list of sample numbers.
+        smooth_spreadsheet_mat: (optional) rwr smoothed spreadsheet_mat cache to slice the columns from.
+        return_iterations: (optional) also return the nmf iterations and runtime of each sample.
+
+    Returns:
+        clusterings: list of run_cc_net_nmf_clusters_worker return values, one per sample.
+        (iterations: nmf iterations of each sample, with return_iterations)
+        (runtimes: seconds of each sample, its sampling and smoothing plus its nmf in the batch,
+            with return_iterations)
+    """
+    rows_sampling_fraction = run_parameters["rows_sampling_fraction"]
+    cols_sampling_fraction = run_parameters["cols_sampling_fraction"]
+    x_list = []
+    sample_permutations = []
+    random_states = []
+    sample_runtimes = []
+    for sample in samples:
+        start_time = time.time()
+        random_state = np.random.RandomState(sample)
+        if smooth_spreadsheet_mat is None:
+            sample_mat, sample_permutation = sample_a_matrix(spreadsheet_mat, rows_sampling_fraction,
+                                                             cols_sampling_fraction, random_state)
+            sample_mat, iterations = rwrtbx.smooth_matrix_with_rwr(sample_mat, network_mat, run_parameters)
+        else:
+            sample_mat, sample_permutation = rwrtbx.sample_a_smoothed_matrix(
+                spreadsheet_mat, smooth_spreadsheet_mat, rows_sampling_fraction, cols_sampling_fraction, random_state)
+
+        x_list.append(kn.get_quantile_norm_matrix(sample_mat))
+        sample_permutations.append(sample_permutation)
+        random_states.append(random_state)
+        sample_runtimes.append(time.time() - start_time)
+
+    batch_results = get_clusterings_of_batch(x_list, sample_permutations, random_states, run_parameters, lap_dag,
+                                             lap_val, return_iterations)
+    save_checkpoints_of_batch(batch_results, run_parameters, samples, return_iterations)
+
+    return add_sample_runtimes(batch_results, sample_runtimes, return_iterations)
+
+
+def save_checkpoints_of_batch(batch_results, run_parameters, samples, return_iterations=False):
+    """ checkpoint the clustering of every sample of a batch (see cptbx.save_checkpoint).
+
+    Args:
+        batch_results: from get_clusterings_of_batch.
+        run_parameters: dictionary of run-time parameters, (optional - "checkpoint_run_directory").
+        samples: list of sample numbers.
+        return_iterations: batch_results also holds the nmf iterations.
+    """
+    clusterings = batch_results[0] if return_iterations else batch_results
+    for sample, clustering in zip(samples, clusterings):
+        cptbx.save_checkpoint(clustering, run_parameters, sample)
+
+
+def add_sample_runtimes(batch_results, sample_runtimes, return_iterations=False):
+    """ add the sampling seconds of each sample of a batch to its nmf runtime.
+
+    Args:
+        batch_results: from get_clusterings_of_batch.
+        sample_runtimes: sampling (and smoothing) seconds of each sample.
+        return_iterations: batch_results also holds the nmf iterations and runtimes.
+
+    Returns:
+        batch_results: with the runtime of each sample, with return_iterations.
+    """
+    if not return_iterations:
+        return batch_results
+
+    clusterings, iterations, runtimes = batch_results
+
+    return clusterings, iterations, [runtime + sample_runtime for runtime, sample_runtime in zip(runtimes, sample_runtimes)]
+
+
+def sample_a_matrix(spreadsheet_mat, rows_fraction, cols_fraction, random_state):
+    """ kn.sample_a_matrix drawing from random_state instead of the global generator.
+
+    Args:
+        spreadsheet_mat: gene x sample spread sheet as matrix.
+        rows_fraction: decimal fraction of rows kept - [0 : 1].
+        cols_fraction: decimal fraction of columns kept - [0 : 1].
+        random_state: np.random.RandomState to draw from.
+
+    Returns:
+        sample_random: A specified precentage sample of the spread sheet.
+        sample_permutation: the array that correponds to columns sample.
+    """
+    features_size = int(np.round(spreadsheet_mat.shape[0] * (1 - rows_fraction)))
+    features_permutation = random_state.permutation(spreadsheet_mat.shape[0])
+    features_permutation = features_permutation[0:features_size].T
+
+    patients_size = int(np.round(spreadsheet_mat.shape[1] * cols_fraction))
+    sample_permutation = random_state.permutation(spreadsheet_mat.shape[1])
+    sample_permutation = sample_permutation[0:patients_size]
+
+    sample_random = spreadsheet_mat[:, sample_permutation]
+    sample_random[features_permutation[:, None], :] = 0
+
+    positive_col_set = sum(sample_random) > 0
+    sample_random = sample_random[:, positive_col_set]
+    sample_permutation = sample_permutation[positive_col_set]
 
-    save_a_clustering_to_tmp(h_mat, sample_permutation, run_parameters, sample)
+    return sample_random, sample_permutation
+
+
+def get_clusterings_of_batch(x_list, sample_permutations, random_states, run_parameters, lap_dag=None,
+                             lap_val=None, return_iterations=False):
+    """ cluster the sampled spreadsheets of a batch with bnmftbx.perform_nmf_list, once per k of a sweep,
+        each k starting from the same random states so that its result equals a single k run.
+
+    Args:
+        x_list: list of sampled spreadsheets.
+        sample_permutations: spreadsheet column index of the sampled columns, one per sampled spreadsheet.
+        random_states: np.random.RandomState to start the nmf of each sampled spreadsheet from.
+        run_parameters: dictionary of run-time parameters.
+        lap_dag: (optional) laplacian matrix component for network based nmf.
+        lap_val: (optional) laplacian matrix component for network based nmf.
+        return_iterations: (optional) also return the nmf iterations and runtime of each sampled spreadsheet.
+
+    Returns:
+        clusterings: list of (cluster_id, sample_permutation), or of lists of them, one per k, in a sweep.
+        (iterations: nmf iterations of each sampled spreadsheet, summed over a sweep, with return_iterations)
+        (runtimes: nmf seconds of each sampled spreadsheet in the batch, summed over a sweep, with return_iterations)
+    """
+    if is_number_of_clusters_sweep(run_parameters):
+        number_of_clusters_list = run_parameters['number_of_clusters']
+    else:
+        number_of_clusters_list = [run_parameters['number_of_clusters']]
+
+    initial_states = [random_state.get_state() for random_state in random_states]
+    clusterings = [[] for sample_permutation in sample_permutations]
+    iterations = np.zeros(len(x_list), dtype=int)
+    runtimes = np.zeros(len(x_list))
+    for number_of_clusters in number_of_clusters_list:
+        for random_state, initial_state in zip(random_states, initial_states):
+            random_state.set_state(initial_state)
+        k_parameters = get_number_of_clusters_parameters(run_parameters, number_of_clusters)
+        h_list, iterations_list, runtimes_list = bnmftbx.perform_nmf_list(x_list, random_states, k_parameters,
+                                                                          lap_dag, lap_val, return_iterations=True)
+        iterations += iterations_list
+        runtimes += runtimes_list
+        for clusterings_list, h_mat, sample_permutation in zip(clusterings, h_list, sample_permutations):
+            clusterings_list.append((np.argmax(h_mat, 0), sample_permutation))
+
+    if not is_number_of_clusters_sweep(run_parameters):
+        clusterings = [clusterings_list[0] for clusterings_list in clusterings]
+    if return_iterations:
+        return clusterings, iterations.tolist(), runtimes.tolist()
+
+    return clusterings
+
+
+def get_clusterings_for_each_k(nmf_function, sample_permutation, run_parameters, return_iterations=False):
+    """ factor one bootstrap sample for every k of the "number_of_clusters" list, each k starting
+        from the same random state so that its result equals a single k run.
+
+    Args:
+        nmf_function: nmf_function(run_parameters) returns the h_matrix of the sampled spreadsheet,
+            and its nmf iterations with return_iterations.
+        sample_permutation: spreadsheet column index of each sampled column.
+        run_parameters: dictionary of run-time parameters with a "number_of_clusters" list.
+        return_iterations: (optional) nmf_function also returns the nmf iterations.
+
+    Returns:
+        clusterings: list of (cluster_id, sample_permutation), one per k.
+        iterations: nmf iterations summed over the k, None without return_iterations.
+    """
+    random_state = np.random.get_state()
+    clusterings = []
+    iterations = 0 if return_iterations else None
+    for number_of_clusters in run_parameters['number_of_clusters']:
+        np.random.set_state(random_state)
+        h_mat, k_iterations = get_h_matrix(nmf_function, get_number_of_clusters_parameters(
+            run_parameters, number_of_clusters), return_iterations)
+        clusterings.append((np.argmax(h_mat, 0), sample_permutation))
+        if return_iterations:
+            iterations += k_iterations
+
+    return clusterings, iterations
+
+
+def get_h_matrix(nmf_function, run_parameters, return_iterations=False):
+    """ call an nmf function that returns the h_matrix, or (h_matrix, iterations) with return_iterations.
+
+    Args:
+        nmf_function: nmf_function(run_parameters) of the sampled spreadsheet.
+        run_parameters: dictionary of run-time parameters.
+        return_iterations: (optional) nmf_function also returns the nmf iterations.
+
+    Returns:
+        h_mat: nonnegative right factor matrix (H).
+        iterations: nmf iterations, None without return_iterations.
+    """
+    if return_iterations:
+        return nmf_function(run_parameters)
+
+    return nmf_function(run_parameters), None
+
+
+def run_cc_nmf_clusters_worker_shared(spreadsheet_handle, run_parameters, sample, return_iterations=False):
+    """Worker to execute nmf_clusters on a memory-mapped spreadsheet in a single process
+
+    Args:
+        spreadsheet_handle: handle of the genes x samples matrix from shmtbx.share_matrix.
+        run_parameters: dictionary of run-time parameters.
+        sample: each loops.
+        return_iterations: (optional) also return the nmf iterations and runtime (of each sample of a list).
+
+    Returns:
+        cluster_id: cluster number of each sampled column.
+        sample_permutation: spreadsheet column index of each sampled column.
+    """
+    spreadsheet_mat = shmtbx.attach_shared_matrix(spreadsheet_handle)
+
+    return run_cc_nmf_clusters_worker(spreadsheet_mat, run_parameters, sample, return_iterations)
+
+
+def run_cc_net_nmf_clusters_worker_shared(network_handle, spreadsheet_handle, lap_dag_handle, lap_val_handle,
+                                          run_parameters, sample, smooth_spreadsheet_handle=None,
+                                          return_iterations=False):
+    """Worker to execute net_nmf_clusters on memory-mapped network and spreadsheet in a single process
+
+    Args:
+        network_handle: handle of the genes x genes symmetric matrix from shmtbx.share_matrix.
+        spreadsheet_handle: handle of the genes x samples matrix.
+        lap_dag_handle: handle of the laplacian matrix component, L = lap_dag - lap_val.
+        lap_val_handle: handle of the laplacian matrix component, L = lap_dag - lap_val.
+        run_parameters: dictionay of run-time parameters.
+        sample: each single loop.
+        smooth_spreadsheet_handle: (optional) handle of the rwr smoothed spreadsheet_mat cache.
+        return_iterations: (optional) also return the nmf iterations and runtime (of each sample of a list).
+
+    Returns:
+        cluster_id: cluster number of each sampled column.
+        sample_permutation: spreadsheet column index of each sampled column.
+    """
+    network_mat = shmtbx.attach_shared_matrix(network_handle)
+    spreadsheet_mat = shmtbx.attach_shared_matrix(spreadsheet_handle)
+    lap_dag = shmtbx.attach_shared_matrix(lap_dag_handle)
+    lap_val = shmtbx.attach_shared_matrix(lap_val_handle)
+    smooth_spreadsheet_mat = None
+    if smooth_spreadsheet_handle is not None:
+        smooth_spreadsheet_mat = shmtbx.attach_shared_matrix(smooth_spreadsheet_handle)
+
+    return run_cc_net_nmf_clusters_worker(network_mat, spreadsheet_mat, lap_dag, lap_val, run_parameters, sample,
+                                          smooth_spreadsheet_mat, return_iterations)
 
 
 def save_a_clustering_to_tmp(h_matrix, sample_permutation, run_parameters, sequence_number):
@@ -294,43 +1245,291 @@ def save_a_clustering_to_tmp(h_matrix, sample_permutation, run_parameters, seque
         sample_permutation.dump(fh1)
 
 
-def form_consensus_matrix(run_parameters, number_of_samples):
-    """ compute the consensus matrix from the indicator and linkage matrix inputs
-        formed by the bootstrap "temp_*" files.
+def form_consensus_matrix(clusterings, number_of_samples, run_parameters):
+    """ compute the consensus matrix from the indicator and linkage matrices
+        summed over the bootstrap clusterings.
 
     Args:
-        run_parameters: parameter set dictionary with "tmp_directory" key.
-        linkage_matrix: linkage matrix from initialization or previous call.
-        indicator_matrix: indicator matrix from initialization or previous call.
+        clusterings: iterable of (cluster_id, sample_permutation), one per bootstrap.
+        number_of_samples: number of spreadsheet columns.
+        run_parameters: parameter set dictionary, (optional - "consensus_batch_size", "consensus_format",
+            "consensus_neighbors", "consensus_memory_budget" - above it the matrix is formed "tiled",
+            "tiled_consensus_directory" - from cmtbx.tiled_consensus_directory).
 
     Returns:
-        consensus_matrix: (sum of linkage matrices) / (sum of indicator matrices).
+        consensus_matrix: (sum of linkage matrices) / (sum of indicator matrices), in the
+            cmtbx.get_consensus_format representation.
     """
+    batch_size = get_consensus_batch_size(run_parameters)
+    consensus_format = cmtbx.get_consensus_format(run_parameters)
+    if consensus_format == 'dense' and not cmtbx.fits_memory_budget(number_of_samples, run_parameters):
+        consensus_format = 'tiled'
+
+    if consensus_format == 'tiled':
+        memory_budget = cmtbx.get_consensus_memory_budget(run_parameters)
+        if memory_budget is None:
+            memory_budget = 3 * 8 * number_of_samples ** 2
+        if 'tiled_consensus_directory' in run_parameters:
+            tiled_dir = run_parameters['tiled_consensus_directory']
+            os.makedirs(tiled_dir, exist_ok=True)
+        else:
+            tiled_dir = kn.create_dir(run_parameters['run_directory'], cmtbx.TILED_CONSENSUS_DIRECTORY)
+        return cmtbx.form_tiled_consensus_matrix(clusterings, number_of_samples, run_parameters['number_of_bootstraps'],
+                                                 tiled_dir, memory_budget, batch_size)
+
+    if consensus_format != 'dense':
+        consensus_matrix = cmtbx.form_packed_consensus_matrix(clusterings, number_of_samples,
+                                                              run_parameters['number_of_bootstraps'], batch_size)
+        if consensus_format == 'knn':
+            consensus_matrix = cmtbx.get_knn_consensus_matrix(consensus_matrix,
+                                                              cmtbx.get_consensus_neighbors(run_parameters))
+        return consensus_matrix
+
     linkage_matrix = np.zeros((number_of_samples, number_of_samples))
     indicator_matrix = linkage_matrix.copy()
 
-    linkage_matrix, indicator_matrix = get_linkage_matrix(run_parameters, linkage_matrix, indicator_matrix)
+    linkage_matrix, indicator_matrix = get_linkage_matrix(clusterings, linkage_matrix, indicator_matrix, batch_size)
     consensus_matrix = linkage_matrix / np.maximum(indicator_matrix, 1)
 
     return consensus_matrix
 
 
-def get_linkage_matrix(run_parameters, linkage_matrix, indicator_matrix):
-    """ read bootstrap temp_h* and temp_p* files, compute and add the linkage_matrix.
+def form_consensus_matrix_adaptive(clusterings, number_of_samples, run_parameters):
+    """ compute the consensus matrix like form_consensus_matrix, but stop taking bootstrap clusterings
+        once the consensus matrix is stable: every "bootstrap_check_window" bootstraps the largest entry
+        change since the previous check is compared with "consensus_tolerance". The clusterings
+        iterable is closed when it stops early, which ends the bootstraps still running.
 
     Args:
-        run_parameters: parameter set dictionary.
+        clusterings: iterable of (cluster_id, sample_permutation), at most "number_of_bootstraps" of them.
+        number_of_samples: number of spreadsheet columns.
+        run_parameters: parameter set dictionary, (optional - "bootstrap_check_window", "consensus_tolerance").
+
+    Returns:
+        consensus_matrix: (sum of linkage matrices) / (sum of indicator matrices).
+        convergence_df: consensus change at each check, indexed by the number of bootstraps used.
+    """
+    check_window, consensus_tolerance = get_bootstrap_convergence_parameters(run_parameters)
+
+    linkage_matrix = np.zeros((number_of_samples, number_of_samples))
+    indicator_matrix = linkage_matrix.copy()
+    consensus_matrix = linkage_matrix.copy()
+
+    number_of_bootstraps = 0
+    convergence_trace = []
+    converged = False
+    clusterings_batch = []
+    for clustering in clusterings:
+        clusterings_batch.append(clustering)
+        if len(clusterings_batch) < check_window:
+            continue
+        linkage_matrix, indicator_matrix = update_linkage_matrix_batch(clusterings_batch, linkage_matrix,
+                                                                       indicator_matrix)
+        number_of_bootstraps += len(clusterings_batch)
+        clusterings_batch = []
+
+        previous_consensus_matrix = consensus_matrix
+        consensus_matrix = linkage_matrix / np.maximum(indicator_matrix, 1)
+        consensus_change = np.abs(consensus_matrix - previous_consensus_matrix)
+        converged = number_of_bootstraps > check_window and consensus_change.max() <= consensus_tolerance
+        convergence_trace.append([number_of_bootstraps, consensus_change.max(), consensus_change.mean(), converged])
+        if converged:
+            break
+
+    if converged:
+        if hasattr(clusterings, 'close'):
+            clusterings.close()
+    elif len(clusterings_batch) > 0:
+        linkage_matrix, indicator_matrix = update_linkage_matrix_batch(clusterings_batch, linkage_matrix,
+                                                                       indicator_matrix)
+        number_of_bootstraps += len(clusterings_batch)
+        previous_consensus_matrix = consensus_matrix
+        consensus_matrix = linkage_matrix / np.maximum(indicator_matrix, 1)
+        consensus_change = np.abs(consensus_matrix - previous_consensus_matrix)
+        convergence_trace.append([number_of_bootstraps, consensus_change.max(), consensus_change.mean(), False])
+
+    convergence_df = pd.DataFrame(convergence_trace, columns=['number_of_bootstraps', 'max_consensus_change',
+                                                              'mean_consensus_change', 'converged'])
+
+    return consensus_matrix, convergence_df.set_index('number_of_bootstraps')
+
+
+def use_adaptive_bootstraps(run_parameters):
+    """ True when "number_of_bootstraps" is only the upper limit of an adaptive bootstrap count.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "adaptive_bootstraps").
+
+    Returns:
+        True or False
+    """
+    return 'adaptive_bootstraps' in run_parameters and bool(run_parameters['adaptive_bootstraps'])
+
+
+def get_bootstrap_convergence_parameters(run_parameters):
+    """ adaptive bootstrap stopping rule parameters.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "bootstrap_check_window", "consensus_tolerance").
+
+    Returns:
+        check_window: number of bootstraps between two consensus checks, 10 by default.
+        consensus_tolerance: largest consensus entry change over a window to stop at, 0.01 by default.
+    """
+    check_window = 10
+    consensus_tolerance = 0.01
+    if 'bootstrap_check_window' in run_parameters:
+        check_window = max(1, int(run_parameters['bootstrap_check_window']))
+    if 'consensus_tolerance' in run_parameters:
+        consensus_tolerance = float(run_parameters['consensus_tolerance'])
+
+    return check_window, consensus_tolerance
+
+
+def form_consensus_matrices_for_each_k(clusterings, number_of_samples, run_parameters):
+    """ compute one consensus matrix per k of a "number_of_clusters" sweep; all k share the
+        bootstrap samples, hence the indicator matrix.
+
+    Args:
+        clusterings: iterable of lists of (cluster_id, sample_permutation), one list per bootstrap
+            and one clustering per k.
+        number_of_samples: number of spreadsheet columns.
+        run_parameters: parameter set dictionary with a "number_of_clusters" list.
+        pipeline: (optional) pipeline_toolbox pipeline to write the files in.
+
+    Returns:
+        consensus_matrices: list of consensus matrices, one per k.
+    """
+    batch_size = get_consensus_batch_size(run_parameters)
+
+    linkage_matrices = [np.zeros((number_of_samples, number_of_samples))
+                        for number_of_clusters in run_parameters['number_of_clusters']]
+    indicator_matrix = np.zeros((number_of_samples, number_of_samples))
+
+    clusterings_batch = []
+    for clusterings_list in clusterings:
+        clusterings_batch.append(clusterings_list)
+        if len(clusterings_batch) >= batch_size:
+            indicator_matrix = update_linkage_matrices_for_each_k(clusterings_batch, linkage_matrices,
+                                                                  indicator_matrix)
+            clusterings_batch = []
+
+    if len(clusterings_batch) > 0:
+        indicator_matrix = update_linkage_matrices_for_each_k(clusterings_batch, linkage_matrices, indicator_matrix)
+
+    indicator_matrix = np.maximum(indicator_matrix, 1)
+
+    return [linkage_matrix / indicator_matrix for linkage_matrix in linkage_matrices]
+
+
+def update_linkage_matrices_for_each_k(clusterings_batch, linkage_matrices, indicator_matrix):
+    """ add a batch of sweep clusterings to the per k linkage matrices (in place) and the shared indicator.
+
+    Args:
+        clusterings_batch: list of lists of (cluster_id, sample_permutation), one clustering per k.
+        linkage_matrices: list of connectivity matrices, one per k.
+        indicator_matrix: indicator matrix.
+
+    Returns:
+        indicator_matrix: indicator matrix incremented at the batch sample_permutation locations.
+    """
+    for k_index in range(0, len(linkage_matrices)):
+        k_batch = [clusterings_list[k_index] for clusterings_list in clusterings_batch]
+        if k_index == 0:
+            linkage_matrices[k_index], indicator_matrix = update_linkage_matrix_batch(
+                k_batch, linkage_matrices[k_index], indicator_matrix)
+        else:
+            linkage_matrices[k_index], unused = update_linkage_matrix_batch(k_batch, linkage_matrices[k_index], None)
+
+    return indicator_matrix
+
+
+def get_consensus_batch_size(run_parameters):
+    """ number of bootstrap clusterings summed per consensus update.
+
+    Args:
+        run_parameters: parameter set dictionary, (optional - "consensus_batch_size").
+
+    Returns:
+        batch_size: positive integer, 20 by default.
+    """
+    if 'consensus_batch_size' in run_parameters:
+        return max(1, int(run_parameters['consensus_batch_size']))
+
+    return 20
+
+
+def get_linkage_matrix(clusterings, linkage_matrix, indicator_matrix, batch_size=1):
+    """ fold the bootstrap clusterings into the linkage and indicator matrices as they arrive,
+        batch_size clusterings at a time.
+
+    Args:
+        clusterings: iterable of (cluster_id, sample_permutation), one per bootstrap.
         linkage_matrix: connectivity matrix from initialization or previous call.
+        indicator_matrix: indicator matrix from initialization or previous call.
+        batch_size: number of clusterings summed by each update_linkage_matrix_batch call.
 
     Returns:
-        linkage_matrix: summed with "temp_h*" files in run_parameters["tmp_directory"].
+        linkage_matrix: summed with the linkage of every clustering.
+        indicator_matrix: summed with the sample permutation of every clustering.
+    """
+    clusterings_batch = []
+    for clustering in clusterings:
+        clusterings_batch.append(clustering)
+        if len(clusterings_batch) >= batch_size:
+            linkage_matrix, indicator_matrix = update_linkage_matrix_batch(
+                clusterings_batch, linkage_matrix, indicator_matrix)
+            clusterings_batch = []
+
+    if len(clusterings_batch) > 0:
+        linkage_matrix, indicator_matrix = update_linkage_matrix_batch(
+            clusterings_batch, linkage_matrix, indicator_matrix)
+
+    return linkage_matrix, indicator_matrix
+
+
+def update_linkage_matrix_batch(clusterings_batch, linkage_matrix, indicator_matrix):
+    """ add a batch of clusterings to the linkage and indicator matrices with one matrix product each:
+        linkage += Z'.Z and indicator += S'.S, where Z stacks the one-hot cluster assignments
+        ((bootstraps * k) x samples) and S the sampled columns (bootstraps x samples) of the batch.
+
+    Args:
+        clusterings_batch: list of (cluster_id, sample_permutation).
+        linkage_matrix: connectivity matrix.
+        indicator_matrix: indicator matrix, or None to skip it.
+
+    Returns:
+        linkage_matrix: connectivity matrix summed with the batch linkages.
+        indicator_matrix: indicator matrix incremented at the batch sample_permutation locations.
+    """
+    number_of_samples = linkage_matrix.shape[1]
+    encode_mat, sample_mat = cmtbx.get_clusterings_encoding(clusterings_batch, number_of_samples, linkage_matrix.dtype)
+
+    block_rows = cmtbx.get_block_rows(number_of_samples)
+    for row_start in range(0, linkage_matrix.shape[0], block_rows):
+        row_stop = min(row_start + block_rows, linkage_matrix.shape[0])
+        linkage_matrix[row_start:row_stop] += encode_mat[:, row_start:row_stop].T.dot(encode_mat)
+        if indicator_matrix is not None:
+            indicator_matrix[row_start:row_stop] += sample_mat[:, row_start:row_stop].T.dot(sample_mat)
+
+    return linkage_matrix, indicator_matrix
+
+
+def get_clusterings_from_tmp(run_parameters):
+    """ read the bootstrap temp_h* and temp_p* files written by the distribute workers.
+
+    Args:
+        run_parameters: parameter set dictionary.
+
+    Yields:
+        (cluster_id, sample_permutation) of each bootstrap file pair.
     """
     if run_parameters['processing_method'] == 'distribute':
         tmp_dir = os.path.join(run_parameters['cluster_shared_volumn'],
                                os.path.basename(os.path.normpath(run_parameters['tmp_directory'])))
     else:
         tmp_dir = run_parameters["tmp_directory"]
-        
+
     dir_list = os.listdir(tmp_dir)
     for tmp_f in dir_list:
         if tmp_f[0:6] == 'tmp_p_':
@@ -338,99 +1537,229 @@ def get_linkage_matrix(run_parameters, linkage_matrix, indicator_matrix):
             hname = os.path.join(tmp_dir, 'tmp_h_' + tmp_f[6:len(tmp_f)])
 
             sample_permutation = np.load(pname)
-            h_mat = np.load(hname)
-
-            linkage_matrix = kn.update_linkage_matrix(h_mat, sample_permutation, linkage_matrix)
-            indicator_matrix = kn.update_indicator_matrix(sample_permutation, indicator_matrix)
+            cluster_id = np.load(hname)
 
-    return linkage_matrix, indicator_matrix
+            yield cluster_id, sample_permutation
 
 
-def save_spreadsheet_and_variance_heatmap(spreadsheet_df, labels, run_parameters, network_mat=None):
+def save_spreadsheet_and_variance_heatmap(spreadsheet_df, labels, run_parameters, network_mat=None,
+                                          smooth_spreadsheet_mat=None):
     """ save the full genes by samples spreadsheet as processed or smoothed if network is provided.
         Also save variance in separate file.
     Args:
         spreadsheet_df: the dataframe as processed
         run_parameters: with keys for "results_directory", "method", (optional - "top_number_of_genes")
         network_mat:    (if appropriate) normalized network adjacency matrix used in processing
+        smooth_spreadsheet_mat: (optional) spreadsheet_df values already smoothed with network_mat by the run
 
     Output:
-        genes_by_samples_heatmp_{method}_{timestamp}_viz.tsv
+        genes_by_samples_heatmp_{method}_{timestamp}_viz.tsv (.npz, .h5 or .parquet with "output_format")
         genes_averages_by_cluster_{method}_{timestamp}_viz.tsv
         top_genes_by_cluster_{method}_{timestamp}_download.tsv
     """
-    if network_mat is not None:
-        sample_smooth, nun = kn.smooth_matrix_with_rwr(spreadsheet_df.as_matrix(), network_mat, run_parameters)
+    if smooth_spreadsheet_mat is not None:
+        clusters_df = pd.DataFrame(smooth_spreadsheet_mat, index=spreadsheet_df.index.values,
+                                   columns=spreadsheet_df.columns.values)
+    elif network_mat is not None:
+        sample_smooth, nun = rwrtbx.smooth_matrix_with_rwr(spreadsheet_df.as_matrix(), network_mat, run_parameters)
         clusters_df = pd.DataFrame(sample_smooth, index=spreadsheet_df.index.values, columns=spreadsheet_df.columns.values)
     else:
         clusters_df = spreadsheet_df
 
-    clusters_df.to_csv(get_output_file_name(run_parameters, 'genes_by_samples_heatmap', 'viz'), sep='\t')
+    output_format = rftbx.get_output_format(run_parameters)
+    heatmap_file_name = get_output_file_name(run_parameters, 'genes_by_samples_heatmap', 'viz',
+                                             rftbx.get_output_type_suffix(run_parameters))
+    if output_format == 'tsv':
+        clusters_df.to_csv(heatmap_file_name, sep='\t')
+    else:
+        rftbx.save_matrix(clusters_df.values, clusters_df.index.values, clusters_df.columns.values,
+                          heatmap_file_name, output_format)
+
+    cluster_report = get_cluster_report(spreadsheet_df.values, clusters_df.values, labels,
+                                        run_parameters['top_number_of_genes'])
+    col_labels = ['Cluster_%d' % (cluster_number) for cluster_number in cluster_report['cluster_numbers']]
 
-    cluster_ave_df = pd.DataFrame({i: spreadsheet_df.iloc[:, labels == i].mean(axis=1) for i in np.unique(labels)})
-    col_labels = []
-    for cluster_number in np.unique(labels):
-        col_labels.append('Cluster_%d'%(cluster_number))
-    cluster_ave_df.columns = col_labels
+    cluster_ave_df = pd.DataFrame(cluster_report['cluster_averages'], index=spreadsheet_df.index.values,
+                                  columns=col_labels)
     cluster_ave_df.to_csv(get_output_file_name(run_parameters, 'genes_averages_by_cluster', 'viz'), sep='\t')
 
-    clusters_variance_df = pd.DataFrame(clusters_df.var(axis=1), columns=['variance'])
+    clusters_variance_df = pd.DataFrame(cluster_report['variance'], index=clusters_df.index.values,
+                                        columns=['variance'])
     clusters_variance_df.to_csv(get_output_file_name(run_parameters, 'genes_variance', 'viz'), sep='\t')
 
-    top_number_of_genes_df = pd.DataFrame(data=np.zeros((cluster_ave_df.shape)), columns=cluster_ave_df.columns,
-                                          index=cluster_ave_df.index.values)
-
-    top_number_of_genes = run_parameters['top_number_of_genes']
-    for sample in top_number_of_genes_df.columns.values:
-        top_index = np.argsort(cluster_ave_df[sample].values)[::-1]
-        top_number_of_genes_df[sample].iloc[top_index[0:top_number_of_genes]] = 1
+    top_number_of_genes_df = pd.DataFrame(cluster_report['top_genes'], index=spreadsheet_df.index.values,
+                                          columns=col_labels)
     top_number_of_genes_df.to_csv(get_output_file_name(run_parameters, 'top_genes_by_cluster', 'download'), sep='\t')
 
 
-def save_consensus_clustering(consensus_matrix, sample_names, labels, run_parameters):
+def get_cluster_report(spreadsheet_mat, clusters_mat, labels, top_number_of_genes):
+    """ per cluster gene averages, gene variance and top genes of each cluster: the averages are one
+        product with the samples x clusters label indicator matrix and the top genes are selected by
+        argpartition.
+
+    Args:
+        spreadsheet_mat: genes x samples matrix the cluster averages are taken from.
+        clusters_mat: genes x samples heatmap matrix (spreadsheet_mat or its smoothed version).
+        labels: cluster number of each sample.
+        top_number_of_genes: number of top genes selected per cluster.
+
+    Returns:
+        cluster_report: dictionary with keys "cluster_numbers" (sorted unique labels), "cluster_averages"
+            (genes x clusters), "variance" (per gene variance of clusters_mat) and "top_genes"
+            (genes x clusters, 1 for the top_number_of_genes largest averages of the cluster, else 0).
+    """
+    labels = np.asarray(labels)
+    cluster_numbers = np.unique(labels)
+    indicator_mat = np.float64(labels[:, None] == cluster_numbers[None, :])
+    cluster_averages = np.dot(spreadsheet_mat, indicator_mat) / indicator_mat.sum(axis=0)
+
+    top_genes = np.zeros(cluster_averages.shape)
+    number_of_genes = cluster_averages.shape[0]
+    if top_number_of_genes >= number_of_genes:
+        top_genes[:] = 1
+    elif top_number_of_genes > 0:
+        top_index = np.argpartition(-cluster_averages, top_number_of_genes - 1, axis=0)[0:top_number_of_genes]
+        top_genes[top_index, np.arange(0, cluster_numbers.size)[None, :]] = 1
+
+    return {'cluster_numbers': cluster_numbers, 'cluster_averages': cluster_averages,
+            'variance': np.var(clusters_mat, axis=1, ddof=1), 'top_genes': top_genes}
+
+
+def save_consensus_clustering(consensus_matrix, sample_names, labels, run_parameters, pipeline=None):
     """ write the consensus matrix as a dataframe with sample_names column lablels
         and cluster labels as row labels.
 
     Args:
-        consensus_matrix: sample_names x sample_names numerical matrix.
+        consensus_matrix: sample_names x sample_names numerical matrix (dense, packed or sparse).
         sample_names: data identifiers for column names.
         labels: cluster numbers for row names.
         run_parameters: path to write to consensus_data file (run_parameters["results_directory"]).
+        pipeline: (optional) pipeline_toolbox pipeline to write the consensus matrix in while the
+            silhouette is computed.
 
     Output:
-        consensus_matrix_{method}_{timestamp}_viz.tsv
+        consensus_matrix_{method}_{timestamp}_viz.tsv (.npz, .h5 or .parquet with "output_format")
         silhouette_average_{method}_{timestamp}_viz.tsv
-    """
-    out_df = pd.DataFrame(data=consensus_matrix, columns=sample_names, index=sample_names)
-    out_df.to_csv(get_output_file_name(run_parameters, 'consensus_matrix', 'viz'), sep='\t')
 
-    silhouette_average = silhouette_score(consensus_matrix, labels)
-    silhouette_score_string = 'silhouette number of clusters = %d, corresponding silhouette score = %g' % (
-        run_parameters['number_of_clusters'], silhouette_average)
+    Returns:
+        silhouette_average: silhouette score of the labels.
+    """
+    output_format = rftbx.get_output_format(run_parameters)
+    consensus_file_name = get_output_file_name(run_parameters, 'consensus_matrix', 'viz',
+                                               rftbx.get_output_type_suffix(run_parameters))
+    if output_format == 'tsv':
+        pltbx.submit_stage(pipeline, cmtbx.save_consensus_matrix, consensus_matrix, sample_names, consensus_file_name)
+    else:
+        pltbx.submit_stage(pipeline, rftbx.save_matrix, consensus_matrix, sample_names, sample_names,
+                           consensus_file_name, output_format)
+
+    number_of_samples = cmtbx.get_number_of_samples(consensus_matrix)
+    if cmtbx.get_silhouette_sample_size(run_parameters, number_of_samples) < number_of_samples:
+        silhouette_average, confidence_interval, sample_size = cmtbx.get_silhouette_estimate(
+            consensus_matrix, labels, run_parameters)
+        silhouette_score_string = 'silhouette number of clusters = %d, corresponding silhouette score = %g' \
+                                  ', 95%% confidence interval = [%g, %g] from %d of %d samples' % (
+            run_parameters['number_of_clusters'], silhouette_average, confidence_interval[0],
+            confidence_interval[1], sample_size, number_of_samples)
+    else:
+        silhouette_average = cmtbx.get_silhouette_score(consensus_matrix, labels, run_parameters)
+        silhouette_score_string = 'silhouette number of clusters = %d, corresponding silhouette score = %g' % (
+            run_parameters['number_of_clusters'], silhouette_average)
 
     with open(get_output_file_name(run_parameters, 'silhouette_average', 'viz'), 'w') as fh:
         fh.write(silhouette_score_string)
 
+    return silhouette_average
+
+
+def save_bootstrap_convergence(convergence_df, run_parameters):
+    """ write the adaptive bootstrap convergence trace and the number of bootstraps used.
+
+    Args:
+        convergence_df: from form_consensus_matrix_adaptive.
+        run_parameters: parameter set dictionary.
+
+    Output:
+        bootstrap_convergence_{method}_{timestamp}_viz.tsv
+        number_of_bootstraps_used_{method}_{timestamp}_viz.tsv
+    """
+    convergence_df.to_csv(get_output_file_name(run_parameters, 'bootstrap_convergence', 'viz'), sep='\t')
+
+    if convergence_df.shape[0] > 0:
+        number_of_bootstraps = convergence_df.index[-1]
+        converged = convergence_df['converged'].values[-1]
+    else:
+        number_of_bootstraps = 0
+        converged = False
+    bootstraps_string = 'number of bootstraps used = %d of %d, converged = %s' % (
+        number_of_bootstraps, run_parameters['number_of_bootstraps'], converged)
+
+    with open(get_output_file_name(run_parameters, 'number_of_bootstraps_used', 'viz'), 'w') as fh:
+        fh.write(bootstraps_string)
+
+
+def save_number_of_clusters_sweep(clusterings, sample_names, run_parameters, pipeline=None):
+    """ write the consensus clustering of every k of a "number_of_clusters" sweep and a summary table.
+
+    Args:
+        clusterings: iterable of lists of (cluster_id, sample_permutation), one list per bootstrap.
+        sample_names: data identifiers for column names.
+        run_parameters: parameter set dictionary with a "number_of_clusters" list.
+        pipeline: (optional) pipeline_toolbox pipeline to write the files in.
 
-def save_final_samples_clustering(sample_names, labels, run_parameters):
-    """ wtite .tsv file that assings a cluster number label to the sample_names.
+    Output:
+        consensus_matrix_{method}_k{k}_{timestamp}_viz.tsv
+        silhouette_average_{method}_k{k}_{timestamp}_viz.tsv
+        samples_label_by_cluster_{method}_k{k}_{timestamp}_viz.tsv
+        silhouette_by_number_of_clusters_{method}_{timestamp}_viz.tsv
+    """
+    consensus_matrices = form_consensus_matrices_for_each_k(clusterings, len(sample_names), run_parameters)
+
+    silhouette_list = []
+    for number_of_clusters, consensus_matrix in zip(run_parameters['number_of_clusters'], consensus_matrices):
+        k_parameters = get_number_of_clusters_parameters(run_parameters, number_of_clusters)
+        labels = cmtbx.perform_final_clustering(consensus_matrix, number_of_clusters, run_parameters)
+        save_final_samples_clustering(sample_names, labels, k_parameters, pipeline)
+        silhouette_list.append(save_consensus_clustering(consensus_matrix, sample_names, labels, k_parameters,
+                                                         pipeline))
+
+    summary_df = pd.DataFrame({'silhouette_score': silhouette_list},
+                              index=pd.Index(run_parameters['number_of_clusters'], name='number_of_clusters'))
+    summary_df.to_csv(get_output_file_name(run_parameters, 'silhouette_by_number_of_clusters', 'viz'), sep='\t')
+
+
+def save_final_samples_clustering(sample_names, labels, run_parameters, pipeline=None):
+    """ wtite .tsv file that assings a cluster number label to the sample_names. The phenotype
+        evaluation is a final stage of the pipeline, its permutation pool is forked on the main thread.
 
     Args:
         sample_names: (unique) data identifiers.
         labels: cluster number assignments.
         run_parameters: write path (run_parameters["results_directory"]).
+        pipeline: (optional) pipeline_toolbox pipeline to write the files in.
 
     Output:
         samples_labeled_by_cluster_{method}_{timestamp}_viz.tsv
         phenotypes_labeled_by_cluster_{method}_{timestamp}_viz.tsv
     """
-    cluster_labels_df = kn.create_df_with_sample_labels(sample_names, labels)
     cluster_mapping_full_path = get_output_file_name(run_parameters, 'samples_label_by_cluster', 'viz')
-    cluster_labels_df.to_csv(cluster_mapping_full_path, sep='\t', header=None)
+    pltbx.submit_stage(pipeline, save_samples_label_by_cluster, sample_names, labels, cluster_mapping_full_path)
 
     if 'phenotype_name_full_path' in run_parameters.keys():
         run_parameters['cluster_mapping_full_path'] = cluster_mapping_full_path
-        cluster_eval.clustering_evaluation(run_parameters)
+        pltbx.submit_final_stage(pipeline, cluster_eval.clustering_evaluation, run_parameters)
+
+
+def save_samples_label_by_cluster(sample_names, labels, cluster_mapping_full_path):
+    """ write the cluster number label of each sample.
+
+    Args:
+        sample_names: (unique) data identifiers.
+        labels: cluster number assignments.
+        cluster_mapping_full_path: output file name.
+    """
+    cluster_labels_df = kn.create_df_with_sample_labels(sample_names, labels)
+    cluster_labels_df.to_csv(cluster_mapping_full_path, sep='\t', header=None)
 
 def get_output_file_name(run_parameters, prefix_string, suffix_string='', type_suffix='tsv'):
     """ get the full directory / filename for writing
@@ -448,6 +1777,67 @@ def get_output_file_name(run_parameters, prefix_string, suffix_string='', type_s
     return output_file_name
 
 
+def update_number_of_clusters(run_parameters):
+    """ expand a "number_of_clusters" sweep, given as a list or as a 'first..last' string, to a list of int.
+
+    Args:
+        run_parameters: parameter set dictionary.
+
+    Returns:
+        run_parameters: with "number_of_clusters" an int or a sorted list of unique int.
+    """
+    number_of_clusters = run_parameters['number_of_clusters']
+    if isinstance(number_of_clusters, str) and '..' in number_of_clusters:
+        first_k, last_k = number_of_clusters.split('..')
+        number_of_clusters = list(range(int(first_k), int(last_k) + 1))
+
+    if isinstance(number_of_clusters, (list, tuple)):
+        run_parameters['number_of_clusters'] = sorted(set(int(k) for k in number_of_clusters))
+        if run_parameters['processing_method'] == 'distribute':
+            raise ValueError('number_of_clusters sweep is not available with distribute processing_method.')
+        if use_adaptive_bootstraps(run_parameters):
+            raise ValueError('number_of_clusters sweep is not available with adaptive_bootstraps.')
+    else:
+        run_parameters['number_of_clusters'] = int(number_of_clusters)
+
+    if cmtbx.get_consensus_format(run_parameters) != 'dense' and (
+            is_number_of_clusters_sweep(run_parameters) or use_adaptive_bootstraps(run_parameters)):
+        raise ValueError('consensus_format is only available with a single number_of_clusters without '
+                         'adaptive_bootstraps.')
+
+    return run_parameters
+
+
+def is_number_of_clusters_sweep(run_parameters):
+    """ True when "number_of_clusters" is a list of k to sweep.
+
+    Args:
+        run_parameters: parameter set dictionary.
+
+    Returns:
+        True or False
+    """
+    return isinstance(run_parameters['number_of_clusters'], list)
+
+
+def get_number_of_clusters_parameters(run_parameters, number_of_clusters):
+    """ copy of run_parameters for one k of a sweep, with "_k{k}" appended to the method name of the outputs.
+
+    Args:
+        run_parameters: parameter set dictionary.
+        number_of_clusters: k.
+
+    Returns:
+        k_parameters: parameter set dictionary.
+    """
+    k_parameters = dict(run_parameters)
+    k_parameters['number_of_clusters'] = number_of_clusters
+    if isinstance(run_parameters['number_of_clusters'], list):
+        k_parameters['method'] = '%s_k%d' % (run_parameters['method'], number_of_clusters)
+
+    return k_parameters
+
+
 def update_tmp_directory(run_parameters, tmp_dir):
     ''' Update tmp_directory value in rum_parameters dictionary
 
@@ -467,18 +1857,20 @@ def update_tmp_directory(run_parameters, tmp_dir):
     return run_parameters
 
 
-def form_consensus_matrix_graphic(consensus_matrix, k=3):
+def form_consensus_matrix_graphic(consensus_matrix, k=3, labels=None):
     """ use K-means to reorder the consensus matrix for graphic display.
 
     Args:
         consensus_matrix: calculated consensus matrix in samples x samples order.
         k: number of clusters estimate (inner diminsion k of factored h_matrix).
+        labels: (optional) the final clustering labels, to sort by instead of running K-means again.
 
     Returns:
         cc_cm: consensus_matrix with rows and columns in K-means sort order.
     """
     cc_cm = consensus_matrix.copy()
-    labels = kn.perform_kmeans(consensus_matrix, k)
+    if labels is None:
+        labels = kn.perform_kmeans(consensus_matrix, k)
     sorted_labels = np.argsort(labels)
     cc_cm = cc_cm[sorted_labels[:, None], sorted_labels]
 
@@ -0,0 +1,84 @@
+"""
+@author: The KnowEnG dev team
+"""
+import os
+import numpy as np
+import scipy.sparse as spar
+import knpackage.toolbox as kn
+
+
+def create_shared_directory(run_parameters):
+    """ create the directory that holds the memory-mapped matrices of one run.
+
+    Args:
+        run_parameters: with "run_directory", (optional - "shared_memory_directory", e.g. /dev/shm).
+
+    Returns:
+        shared_dir: new time stamped directory name.
+    """
+    if 'shared_memory_directory' in run_parameters:
+        dir_path = run_parameters['shared_memory_directory']
+    else:
+        dir_path = run_parameters['run_directory']
+
+    return kn.create_dir(dir_path, 'tmp_shared_matrix')
+
+
+def share_matrix(matrix, shared_dir, matrix_name):
+    """ write a read-only dense or sparse matrix once to .npy files that workers memory-map by name.
+
+    Args:
+        matrix: numpy array or scipy sparse matrix (sparse is stored as its CSR parts).
+        shared_dir: directory from create_shared_directory.
+        matrix_name: file name prefix, unique within shared_dir.
+
+    Returns:
+        matrix_handle: (format, path prefix, shape) - small picklable tuple for attach_shared_matrix.
+    """
+    path_prefix = os.path.join(shared_dir, matrix_name)
+    if spar.issparse(matrix):
+        csr_mat = spar.csr_matrix(matrix)
+        np.save(path_prefix + '_data.npy', csr_mat.data)
+        np.save(path_prefix + '_indices.npy', csr_mat.indices)
+        np.save(path_prefix + '_indptr.npy', csr_mat.indptr)
+        return ('csr', path_prefix, csr_mat.shape)
+
+    np.save(path_prefix + '.npy', np.asarray(matrix))
+
+    return ('dense', path_prefix, matrix.shape)
+
+
+def attach_shared_matrix(matrix_handle):
+    """ attach to a matrix written by share_matrix without copying it into the process.
+
+    Args:
+        matrix_handle: (format, path prefix, shape) returned by share_matrix.
+
+    Returns:
+        matrix: read-only memory-mapped numpy array, or CSR matrix over memory-mapped parts.
+    """
+    matrix_format, path_prefix, shape = matrix_handle
+    if matrix_format == 'csr':
+        data = np.load(path_prefix + '_data.npy', mmap_mode='r')
+        indices = np.load(path_prefix + '_indices.npy', mmap_mode='r')
+        indptr = np.load(path_prefix + '_indptr.npy', mmap_mode='r')
+        return spar.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+
+    return np.load(path_prefix + '.npy', mmap_mode='r')
+
+
+def use_shared_memory(run_parameters):
+    """ True when the local parallel path should hand workers memory-mapped matrices.
+
+    Args:
+        run_parameters: with "processing_method", (optional - "parallel_shared_memory").
+
+    Returns:
+        True or False
+    """
+    if run_parameters['processing_method'] != 'parallel':
+        return False
+    if 'parallel_shared_memory' in run_parameters:
+        return bool(run_parameters['parallel_shared_memory'])
+
+    return False
@@ -0,0 +1,71 @@
+import unittest
+from unittest import TestCase
+import numpy as np
+import scipy.sparse as spar
+import knpackage.toolbox as kn
+
+import sample_clustering_toolbox_research_module as tstdata
+import batch_nmf_toolbox as bnmftbx
+
+
+class TestBatch_nmf_toolbox(TestCase):
+    def setUp(self):
+        self.run_parameters = tstdata.get_test_paramters_dictionary()
+        self.run_parameters['number_of_clusters'] = 3
+        self.run_parameters['nmf_penalty_parameter'] = 1400
+        np.random.seed(0)
+        spreadsheet_mat, h_mat = tstdata.get_nmf_sample_data(40, 20, 3)
+        spreadsheet_mat += np.random.rand(40, 20) * 0.1
+        self.x_list = []
+        self.random_states = []
+        for sample in range(0, 6):
+            np.random.seed(sample)
+            x_matrix, sample_permutation = kn.sample_a_matrix(spreadsheet_mat, 1.0, 0.8)
+            self.x_list.append(x_matrix)
+            self.random_states.append(np.random.get_state())
+        self.random_generators = []
+        for random_state in self.random_states:
+            self.random_generators.append(np.random.RandomState())
+            self.random_generators[-1].set_state(random_state)
+
+    def tearDown(self):
+        del self.run_parameters
+        del self.x_list
+        del self.random_states
+        del self.random_generators
+
+    def test_perform_nmf_list(self):
+        h_list = bnmftbx.perform_nmf_list(self.x_list, self.random_generators, self.run_parameters)
+        for x_matrix, random_state, h_batch in zip(self.x_list, self.random_states, h_list):
+            np.random.set_state(random_state)
+            h_matrix = kn.perform_nmf(x_matrix, self.run_parameters)
+            self.assertTrue(np.allclose(h_batch, h_matrix), msg='batched nmf differs')
+
+    def test_perform_net_nmf_list(self):
+        network_mat = spar.csr_matrix(tstdata.synthesize_random_network(self.x_list[0].shape[0], 40))
+        lap_diag, lap_pos = kn.form_network_laplacian_matrix(network_mat)
+        h_list = bnmftbx.perform_nmf_list(self.x_list, self.random_generators, self.run_parameters, lap_diag, lap_pos)
+        for x_matrix, random_state, h_batch in zip(self.x_list, self.random_states, h_list):
+            np.random.set_state(random_state)
+            h_matrix = kn.perform_net_nmf(x_matrix, lap_pos, lap_diag, self.run_parameters)
+            self.assertTrue(np.allclose(h_batch, h_matrix), msg='batched net nmf differs')
+
+    def test_perform_nmf(self):
+        network_mat = spar.csr_matrix(tstdata.synthesize_random_network(self.x_list[0].shape[0], 40))
+        lap_diag, lap_pos = kn.form_network_laplacian_matrix(network_mat)
+        for x_matrix, random_state in zip(self.x_list, self.random_states):
+            np.random.set_state(random_state)
+            h_matrix, iterations = bnmftbx.perform_nmf(x_matrix, self.run_parameters)
+            np.random.set_state(random_state)
+            self.assertTrue(np.array_equal(h_matrix, kn.perform_nmf(x_matrix, self.run_parameters)))
+            self.assertTrue(0 < iterations <= self.run_parameters['nmf_max_iterations'])
+
+            np.random.set_state(random_state)
+            h_matrix, iterations = bnmftbx.perform_nmf(x_matrix, self.run_parameters, lap_diag, lap_pos)
+            np.random.set_state(random_state)
+            self.assertTrue(np.array_equal(h_matrix, kn.perform_net_nmf(x_matrix, lap_pos, lap_diag,
+                                                                         self.run_parameters)))
+            self.assertTrue(0 < iterations <= self.run_parameters['nmf_max_iterations'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+import numpy as np
+
+import checkpoint_toolbox as cptbx
+
+
+class TestCheckpoint_toolbox(TestCase):
+    def setUp(self):
+        self.checkpoint_directory = tempfile.mkdtemp()
+        self.spreadsheet_name = os.path.join(self.checkpoint_directory, 'spreadsheet.tsv')
+        with open(self.spreadsheet_name, 'w') as fh:
+            fh.write('\ts1\ts2\ng1\t1\t2\n')
+        self.run_parameters = {'method': 'cc_nmf', 'processing_method': 'serial', 'number_of_clusters': 3,
+                               'rows_sampling_fraction': 0.8, 'cols_sampling_fraction': 0.8,
+                               'checkpoint_directory': self.checkpoint_directory}
+
+    def tearDown(self):
+        shutil.rmtree(self.checkpoint_directory)
+        del self.run_parameters
+
+    def test_save_and_load_checkpoint(self):
+        run_parameters = cptbx.update_checkpoint_directory(self.run_parameters, 4, [self.spreadsheet_name])
+        self.assertEqual(run_parameters['checkpoint_samples'], [0, 1, 2, 3])
+
+        clustering = (np.array([0, 2, 1]), np.array([4, 0, 3]))
+        sweep_clustering = [(np.array([0, 1, 1]), np.array([1, 2, 3])), (np.array([2, 0, 1]), np.array([1, 2, 3]))]
+        cptbx.save_checkpoint(clustering, run_parameters, 1)
+        cptbx.save_checkpoint(sweep_clustering, run_parameters, 3)
+
+        checkpoint_dir = run_parameters['checkpoint_run_directory']
+        cluster_id, sample_permutation = cptbx.load_checkpoint(checkpoint_dir, 1)
+        self.assertTrue(np.array_equal(cluster_id, clustering[0]))
+        self.assertTrue(np.array_equal(sample_permutation, clustering[1]))
+        for loaded, saved in zip(cptbx.load_checkpoint(checkpoint_dir, 3), sweep_clustering):
+            self.assertTrue(np.array_equal(loaded[0], saved[0]))
+            self.assertTrue(np.array_equal(loaded[1], saved[1]))
+        self.assertEqual(sorted(os.listdir(checkpoint_dir)), ['bootstrap_1.npz', 'bootstrap_3.npz'])
+
+        run_parameters = cptbx.update_checkpoint_directory(self.run_parameters, 4, [self.spreadsheet_name])
+        self.assertEqual(run_parameters['checkpoint_samples'], [0, 2])
+        self.assertEqual(len(list(cptbx.get_checkpoint_clusterings(run_parameters, 4))), 2)
+
+    def test_get_checkpoint_hash(self):
+        checkpoint_hash = cptbx.get_checkpoint_hash(self.run_parameters, [self.spreadsheet_name])
+        self.run_parameters['processing_method'] = 'parallel'
+        self.assertEqual(cptbx.get_checkpoint_hash(self.run_parameters, [self.spreadsheet_name]), checkpoint_hash)
+
+        self.run_parameters['number_of_clusters'] = 4
+        self.assertNotEqual(cptbx.get_checkpoint_hash(self.run_parameters, [self.spreadsheet_name]), checkpoint_hash)
+
+        self.run_parameters['number_of_clusters'] = 3
+        with open(self.spreadsheet_name, 'a') as fh:
+            fh.write('g2\t3\t4\n')
+        self.assertNotEqual(cptbx.get_checkpoint_hash(self.run_parameters, [self.spreadsheet_name]), checkpoint_hash)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+from unittest import TestCase
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+import clustering_eval_toolbox as cluster_eval
+
+
+class TestClustering_eval_toolbox(TestCase):
+    def setUp(self):
+        self.cluster_ids = np.random.randint(0, 3, 60)
+        self.trait_mat = np.random.rand(60, 4) + self.cluster_ids[:, None] * 0.2
+        self.trait_mat[0:10, 1] = np.nan
+
+    def tearDown(self):
+        del self.cluster_ids
+        del self.trait_mat
+
+    def test_f_oneway_batch(self):
+        ret_list = cluster_eval.f_oneway_batch(self.cluster_ids, self.trait_mat)
+        for trait in range(0, 4):
+            valid = ~np.isnan(self.trait_mat[:, trait])
+            groups = [self.trait_mat[valid & (self.cluster_ids == i), trait] for i in range(0, 3)]
+            fval, pval = stats.f_oneway(*groups)
+            self.assertEqual(ret_list[trait][2], valid.sum())
+            self.assertAlmostEqual(ret_list[trait][3], fval)
+            self.assertAlmostEqual(ret_list[trait][4], pval)
+
+    def test_f_oneway_one_cluster(self):
+        ret = cluster_eval.f_oneway_batch(np.zeros(60), self.trait_mat)[0]
+        self.assertEqual(ret[5], 'FAIL')
+
+    def test_chisquare(self):
+        category = np.random.choice(['a', 'b', 'c'], 60)
+        ret = cluster_eval.chisquare(pd.DataFrame({'Cluster_ID': self.cluster_ids, 'trait': category}))
+        cont_table = pd.crosstab(self.cluster_ids, category).values
+        chi, pval, dof, expected = stats.chi2_contingency(cont_table)
+        self.assertAlmostEqual(ret[3], chi)
+        self.assertAlmostEqual(ret[4], pval)
+
+    def test_chisquare_batch(self):
+        df_list = [pd.DataFrame({'Cluster_ID': self.cluster_ids, 'trait_0': np.random.choice(['a', 'b', 'c'], 60)}),
+                   pd.DataFrame({'Cluster_ID': self.cluster_ids % 2, 'trait_1': np.random.choice(['a', 'b'], 60)}),
+                   pd.DataFrame({'Cluster_ID': self.cluster_ids, 'trait_2': np.random.choice([1.0, 2.0], 60)}),
+                   pd.DataFrame({'Cluster_ID': np.zeros(60, dtype=int), 'trait_3': np.random.choice(['a', 'b'], 60)})]
+        df_list[2] = df_list[2][self.cluster_ids > 0]
+        ret_list = cluster_eval.chisquare_batch(df_list)
+        for phenotype_df, ret in zip(df_list, ret_list):
+            cont_table = pd.crosstab(phenotype_df.values[:, 0], phenotype_df.values[:, 1]).values
+            chi, pval, dof, expected = stats.chi2_contingency(cont_table)
+            self.assertEqual(ret[1], cont_table.shape[1])
+            self.assertEqual(ret[2], phenotype_df.shape[0])
+            self.assertAlmostEqual(ret[3], chi)
+            self.assertAlmostEqual(ret[4], pval)
+
+    def test_get_permutation_statistics(self):
+        category = np.random.choice(['a', 'b', 'c'], 60)
+        phenotype_df = pd.DataFrame({'Cluster_ID': self.cluster_ids, 'trait': category})
+        permutation_trait = cluster_eval.get_permutation_trait(phenotype_df, cluster_eval.ColumnType.CATEGORICAL)
+        cluster_ix_mat = np.array([permutation_trait[0], permutation_trait[0][::-1]])
+        statistics = cluster_eval.get_permutation_statistics(permutation_trait, cluster_ix_mat)
+        for statistic, cluster_ix in zip(statistics, cluster_ix_mat):
+            chi = stats.chi2_contingency(pd.crosstab(cluster_ix, category).values, correction=False)[0]
+            self.assertAlmostEqual(statistic, chi)
+
+    def test_get_permutation_pvals(self):
+        phenotype_df = pd.DataFrame({'Cluster_ID': self.cluster_ids, 'trait': self.cluster_ids * 10.0})
+        output_dict = {cluster_eval.ColumnType.CONTINUOUS: [phenotype_df]}
+        run_parameters = {'number_of_permutations': 99, 'permutation_block_size': 40, 'parallelism': 2}
+        pval_dict = cluster_eval.get_permutation_pvals(output_dict, run_parameters)
+        self.assertAlmostEqual(pval_dict['trait'], 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+from unittest import TestCase
+import os
+import numpy as np
+from sklearn.metrics import silhouette_score, adjusted_rand_score
+import knpackage.toolbox as kn
+
+import sample_clustering_toolbox as sctbx
+import consensus_matrix_toolbox as cmtbx
+
+
+class TestConsensus_matrix_toolbox(TestCase):
+    def setUp(self):
+        self.number_of_samples = 30
+        self.clusterings = []
+        for sample in range(0, 12):
+            np.random.seed(sample)
+            sample_permutation = np.random.permutation(self.number_of_samples)[0:24]
+            cluster_id = sample_permutation // 10
+            cluster_id[0:3] = np.random.randint(0, 3, 3)
+            self.clusterings.append((cluster_id, sample_permutation))
+        self.consensus_matrix = sctbx.form_consensus_matrix(self.clusterings, self.number_of_samples, {})
+
+    def tearDown(self):
+        del self.clusterings
+        del self.consensus_matrix
+
+    def test_form_packed_consensus_matrix(self):
+        packed_matrix = cmtbx.form_packed_consensus_matrix(self.clusterings, self.number_of_samples, 12, 5)
+        self.assertEqual(packed_matrix.dtype, np.float32)
+        self.assertEqual(cmtbx.get_number_of_samples(packed_matrix), self.number_of_samples)
+        consensus_rows = cmtbx.get_consensus_rows(packed_matrix, 0, self.number_of_samples)
+        self.assertTrue(np.allclose(consensus_rows, self.consensus_matrix), msg='packed consensus differs')
+
+    def test_form_tiled_consensus_matrix(self):
+        tiled_dir = kn.create_dir('.', 'tmp_consensus_matrix')
+        memory_budget = 32 * self.number_of_samples * 4
+        consensus_matrix = cmtbx.form_tiled_consensus_matrix(self.clusterings, self.number_of_samples, 12, tiled_dir,
+                                                             memory_budget, 5)
+        self.assertTrue(isinstance(consensus_matrix, np.memmap))
+        self.assertTrue(np.allclose(consensus_matrix, self.consensus_matrix), msg='tiled consensus differs')
+        self.assertEqual(os.listdir(tiled_dir), ['consensus_matrix.npy'])
+        cmtbx.remove_tiled_consensus_matrix(consensus_matrix)
+        self.assertFalse(os.path.isdir(tiled_dir))
+
+    def test_tiled_consensus_directory(self):
+        run_parameters = {'run_directory': '.', 'number_of_bootstraps': 12, 'consensus_format': 'tiled'}
+        with self.assertRaises(ValueError):
+            with cmtbx.tiled_consensus_directory(run_parameters) as tiled_dir:
+                sctbx.form_consensus_matrix(self.clusterings, self.number_of_samples, run_parameters)
+                self.assertTrue(os.path.isdir(tiled_dir))
+                raise ValueError('run failed')
+        self.assertFalse(os.path.isdir(tiled_dir))
+
+    def test_get_knn_consensus_matrix(self):
+        knn_matrix = cmtbx.get_knn_consensus_matrix(self.consensus_matrix, 5)
+        self.assertTrue((knn_matrix.getnnz(1) <= 5).all())
+        for row in range(0, self.number_of_samples):
+            knn_row = knn_matrix[row].toarray()[0]
+            kept_min = knn_row[knn_row > 0].min()
+            self.assertTrue(np.sum(self.consensus_matrix[row].astype(np.float32) > kept_min) < 5, msg='largest entries not kept')
+
+    def test_packed_kmeans_and_silhouette(self):
+        packed_matrix = cmtbx.form_packed_consensus_matrix(self.clusterings, self.number_of_samples, 12)
+        labels = cmtbx.perform_kmeans(packed_matrix, 3)
+        self.assertEqual(np.unique(labels).size, 3)
+        consensus_rows = cmtbx.get_consensus_rows(packed_matrix, 0, self.number_of_samples)
+        self.assertAlmostEqual(cmtbx.get_silhouette_score(packed_matrix, labels),
+                               silhouette_score(consensus_rows, labels), places=5)
+
+    def test_get_silhouette_score_consensus_distance(self):
+        labels = np.arange(0, self.number_of_samples) // 10
+        distance_matrix = 1 - self.consensus_matrix
+        np.fill_diagonal(distance_matrix, 0)
+        expected_score = silhouette_score(distance_matrix, labels, metric='precomputed')
+        packed_matrix = cmtbx.form_packed_consensus_matrix(self.clusterings, self.number_of_samples, 12)
+        for consensus_matrix in [self.consensus_matrix, packed_matrix]:
+            self.assertAlmostEqual(cmtbx.get_silhouette_score(consensus_matrix, labels,
+                                                              {'silhouette_distance': 'consensus'}),
+                                   expected_score, places=5)
+
+    def test_get_silhouette_estimate(self):
+        labels = np.arange(0, self.number_of_samples) // 10
+        run_parameters = {'silhouette_sample_size': 12}
+        silhouette_average, confidence_interval, sample_size = cmtbx.get_silhouette_estimate(
+            self.consensus_matrix, labels, run_parameters)
+        self.assertEqual(sample_size, 12)
+        self.assertTrue(confidence_interval[0] <= silhouette_average <= confidence_interval[1])
+
+        run_parameters['silhouette_sample_size'] = self.number_of_samples
+        silhouette_average, confidence_interval, sample_size = cmtbx.get_silhouette_estimate(
+            self.consensus_matrix, labels, run_parameters)
+        self.assertAlmostEqual(silhouette_average, silhouette_score(self.consensus_matrix, labels))
+        self.assertAlmostEqual(confidence_interval[0], confidence_interval[1])
+
+    def test_perform_final_clustering_spectral(self):
+        run_parameters = {'final_clustering': 'spectral'}
+        packed_matrix = cmtbx.form_packed_consensus_matrix(self.clusterings, self.number_of_samples, 12)
+        knn_matrix = cmtbx.get_knn_consensus_matrix(self.consensus_matrix, 10)
+        expected_labels = np.arange(0, self.number_of_samples) // 10
+        for consensus_matrix in [self.consensus_matrix, packed_matrix, knn_matrix]:
+            labels = cmtbx.perform_final_clustering(consensus_matrix, 3, run_parameters)
+            self.assertEqual(adjusted_rand_score(expected_labels, labels), 1.0, msg='spectral labels differ')
+
+        graphic_matrix = sctbx.form_consensus_matrix_graphic(self.consensus_matrix, 3, expected_labels)
+        self.assertEqual(np.abs(graphic_matrix - self.consensus_matrix).sum(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import shutil
+import unittest
+from unittest import TestCase
+import numpy as np
+import pandas as pd
+import knpackage.toolbox as kn
+
+import sample_clustering_toolbox_research_module as tstdata
+import data_cache_toolbox as dctbx
+
+
+class TestData_cache_toolbox(TestCase):
+    def setUp(self):
+        self.run_parameters = tstdata.get_test_paramters_dictionary()
+        self.run_parameters["input_cache"] = True
+        self.run_parameters["input_cache_directory"] = kn.create_dir('.', 'tmp_input_cache')
+        self.network_name = os.path.join(self.run_parameters["input_cache_directory"], 'TEST_1_gene_gene.edge')
+        shutil.copyfile('../../data/networks/TEST_1_gene_gene.edge', self.network_name)
+
+    def tearDown(self):
+        shutil.rmtree(self.run_parameters["input_cache_directory"])
+        del self.run_parameters
+
+    def test_get_network_matrices(self):
+        network_mats = dctbx.form_network_matrices(self.network_name)
+        dctbx.get_network_matrices(self.network_name, self.run_parameters)
+        cached_mats = dctbx.get_network_matrices(self.network_name, self.run_parameters)
+
+        self.assertTrue(isinstance(cached_mats[0].data.base.base, np.memmap))
+        self.assertEqual(network_mats[3], cached_mats[3])
+        for network_part, cached_part in zip(network_mats[0:3], cached_mats[0:3]):
+            self.assertEqual(np.abs(network_part - cached_part).sum(), 0, msg='cached network differs')
+
+    def test_network_cache_rebuilt(self):
+        dctbx.get_network_matrices(self.network_name, self.run_parameters)
+        with open(self.network_name, 'a') as fh:
+            fh.write('g1\tg5\t1\n')
+        network_mats = dctbx.get_network_matrices(self.network_name, self.run_parameters)
+
+        cache_list = [f for f in os.listdir(self.run_parameters["input_cache_directory"]) if f.endswith('.network')]
+        self.assertEqual(len(cache_list), 1)
+        self.assertEqual(network_mats[0].nnz, dctbx.form_network_matrices(self.network_name)[0].nnz)
+
+    def test_get_spreadsheet_df(self):
+        spreadsheet_name = os.path.join(self.run_parameters["input_cache_directory"], 'spreadsheet.tsv')
+        spreadsheet_mat = tstdata.get_wide_3_cluster_spreadsheet(3)
+        mixed_mat = pd.DataFrame(spreadsheet_mat, columns=['s%d' % (c) for c in range(9)])
+        mixed_mat['s0'] = np.int_(mixed_mat['s0'])
+        for gene_names, spreadsheet_df in [(['g1', 'g2', 'g3'], pd.DataFrame(np.int_(spreadsheet_mat))),
+                                           ([101, 102, 103], pd.DataFrame(spreadsheet_mat)),
+                                           (['g1', 'g2', 'g3'], mixed_mat)]:
+            spreadsheet_df.index = gene_names
+            spreadsheet_df.columns = ['s%d' % (c) for c in range(9)]
+            spreadsheet_df.to_csv(spreadsheet_name, sep='\t')
+            self.run_parameters["input_cache"] = False
+            uncached_df = dctbx.get_spreadsheet_df(spreadsheet_name, self.run_parameters)
+            self.run_parameters["input_cache"] = True
+            dctbx.get_spreadsheet_df(spreadsheet_name, self.run_parameters)
+            cached_df = dctbx.get_spreadsheet_df(spreadsheet_name, self.run_parameters)
+
+            self.assertTrue(cached_df.equals(uncached_df), msg='cached spreadsheet differs')
+            self.assertEqual(cached_df.index.dtype, uncached_df.index.dtype)
+            self.assertEqual(cached_df.columns.dtype, uncached_df.columns.dtype)
+        self.assertTrue(kn.get_spreadsheet_df(spreadsheet_name).equals(uncached_df))
+
+    def test_get_spreadsheet_df_memory_mapped(self):
+        spreadsheet_name = os.path.join(self.run_parameters["input_cache_directory"], 'spreadsheet.tsv')
+        pd.DataFrame(tstdata.get_wide_3_cluster_spreadsheet(3), index=['g1', 'g2', 'g3'],
+                     columns=['s%d' % (c) for c in range(9)]).to_csv(spreadsheet_name, sep='\t')
+        dctbx.get_spreadsheet_df(spreadsheet_name, self.run_parameters)
+        cached_df = dctbx.get_spreadsheet_df(spreadsheet_name, self.run_parameters)
+
+        self.assertTrue(cached_df.values.flags.f_contiguous)
+        self.assertEqual(cached_df.values.dtype, np.float64)
+
+if __name__ == '__main__':
+    unittest.main()
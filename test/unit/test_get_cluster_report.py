@@ -0,0 +1,37 @@
+import unittest
+from unittest import TestCase
+import numpy as np
+import pandas as pd
+
+import sample_clustering_toolbox as sctbx
+
+
+class TestGet_cluster_report(TestCase):
+    def setUp(self):
+        self.spreadsheet_mat = np.random.rand(20, 9)
+        self.labels = np.array([2, 0, 0, 2, 1, 1, 0, 2, 2])
+
+    def tearDown(self):
+        del self.spreadsheet_mat
+        del self.labels
+
+    def test_get_cluster_report(self):
+        spreadsheet_df = pd.DataFrame(self.spreadsheet_mat)
+        cluster_report = sctbx.get_cluster_report(self.spreadsheet_mat, self.spreadsheet_mat, self.labels, 5)
+
+        self.assertTrue(np.array_equal(cluster_report['cluster_numbers'], [0, 1, 2]))
+        for cluster_number in range(0, 3):
+            cluster_averages = spreadsheet_df.iloc[:, self.labels == cluster_number].mean(axis=1).values
+            self.assertTrue(np.allclose(cluster_report['cluster_averages'][:, cluster_number], cluster_averages))
+            top_genes = np.zeros(20)
+            top_genes[np.argsort(cluster_averages)[::-1][0:5]] = 1
+            self.assertTrue(np.array_equal(cluster_report['top_genes'][:, cluster_number], top_genes))
+        self.assertTrue(np.allclose(cluster_report['variance'], spreadsheet_df.var(axis=1).values))
+
+    def test_get_cluster_report_all_genes(self):
+        cluster_report = sctbx.get_cluster_report(self.spreadsheet_mat, self.spreadsheet_mat, self.labels, 100)
+        self.assertEqual(cluster_report['top_genes'].sum(), 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+from unittest import TestCase
+
+import parallelism_toolbox as prtbx
+
+
+class TestParallelism_toolbox(TestCase):
+    def setUp(self):
+        self.run_parameters = {'method': 'cc_nmf', 'processing_method': 'parallel', 'number_of_clusters': 3,
+                               'rows_sampling_fraction': 0.8, 'cols_sampling_fraction': 0.8,
+                               'parallel_shared_memory': True, 'memory_budget': 2 ** 20}
+        self.get_number_of_cores = prtbx.get_number_of_cores
+        prtbx.get_number_of_cores = lambda: 64
+
+    def tearDown(self):
+        prtbx.get_number_of_cores = self.get_number_of_cores
+        del self.run_parameters
+
+    def test_get_parallelism_plan(self):
+        plan = prtbx.get_parallelism_plan(self.run_parameters, 200, (20000, 500))
+        self.assertEqual(plan['processes'], 64)
+        self.assertEqual(plan['blas_threads'], 1)
+
+        plan = prtbx.get_parallelism_plan(self.run_parameters, 8, (20000, 500))
+        self.assertEqual(plan['processes'], 8)
+        self.assertEqual(plan['blas_threads'], 8)
+
+        plan = prtbx.get_parallelism_plan(self.run_parameters, 8, (100, 50))
+        self.assertEqual(plan['blas_threads'], 1)
+
+        self.run_parameters['parallelism'] = 4
+        self.run_parameters['nmf_batch_size'] = 4
+        plan = prtbx.get_parallelism_plan(self.run_parameters, 100, (20000, 500))
+        self.assertEqual(plan['jobs'], 25)
+        self.assertEqual(plan['processes'], 4)
+        self.assertEqual(plan['blas_threads'], 16)
+        self.assertTrue(plan['processes'] * plan['blas_threads'] <= plan['cores'])
+
+    def test_get_memory_estimate(self):
+        parent_bytes, worker_bytes = prtbx.get_memory_estimate(self.run_parameters, 100, (1000, 100))
+        self.assertEqual(parent_bytes, 8 * 1000 * 100 + 3 * 8 * 100 ** 2)
+        self.assertEqual(worker_bytes, 8 * (3 * 1000 * 80 + 2 * (1000 + 80) * 3))
+
+        self.run_parameters['method'] = 'cc_net_nmf'
+        self.run_parameters['parallel_shared_memory'] = False
+        self.run_parameters['consensus_format'] = 'packed'
+        net_parent_bytes, net_worker_bytes = prtbx.get_memory_estimate(self.run_parameters, 100, (1000, 100), 5000)
+        self.assertTrue(net_parent_bytes < parent_bytes + prtbx.get_network_bytes(1000, 5000))
+        self.assertEqual(net_worker_bytes, 8 * (6 * 1000 * 80 + 2 * (1000 + 80) * 3) + 8 * 1000 * 100 +
+                         prtbx.get_network_bytes(1000, 5000))
+
+    def test_memory_budget(self):
+        parent_bytes, worker_bytes = prtbx.get_memory_estimate(self.run_parameters, 100, (1000, 100))
+        self.run_parameters['memory_budget'] = (parent_bytes + 5 * worker_bytes) / float(2 ** 20)
+        plan = prtbx.get_parallelism_plan(self.run_parameters, 100, (1000, 100))
+        self.assertEqual(plan['memory_processes'], 5)
+        self.assertEqual(plan['processes'], 5)
+
+        self.run_parameters['memory_budget'] = 1
+        plan = prtbx.get_parallelism_plan(self.run_parameters, 100, (1000, 100))
+        self.assertEqual(plan['processes'], 1)
+        self.assertTrue('warning' in prtbx.get_parallelism_plan_text(plan, self.run_parameters))
+
+    def test_update_parallelism_plan(self):
+        self.run_parameters['processing_method'] = 'serial'
+        run_parameters = prtbx.update_parallelism_plan(self.run_parameters, 8, (100, 50))
+        self.assertIsNone(prtbx.get_blas_threads(run_parameters))
+
+        self.run_parameters['processing_method'] = 'threads'
+        run_parameters = prtbx.update_parallelism_plan(self.run_parameters, 8, (100, 50))
+        self.assertEqual(prtbx.get_blas_threads(run_parameters), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import time
+import threading
+import unittest
+from unittest import TestCase
+
+import pipeline_toolbox as pltbx
+
+
+def append_after(stage_list, stage_name, seconds):
+    time.sleep(seconds)
+    stage_list.append(stage_name)
+    return stage_name
+
+
+def append_thread(stage_list):
+    stage_list.append(threading.current_thread())
+
+
+def raise_value_error():
+    raise ValueError('stage failed')
+
+
+class TestPipeline_toolbox(TestCase):
+    def setUp(self):
+        self.run_parameters = {'pipelined_execution': True, 'pipeline_threads': 2}
+
+    def tearDown(self):
+        del self.run_parameters
+
+    def test_run_pipeline(self):
+        stage_list = []
+        with pltbx.run_pipeline(self.run_parameters) as pipeline:
+            slow_future = pltbx.submit_stage(pipeline, append_after, stage_list, 'slow', 0.2)
+            pltbx.submit_stage(pipeline, append_after, stage_list, 'fast', 0)
+            stage_list.append('main')
+        self.assertEqual(slow_future.result(), 'slow')
+        self.assertEqual(stage_list[-1], 'slow')
+        self.assertEqual(sorted(stage_list), ['fast', 'main', 'slow'])
+
+    def test_run_pipeline_serial(self):
+        stage_list = []
+        with pltbx.run_pipeline({}) as pipeline:
+            self.assertIsNone(pipeline)
+            pltbx.submit_stage(pipeline, append_after, stage_list, 'first', 0.1)
+            stage_list.append('main')
+        self.assertEqual(stage_list, ['first', 'main'])
+
+    def test_final_stage(self):
+        stage_list = []
+        with pltbx.run_pipeline(self.run_parameters) as pipeline:
+            pltbx.submit_final_stage(pipeline, append_thread, stage_list)
+            pltbx.submit_stage(pipeline, append_after, stage_list, 'slow', 0.2)
+            self.assertEqual(stage_list, [])
+        self.assertEqual(stage_list, ['slow', threading.current_thread()])
+
+        with pltbx.run_pipeline({}) as pipeline:
+            pltbx.submit_final_stage(pipeline, stage_list.append, 'serial')
+            self.assertEqual(stage_list[-1], 'serial')
+
+    def test_stage_error(self):
+        stage_list = []
+        with self.assertRaises(ValueError):
+            with pltbx.run_pipeline(self.run_parameters) as pipeline:
+                pltbx.submit_stage(pipeline, raise_value_error)
+                pltbx.submit_stage(pipeline, append_after, stage_list, 'slow', 0.2)
+                pltbx.submit_final_stage(pipeline, stage_list.append, 'final')
+        self.assertEqual(stage_list, ['slow'])
+
+
+if __name__ == '__main__':
+    unittest.main()
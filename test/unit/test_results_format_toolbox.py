@@ -0,0 +1,83 @@
+import os
+import shutil
+import unittest
+from unittest import TestCase
+import numpy as np
+import pandas as pd
+import knpackage.toolbox as kn
+
+import results_format_toolbox as rftbx
+import consensus_matrix_toolbox as cmtbx
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class TestResults_format_toolbox(TestCase):
+    def setUp(self):
+        self.results_dir = kn.create_dir('.', 'tmp_results_format')
+        self.sample_names = np.array(['s%d' % (i) for i in range(0, 7)])
+        consensus_matrix = np.random.rand(7, 7)
+        self.consensus_matrix = np.float32((consensus_matrix + consensus_matrix.T) / 2)
+        np.fill_diagonal(self.consensus_matrix, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.results_dir)
+
+    def test_get_output_format(self):
+        self.assertEqual(rftbx.get_output_format({}), 'tsv')
+        self.assertEqual(rftbx.get_output_type_suffix({'output_format': 'hdf5'}), 'h5')
+        self.assertRaises(ValueError, rftbx.get_output_format, {'output_format': 'xls'})
+
+    def test_npz_to_tsv(self):
+        tsv_name = os.path.join(self.results_dir, 'consensus_matrix.tsv')
+        cmtbx.save_consensus_matrix(self.consensus_matrix, self.sample_names, tsv_name)
+        tsv_df = pd.read_csv(tsv_name, sep='\t', index_col=0)
+
+        packed_matrix = self.consensus_matrix[np.triu_indices(7)]
+        for consensus_matrix in [self.consensus_matrix, packed_matrix]:
+            npz_name = os.path.join(self.results_dir, 'consensus_matrix.npz')
+            rftbx.save_matrix(consensus_matrix, self.sample_names, self.sample_names, npz_name, 'npz')
+            matrix, row_names, column_names = rftbx.load_matrix(npz_name)
+            self.assertTrue(np.array_equal(row_names, self.sample_names))
+            self.assertTrue(np.array_equal(matrix, consensus_matrix))
+
+            rftbx.save_tsv(npz_name, os.path.join(self.results_dir, 'converted.tsv'))
+            converted_df = pd.read_csv(os.path.join(self.results_dir, 'converted.tsv'), sep='\t', index_col=0)
+            self.assertTrue(converted_df.equals(tsv_df), msg='converted tsv differs')
+
+    def binary_to_tsv(self, output_format):
+        tsv_name = os.path.join(self.results_dir, 'consensus_matrix.tsv')
+        cmtbx.save_consensus_matrix(self.consensus_matrix, self.sample_names, tsv_name)
+        tsv_df = pd.read_csv(tsv_name, sep='\t', index_col=0)
+
+        packed_matrix = self.consensus_matrix[np.triu_indices(7)]
+        binary_name = os.path.join(self.results_dir, 'consensus_matrix.' + rftbx.OUTPUT_TYPE_SUFFIX[output_format])
+        for consensus_matrix in [self.consensus_matrix, packed_matrix]:
+            rftbx.save_matrix(consensus_matrix, self.sample_names, self.sample_names, binary_name, output_format)
+            matrix, row_names, column_names = rftbx.load_matrix(binary_name)
+            self.assertTrue(np.array_equal(row_names, self.sample_names))
+            self.assertTrue(np.array_equal(column_names, self.sample_names))
+            self.assertTrue(np.array_equal(matrix, self.consensus_matrix))
+
+            rftbx.save_tsv(binary_name, os.path.join(self.results_dir, 'converted.tsv'))
+            converted_df = pd.read_csv(os.path.join(self.results_dir, 'converted.tsv'), sep='\t', index_col=0)
+            self.assertTrue(converted_df.equals(tsv_df), msg='converted tsv differs')
+
+    @unittest.skipUnless(h5py is not None, 'h5py is not installed')
+    def test_hdf5_to_tsv(self):
+        self.binary_to_tsv('hdf5')
+
+    @unittest.skipUnless(pyarrow is not None, 'pyarrow is not installed')
+    def test_parquet_to_tsv(self):
+        self.binary_to_tsv('parquet')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,9 @@
+import os
+import sys
+import types
+import inspect
 import unittest
+from functools import partial
 from unittest import TestCase
 import numpy as np
 import knpackage.toolbox as kn
@@ -7,6 +12,18 @@ import sample_clustering_toolbox_research_module as tstdata
 import sample_clustering_toolbox as sctbx
 
 
+def get_node_module(node_function, dependency_list):
+    """ module holding only the node function and the functions of its dependency_list, as on a dispy
+        compute node (the modules of the list are imported by the node code itself). """
+    node_module = types.ModuleType('dispy_node')
+    sys.modules['dispy_node'] = node_module
+    for dependency in [node_function] + dependency_list:
+        if not inspect.ismodule(dependency):
+            exec(inspect.getsource(dependency), node_module.__dict__)
+
+    return node_module
+
+
 class TestRun_nmf_clusters_worker(TestCase):
     def setUp(self):
         self.run_parameters = tstdata.get_test_paramters_dictionary()
@@ -26,12 +43,11 @@ class TestRun_nmf_clusters_worker(TestCase):
         spreadsheet_consensus_mat = tstdata.get_square_3_cluster_spreadsheet(cluster_rows)
         spreadsheet_mat = tstdata.get_wide_3_cluster_spreadsheet(cluster_rows)
 
+        clusterings = []
         for sample in range(0, int(self.run_parameters['number_of_bootstraps'])):
-            sctbx.run_cc_nmf_clusters_worker(spreadsheet_mat, self.run_parameters, sample)
+            clusterings.append(sctbx.run_cc_nmf_clusters_worker(spreadsheet_mat, self.run_parameters, sample))
 
-        linkage_matrix = np.zeros((spreadsheet_mat.shape[1], spreadsheet_mat.shape[1]))
-        indicator_matrix = np.zeros((spreadsheet_mat.shape[1], spreadsheet_mat.shape[1]))
-        consensus_matrix = sctbx.form_consensus_matrix(self.run_parameters, linkage_matrix, indicator_matrix)
+        consensus_matrix = sctbx.form_consensus_matrix(clusterings, spreadsheet_mat.shape[1], self.run_parameters)
         consensus_matrix[consensus_matrix != 0] = 1
         consensus_matrix = np.int_(consensus_matrix)
 
@@ -39,5 +55,102 @@ class TestRun_nmf_clusters_worker(TestCase):
         cluster_difference = cluster_difference.sum()
         self.assertEqual(cluster_difference, 0, msg='nmf clustering failed')
 
+    def test_find_cc_nmf_clusters_threads(self):
+        self.run_parameters['processing_method'] = 'threads'
+        self.run_parameters['parallelism'] = 3
+        np.random.seed(0)
+        spreadsheet_mat, h_mat = tstdata.get_nmf_sample_data(40, 20, 3)
+        spreadsheet_mat += np.random.rand(40, 20) * 0.1
+
+        clusterings = list(sctbx.find_cc_nmf_clusters_threads(spreadsheet_mat, self.run_parameters, 6))
+        for sample in range(0, 6):
+            cluster_id, sample_permutation = sctbx.run_cc_nmf_clusters_worker(spreadsheet_mat, self.run_parameters,
+                                                                              sample)
+            matches = [np.array_equal(sample_permutation, permutation) and np.array_equal(cluster_id, thread_id)
+                       for thread_id, permutation in clusterings]
+            self.assertTrue(any(matches), msg='threads clustering differs')
+
+    def test_run_cc_nmf_clusters_batch_sweep(self):
+        np.random.seed(0)
+        spreadsheet_mat, h_mat = tstdata.get_nmf_sample_data(40, 20, 3)
+        spreadsheet_mat += np.random.rand(40, 20) * 0.1
+
+        self.run_parameters['number_of_clusters'] = [2, 3]
+        sweep_clusterings = sctbx.run_cc_nmf_clusters_batch(spreadsheet_mat, self.run_parameters, [0, 1, 2])
+        for k_index, number_of_clusters in enumerate([2, 3]):
+            self.run_parameters['number_of_clusters'] = number_of_clusters
+            k_clusterings = sctbx.run_cc_nmf_clusters_batch(spreadsheet_mat, self.run_parameters, [0, 1, 2])
+            for sweep_clustering, (cluster_id, sample_permutation) in zip(sweep_clusterings, k_clusterings):
+                self.assertTrue(np.array_equal(sweep_clustering[k_index][0], cluster_id), msg='sweep labels differ')
+                self.assertTrue(np.array_equal(sweep_clustering[k_index][1], sample_permutation))
+
+    def test_get_resumed_clusterings(self):
+        closed = []
+
+        def new_clusterings():
+            try:
+                for sample in range(2, 10):
+                    yield sample
+            finally:
+                closed.append(True)
+
+        clusterings = sctbx.get_resumed_clusterings(iter([0, 1]), new_clusterings())
+        self.assertEqual([next(clusterings) for sample in range(0, 4)], [0, 1, 2, 3])
+        clusterings.close()
+        self.assertEqual(closed, [True])
+
+    def test_find_and_save_cc_nmf_clusters_parallel_on_node(self):
+        self.run_parameters['processing_method'] = 'distribute'
+        self.run_parameters['cluster_shared_volumn'] = self.run_parameters['run_directory']
+        self.run_parameters['parallelism'] = 2
+        np.random.seed(0)
+        spreadsheet_mat, h_mat = tstdata.get_nmf_sample_data(40, 20, 3)
+        spreadsheet_mat += np.random.rand(40, 20) * 0.1
+
+        try:
+            node_module = get_node_module(sctbx.find_and_save_cc_nmf_clusters_parallel,
+                                          sctbx.get_distribute_dependency_list('cc_nmf'))
+            node_module.find_and_save_cc_nmf_clusters_parallel(spreadsheet_mat, self.run_parameters, 4)
+        finally:
+            del sys.modules['dispy_node']
+        tmp_files = os.listdir(self.run_parameters['tmp_directory'])
+        self.assertEqual(sorted(tmp_f for tmp_f in tmp_files if tmp_f.startswith('tmp_h_')),
+                         ['tmp_h_0', 'tmp_h_1', 'tmp_h_2', 'tmp_h_3'])
+
+    def test_schedule_bootstraps(self):
+        self.run_parameters['processing_method'] = 'threads'
+        np.random.seed(0)
+        spreadsheet_mat, h_mat = tstdata.get_nmf_sample_data(40, 20, 3)
+        spreadsheet_mat += np.random.rand(40, 20) * 0.1
+
+        bootstrap_log = []
+        clusterings = list(sctbx.find_cc_nmf_clusters_threads(spreadsheet_mat, self.run_parameters, 4, bootstrap_log))
+        self.assertEqual(len(clusterings), 4)
+        self.assertEqual(sorted(row[0] for row in bootstrap_log), [0, 1, 2, 3])
+        for sample, runtime, nmf_iterations, batch_size in bootstrap_log:
+            self.assertTrue(runtime >= 0)
+            self.assertTrue(0 < nmf_iterations <= self.run_parameters['nmf_max_iterations'])
+            self.assertEqual(batch_size, 1)
+
+    def test_schedule_bootstraps_serial(self):
+        self.run_parameters['processing_method'] = 'serial'
+        np.random.seed(0)
+        spreadsheet_mat, h_mat = tstdata.get_nmf_sample_data(40, 20, 3)
+        spreadsheet_mat += np.random.rand(40, 20) * 0.1
+
+        bootstrap_log = []
+        worker = partial(sctbx.run_cc_nmf_clusters_worker, spreadsheet_mat, self.run_parameters)
+        clusterings = list(sctbx.schedule_bootstraps(worker, range(0, 4), 1, 'serial', bootstrap_log))
+        for sample, clustering in enumerate(clusterings):
+            unlogged_clustering = sctbx.run_cc_nmf_clusters_worker(spreadsheet_mat, self.run_parameters, sample)
+            self.assertTrue(np.array_equal(clustering[0], unlogged_clustering[0]))
+            self.assertTrue(np.array_equal(clustering[1], unlogged_clustering[1]))
+        self.assertEqual([row[0] for row in bootstrap_log], [0, 1, 2, 3])
+        self.assertEqual(len(set(row[1] for row in bootstrap_log)), 4)
+        for sample, runtime, nmf_iterations, batch_size in bootstrap_log:
+            self.assertTrue(runtime > 0)
+            self.assertTrue(0 < nmf_iterations <= self.run_parameters['nmf_max_iterations'])
+            self.assertEqual(batch_size, 1)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+from unittest import TestCase, mock
+import numpy as np
+import scipy.sparse as spar
+import knpackage.toolbox as kn
+
+import sample_clustering_toolbox_research_module as tstdata
+import rwr_toolbox as rwrtbx
+
+
+class TestRwr_toolbox(TestCase):
+    def setUp(self):
+        self.run_parameters = tstdata.get_test_paramters_dictionary()
+        np.random.seed(0)
+        network_mat = tstdata.synthesize_random_network(40, 80) + np.eye(40, k=1) + np.eye(40, k=-1)
+        self.network_mat = kn.normalize_sparse_mat_by_diagonal(spar.csr_matrix(network_mat))
+        self.spreadsheet_mat = np.random.rand(40, 12)
+
+    def tearDown(self):
+        del self.run_parameters
+
+    def test_direct_solver_matches_power(self):
+        smooth_power, step = rwrtbx.smooth_matrix_with_rwr(self.spreadsheet_mat, self.network_mat, self.run_parameters)
+        self.run_parameters['rwr_solver'] = 'direct'
+        smooth_direct, step = rwrtbx.smooth_matrix_with_rwr(self.spreadsheet_mat, self.network_mat, self.run_parameters)
+
+        tolerance = 10 * self.run_parameters['rwr_convergence_tolerence']
+        self.assertLess(np.linalg.norm(smooth_power - smooth_direct), tolerance, msg='direct rwr differs')
+
+    def test_factor_reused(self):
+        alpha = self.run_parameters['rwr_restart_probability']
+        rwr_factor = rwrtbx.get_rwr_factor(self.network_mat, alpha)
+        self.assertTrue(rwrtbx.get_rwr_factor(self.network_mat.copy(), alpha) is rwr_factor)
+        rwrtbx.clear_rwr_factor_cache()
+        self.assertFalse(rwrtbx.RWR_FACTOR_CACHE)
+
+    def test_update_rwr_network_fingerprint(self):
+        self.run_parameters = rwrtbx.update_rwr_network_fingerprint(self.run_parameters, self.network_mat)
+        self.assertFalse('rwr_network_fingerprint' in self.run_parameters)
+        self.run_parameters['rwr_solver'] = 'direct'
+        self.run_parameters = rwrtbx.update_rwr_network_fingerprint(self.run_parameters, self.network_mat)
+        self.assertEqual(self.run_parameters['rwr_network_fingerprint'], rwrtbx.get_network_fingerprint(self.network_mat))
+
+        smooth_direct, step = rwrtbx.smooth_matrix_with_rwr(self.spreadsheet_mat, self.network_mat, self.run_parameters)
+        with mock.patch.object(rwrtbx, 'get_network_fingerprint', side_effect=AssertionError('network hashed')):
+            smooth_copy, step = rwrtbx.smooth_matrix_with_rwr(self.spreadsheet_mat, self.network_mat.copy(),
+                                                              self.run_parameters)
+        self.assertTrue(np.array_equal(smooth_direct, smooth_copy))
+        rwrtbx.clear_rwr_factor_cache()
+
+    def test_sample_a_smoothed_matrix(self):
+        smooth_mat, step = rwrtbx.smooth_matrix_with_rwr(self.spreadsheet_mat, self.network_mat, self.run_parameters)
+        for rows_fraction in [1.0, 0.8]:
+            np.random.seed(3)
+            sample_mat, sample_permutation = kn.sample_a_matrix(self.spreadsheet_mat.copy(), rows_fraction, 0.8)
+            np.random.seed(3)
+            smooth_random, smooth_permutation = rwrtbx.sample_a_smoothed_matrix(
+                self.spreadsheet_mat, smooth_mat, rows_fraction, 0.8)
+
+            self.assertEqual(np.abs(sample_permutation - smooth_permutation).sum(), 0, msg='permutation differs')
+            dropped_rows = sample_mat.sum(axis=1) == 0
+            self.assertEqual(np.abs(smooth_random[dropped_rows, :]).sum(), 0, msg='dropped rows not zero')
+            self.assertEqual(np.abs(smooth_random[~dropped_rows, :] - smooth_mat[~dropped_rows, :][:, sample_permutation]).sum(), 0)
+
+    def test_use_rwr_cache(self):
+        self.assertFalse(rwrtbx.use_rwr_cache(self.run_parameters))
+        self.run_parameters['rwr_smoothing_cache'] = True
+        self.assertFalse(rwrtbx.use_rwr_cache(self.run_parameters))
+        self.run_parameters['rwr_cache_row_sampling'] = 'after_smoothing'
+        self.assertTrue(rwrtbx.use_rwr_cache(self.run_parameters))
+
+if __name__ == '__main__':
+    unittest.main()
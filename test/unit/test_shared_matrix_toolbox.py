@@ -0,0 +1,46 @@
+import unittest
+from unittest import TestCase
+import numpy as np
+import scipy.sparse as spar
+import knpackage.toolbox as kn
+
+import sample_clustering_toolbox_research_module as tstdata
+import shared_matrix_toolbox as shmtbx
+
+
+class TestShared_matrix_toolbox(TestCase):
+    def setUp(self):
+        self.run_parameters = tstdata.get_test_paramters_dictionary()
+        self.run_parameters["run_directory"] = '.'
+        self.shared_dir = shmtbx.create_shared_directory(self.run_parameters)
+
+    def tearDown(self):
+        kn.remove_dir(self.shared_dir)
+        del self.run_parameters
+
+    def test_share_dense_matrix(self):
+        spreadsheet_mat = tstdata.get_wide_3_cluster_spreadsheet(3)
+        matrix_handle = shmtbx.share_matrix(spreadsheet_mat, self.shared_dir, 'spreadsheet_mat')
+        shared_mat = shmtbx.attach_shared_matrix(matrix_handle)
+
+        self.assertTrue(isinstance(shared_mat, np.memmap))
+        self.assertEqual(np.abs(shared_mat - spreadsheet_mat).sum(), 0, msg='dense matrix changed')
+
+    def test_share_sparse_matrix(self):
+        network_mat = spar.csr_matrix(tstdata.synthesize_random_network(20, 40))
+        lap_diag, lap_pos = kn.form_network_laplacian_matrix(network_mat)
+        for matrix_name, matrix in [('network_mat', network_mat), ('lap_diag', lap_diag), ('lap_pos', lap_pos)]:
+            matrix_handle = shmtbx.share_matrix(matrix, self.shared_dir, matrix_name)
+            shared_mat = shmtbx.attach_shared_matrix(matrix_handle)
+            self.assertEqual(np.abs(shared_mat - matrix).sum(), 0, msg='%s changed' % (matrix_name))
+
+    def test_use_shared_memory(self):
+        self.run_parameters['processing_method'] = 'parallel'
+        self.assertFalse(shmtbx.use_shared_memory(self.run_parameters))
+        self.run_parameters['parallel_shared_memory'] = True
+        self.assertTrue(shmtbx.use_shared_memory(self.run_parameters))
+        self.run_parameters['processing_method'] = 'serial'
+        self.assertFalse(shmtbx.use_shared_memory(self.run_parameters))
+
+if __name__ == '__main__':
+    unittest.main()
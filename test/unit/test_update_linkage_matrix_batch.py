@@ -0,0 +1,74 @@
+import unittest
+from unittest import TestCase
+import numpy as np
+import knpackage.toolbox as kn
+
+import sample_clustering_toolbox as sctbx
+
+
+class TestUpdate_linkage_matrix_batch(TestCase):
+    def setUp(self):
+        self.number_of_samples = 30
+        self.clusterings = []
+        for sample in range(0, 12):
+            np.random.seed(sample)
+            sample_permutation = np.random.permutation(self.number_of_samples)[0:24]
+            cluster_id = np.random.randint(0, 4, sample_permutation.size)
+            self.clusterings.append((cluster_id, sample_permutation))
+
+    def tearDown(self):
+        del self.clusterings
+
+    def test_update_linkage_matrix_batch(self):
+        linkage_matrix = np.zeros((self.number_of_samples, self.number_of_samples))
+        indicator_matrix = linkage_matrix.copy()
+        for cluster_id, sample_permutation in self.clusterings:
+            linkage_matrix = kn.update_linkage_matrix(cluster_id, sample_permutation, linkage_matrix)
+            indicator_matrix = kn.update_indicator_matrix(sample_permutation, indicator_matrix)
+
+        for batch_size in [1, 5, 12]:
+            linkage_batch = np.zeros((self.number_of_samples, self.number_of_samples))
+            indicator_batch = linkage_batch.copy()
+            linkage_batch, indicator_batch = sctbx.get_linkage_matrix(
+                self.clusterings, linkage_batch, indicator_batch, batch_size)
+
+            self.assertEqual(np.abs(linkage_batch - linkage_matrix).sum(), 0, msg='linkage differs')
+            self.assertEqual(np.abs(indicator_batch - indicator_matrix).sum(), 0, msg='indicator differs')
+
+    def test_form_consensus_matrices_for_each_k(self):
+        run_parameters = {'number_of_clusters': [2, 3], 'consensus_batch_size': 5}
+        sweep_clusterings = [[clustering, (clustering[0] % 2, clustering[1])] for clustering in self.clusterings]
+        consensus_matrices = sctbx.form_consensus_matrices_for_each_k(
+            sweep_clusterings, self.number_of_samples, run_parameters)
+
+        for k_index in range(0, 2):
+            k_clusterings = [clusterings_list[k_index] for clusterings_list in sweep_clusterings]
+            consensus_matrix = sctbx.form_consensus_matrix(k_clusterings, self.number_of_samples, run_parameters)
+            self.assertEqual(np.abs(consensus_matrices[k_index] - consensus_matrix).sum(), 0,
+                             msg='consensus differs')
+
+    def test_form_consensus_matrix_adaptive(self):
+        run_parameters = {'bootstrap_check_window': 5, 'consensus_tolerance': 2.0}
+        consensus_matrix, convergence_df = sctbx.form_consensus_matrix_adaptive(
+            iter(self.clusterings), self.number_of_samples, run_parameters)
+        self.assertEqual(list(convergence_df.index), [5, 10])
+        self.assertTrue(convergence_df['converged'].values[-1])
+        expected_matrix = sctbx.form_consensus_matrix(self.clusterings[0:10], self.number_of_samples, run_parameters)
+        self.assertEqual(np.abs(consensus_matrix - expected_matrix).sum(), 0, msg='consensus differs')
+
+        run_parameters['consensus_tolerance'] = -1.0
+        consensus_matrix, convergence_df = sctbx.form_consensus_matrix_adaptive(
+            iter(self.clusterings), self.number_of_samples, run_parameters)
+        self.assertEqual(list(convergence_df.index), [5, 10, 12])
+        self.assertFalse(convergence_df['converged'].any())
+
+    def test_update_number_of_clusters(self):
+        run_parameters = {'number_of_clusters': '2..4', 'processing_method': 'serial'}
+        self.assertEqual(sctbx.update_number_of_clusters(run_parameters)['number_of_clusters'], [2, 3, 4])
+        run_parameters = {'number_of_clusters': 3, 'processing_method': 'distribute'}
+        self.assertEqual(sctbx.update_number_of_clusters(run_parameters)['number_of_clusters'], 3)
+        run_parameters = {'number_of_clusters': [4, 2], 'processing_method': 'distribute'}
+        self.assertRaises(ValueError, sctbx.update_number_of_clusters, run_parameters)
+
+if __name__ == '__main__':
+    unittest.main()